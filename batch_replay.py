@@ -0,0 +1,107 @@
+import json
+import queue
+import threading
+import time
+
+from services.log_pipeline import log
+
+# records buffered between the reader, workers and writer, this bounds memory use
+QUEUE_SIZE = 1024
+
+_DONE = object()
+
+
+def parse_record(line):
+    # a record looks like {"session": "...", "command": "withdraw", "args": ["80"]}, optionally with a "terminal"
+    # and a "request" ID that makes replaying the same record twice harmless. Returns None if it doesn't
+    try:
+        record = json.loads(line)
+        options = {'session_id': str(record['session'])}
+        if 'terminal' in record:
+            options['terminal_id'] = str(record['terminal'])
+        if 'request' in record:
+            options['request_id'] = str(record['request'])
+        return str(record['command']), [str(arg) for arg in record.get('args', [])], options
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def run_record(handler, line_number, record):
+    if record is None:
+        return {'line': line_number, 'error': 'Invalid record.'}
+
+    command, args, options = record
+    try:
+        result = handler(command, *args, **options)
+    except Exception:
+        log.exception('Command failed', line=line_number, command=command, session_id=options['session_id'])
+        result = 'Unable to process your request at this time.'
+    return {'line': line_number, 'session': options['session_id'], 'command': command, 'result': str(result)}
+
+
+def iter_records(input_file):
+    for line_number, line in enumerate(input_file, start=1):
+        if line.strip():
+            yield line_number, parse_record(line)
+
+
+# streams a JSONL file of commands through handler (main.process_command) and writes one JSONL result per record.
+# With several workers, records are sharded by session so each session still sees its commands in order,
+# while results from different sessions may be written interleaved.
+def replay(input_file, output_file, handler, workers=1):
+    started = time.perf_counter()
+    count = 0
+
+    if workers <= 1:
+        for line_number, record in iter_records(input_file):
+            output_file.write(json.dumps(run_record(handler, line_number, record)) + '\n')
+            count += 1
+        return replay_report(count, started)
+
+    results = queue.Queue(QUEUE_SIZE)
+    shards = [queue.Queue(QUEUE_SIZE) for _ in range(workers)]
+
+    def work(shard):
+        while True:
+            item = shard.get()
+            if item is _DONE:
+                results.put(_DONE)
+                return
+            results.put(run_record(handler, *item))
+
+    def write():
+        finished = 0
+        while finished < workers:
+            result = results.get()
+            if result is _DONE:
+                finished += 1
+                continue
+            output_file.write(json.dumps(result) + '\n')
+
+    threads = [threading.Thread(target=work, args=(shard,), daemon=True) for shard in shards]
+    writer = threading.Thread(target=write, daemon=True)
+    for thread in threads:
+        thread.start()
+    writer.start()
+
+    for line_number, record in iter_records(input_file):
+        # invalid records all go to the first shard and are reported from there
+        shard = hash(record[2]['session_id']) % workers if record else 0
+        shards[shard].put((line_number, record))
+        count += 1
+    for shard in shards:
+        shard.put(_DONE)
+
+    for thread in threads:
+        thread.join()
+    writer.join()
+    return replay_report(count, started)
+
+
+def replay_report(count, started):
+    elapsed = time.perf_counter() - started
+    return {
+        'records': count,
+        'seconds': elapsed,
+        'records_per_second': count / elapsed if elapsed else 0.0
+    }
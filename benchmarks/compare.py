@@ -0,0 +1,37 @@
+import argparse
+import json
+
+
+def load_timings(path):
+    with open(path, 'r') as report_file:
+        report = json.load(report_file)
+    return report.get('revision'), {(result['accounts'], name): timing
+                                    for result in report['results']
+                                    for name, timing in result['operations'].items()}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=1.2, help='p50 ratio reported as a regression')
+    options = parser.parse_args()
+
+    baseline_revision, baseline = load_timings(options.baseline)
+    candidate_revision, candidate = load_timings(options.candidate)
+    print(f'baseline {baseline_revision}  candidate {candidate_revision}')
+
+    regressions = 0
+    for key in sorted(baseline.keys() & candidate.keys()):
+        ratio = candidate[key]['p50_ns'] / max(baseline[key]['p50_ns'], 1)
+        flag = ''
+        if ratio >= options.threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        accounts, name = key
+        print(f'{accounts:>8} {name:<56} {ratio:>6.2f}x{flag}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main_cli())
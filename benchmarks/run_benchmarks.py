@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import timeit
+import types
+
+import main
+from services.account_store import AccountStore
+from services.atm_service import AtmService
+from services.authorization_service import AuthorizationService
+from services.credentials import hash_pin
+from services.log_pipeline import log
+from services.metrics import Metrics
+from services.transaction_history import AccountHistory
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+# events per account: most accounts are quiet, a few are busy
+HISTORY_LENGTHS = [0, 2, 5, 20, 200]
+HISTORY_WEIGHTS = [30, 35, 25, 9, 1]
+SECONDS_PER_EVENT = 6 * 60 * 60
+# PIN key derivation dominates authorize, so fewer calls give stable percentiles
+AUTHORIZE_REPEAT = 200
+
+
+def build_population(size, seed=0):
+    # fresh singletons populated with `size` synthetic accounts and their history
+    rng = random.Random(seed)
+    AtmService._instance = None
+    AuthorizationService._instance = None
+    atm_service = AtmService()
+    authorization_service = AuthorizationService()
+
+    account_ids = [f'{number:010d}' for number in range(size)]
+    balances = {}
+    histories = {}
+    pins = {}
+    now = int(time.time())
+    for account_id in account_ids:
+        balance_cents = rng.randrange(0, 1000000)
+        history = AccountHistory()
+        length = rng.choices(HISTORY_LENGTHS, HISTORY_WEIGHTS)[0]
+        running = balance_cents
+        start = now - length * SECONDS_PER_EVENT
+        for event in range(length):
+            amount = rng.choice((-2000, -6000, 5000, 12550))
+            running += amount
+            history.append(start + event * SECONDS_PER_EVENT, amount, running)
+        balances[account_id] = running / 100
+        histories[account_id] = history
+        pins[account_id] = f'{rng.randrange(10000):04d}'
+
+    atm_service.account_balances = AccountStore(balances)
+    atm_service.transaction_history = histories
+    atm_service.atm_balance = 10 ** 9
+    main.atm_service = atm_service
+    main.authorization_service = authorization_service
+    return atm_service, authorization_service, account_ids, pins
+
+
+def time_operation(operation, arguments, repeat):
+    # per-call latency percentiles over a cycle of pre-built arguments
+    samples = []
+    for index in range(repeat):
+        started = time.perf_counter_ns()
+        operation(*arguments[index % len(arguments)])
+        samples.append(time.perf_counter_ns() - started)
+    samples.sort()
+    return {
+        'calls': repeat,
+        'mean_ns': sum(samples) / repeat,
+        'p50_ns': samples[repeat // 2],
+        'p99_ns': samples[min(repeat * 99 // 100, repeat - 1)]
+    }
+
+
+def run_size(size, repeat, seed):
+    started = time.perf_counter()
+    atm_service, authorization_service, account_ids, pins = build_population(size, seed)
+    build_seconds = time.perf_counter() - started
+
+    rng = random.Random(seed + 1)
+    sample = [rng.choice(account_ids) for _ in range(min(repeat, 1000))]
+    # the busiest account shows history costs for long-lived accounts
+    busiest = max(account_ids[:10000], key=lambda account_id: len(atm_service.transaction_history[account_id]))
+    sessions = [f'bench-{number}' for number in range(len(sample))]
+    # only sampled accounts log in, hashing every PIN would make building large populations take minutes
+    authorization_service.account_information = {account_id: hash_pin(pins[account_id]) for account_id in set(sample)}
+    for session_id, account_id in zip(sessions, sample):
+        authorization_service.authorize(account_id, pins[account_id], session_id)
+
+    operations = {
+        'AtmService.withdraw': (atm_service.withdraw, [(account_id, 20) for account_id in sample]),
+        'AtmService.deposit': (atm_service.deposit, [(account_id, 20.0) for account_id in sample]),
+        'AtmService.get_balance': (atm_service.get_balance, [(account_id,) for account_id in sample]),
+        'AtmService.get_history_by_account_id': (atm_service.get_history_by_account_id,
+                                                 [(account_id,) for account_id in sample]),
+        'AtmService.get_history_by_account_id[busiest]': (atm_service.get_history_by_account_id,
+                                                          [(busiest,)]),
+        'AtmService.get_history_by_account_id[busiest, page 20]': (atm_service.get_history_by_account_id,
+                                                                   [(busiest, 20)]),
+        'AuthorizationService.authorize': (authorization_service.authorize,
+                                           [(account_id, pins[account_id], session_id)
+                                            for session_id, account_id in zip(sessions, sample)]),
+        'main.process_command[balance]': (
+            lambda session_id: main.process_command('balance', session_id=session_id),
+            [(session_id,) for session_id in sessions]),
+        'main.process_command[withdraw]': (
+            lambda session_id: main.process_command('withdraw', '20', session_id=session_id),
+            [(session_id,) for session_id in sessions])
+    }
+
+    repeats = {name: repeat for name in operations}
+    repeats['AuthorizationService.authorize'] = min(repeat, AUTHORIZE_REPEAT)
+    results = {name: time_operation(operation, arguments, repeats[name])
+               for name, (operation, arguments) in operations.items()}
+    return {
+        'accounts': size,
+        'history_events': sum(len(history) for history in atm_service.transaction_history.values()),
+        'busiest_history_events': len(atm_service.transaction_history[busiest]),
+        'build_seconds': build_seconds,
+        'operations': results
+    }
+
+
+def _command(command, *args):
+    return command
+
+
+def _timing_wrapper(function):
+    # the least any timing wrapper costs: forwarding the call and reading the clock twice
+    clock = time.perf_counter_ns
+
+    def timed(*args, **kwargs):
+        started = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            clock() - started
+    return timed
+
+
+def metrics_overhead(calls=20000, rounds=15):
+    # ns per call of a trivial command function: plain, behind a bare timing wrapper, and instrumented by
+    # metrics with a fixed label or labelled by command like main.process_command. Variants are interleaved
+    # and the fastest round of each is kept, which is the least noisy estimate on a busy machine
+    variants = {'plain_ns': _command, 'timing_wrapper_ns': _timing_wrapper(_command)}
+    for name, label in (('instrumented_ns', None), ('labelled_ns', lambda command, *args: command)):
+        variants[name] = Metrics().instrument(types.SimpleNamespace(call=_command), 'call', 'bench_seconds', label)
+
+    best = dict.fromkeys(variants, float('inf'))
+    for _ in range(rounds):
+        for name, function in variants.items():
+            seconds = timeit.timeit(lambda: function('balance', '1'), number=calls)
+            best[name] = min(best[name], seconds / calls * 1e9)
+    return best
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Service layer benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='account population sizes')
+    parser.add_argument('--repeat', type=int, default=2000, help='calls timed per operation')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_output.json', help='machine readable results')
+    parser.add_argument('--with-logging', action='store_true', help='include service logging in the timings')
+    options = parser.parse_args()
+
+    # the service logs through the structured pipeline, which discards everything until started
+    log_directory = tempfile.TemporaryDirectory() if options.with_logging else None
+    if log_directory:
+        log.start(os.path.join(log_directory.name, 'atm_service.log'))
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': int(time.time()),
+        'results': []
+    }
+    for size in options.sizes:
+        result = run_size(size, options.repeat, options.seed)
+        report['results'].append(result)
+        print(f"{size} accounts ({result['history_events']} history events, built in {result['build_seconds']:.1f}s)")
+        for name, timing in result['operations'].items():
+            print(f"  {name:<56} p50 {timing['p50_ns'] / 1000:>9.1f}us  p99 {timing['p99_ns'] / 1000:>9.1f}us")
+
+    if log_directory:
+        log.stop()
+        log_directory.cleanup()
+
+    overhead = report['metrics_overhead'] = metrics_overhead()
+    print(f"metrics: instrumented call +{overhead['instrumented_ns'] - overhead['plain_ns']:.0f}ns, "
+          f"with a label +{overhead['labelled_ns'] - overhead['plain_ns']:.0f}ns, "
+          f"bare timing wrapper +{overhead['timing_wrapper_ns'] - overhead['plain_ns']:.0f}ns")
+
+    with open(options.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main_cli()
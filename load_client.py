@@ -0,0 +1,77 @@
+import argparse
+import asyncio
+import json
+import time
+
+# (account_id, pin) pairs the default account data ships with
+ACCOUNTS = [
+    ('2859459814', '7386'),
+    ('1434597300', '4557'),
+    ('7089382418', '0075'),
+    ('2001377812', '5950')
+]
+COMMANDS = ['balance', 'deposit 20', 'withdraw 20', 'history 5']
+
+
+async def run_terminal(host, port, terminal_number, requests, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    account_id, pin = ACCOUNTS[terminal_number % len(ACCOUNTS)]
+
+    async def send(line):
+        started = time.perf_counter()
+        writer.write(line.encode() + b'\n')
+        await writer.drain()
+        response = await reader.readline()
+        latencies.append(time.perf_counter() - started)
+        return json.loads(response)
+
+    await send(f'authorize {account_id} {pin}')
+    for request_number in range(requests):
+        await send(COMMANDS[request_number % len(COMMANDS)])
+
+    writer.write(b'end\n')
+    await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+async def run_load(host, port, terminals, requests):
+    latencies = []
+    started = time.perf_counter()
+    await asyncio.gather(*(run_terminal(host, port, terminal_number, requests, latencies)
+                           for terminal_number in range(terminals)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'seconds': elapsed,
+        'requests_per_second': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load generator for the ATM server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8023)
+    parser.add_argument('--terminals', type=int, default=50, help='concurrent connections')
+    parser.add_argument('--requests', type=int, default=200, help='commands sent per connection')
+    options = parser.parse_args()
+
+    report = asyncio.run(run_load(options.host, options.port, options.terminals, options.requests))
+    print(f"{report['requests']} requests in {report['seconds']:.2f}s: "
+          f"{report['requests_per_second']:.0f} req/s, "
+          f"p50 {report['p50_ms']:.2f}ms, p99 {report['p99_ms']:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,50 +1,274 @@
+import argparse
+import math
+import os
+import signal
+import sys
+import time
+from datetime import datetime
+
+from batch_replay import replay
+from server import serve
+from shard_router import ShardRouter
+from services.atm_fleet import DEFAULT_TERMINAL
 from services.atm_service import AtmService
-from services.authorization_service import AuthorizationService
+from services.authorization_service import DEFAULT_SESSION, AuthorizationService
+from services.ledger import Ledger
+from services.log_pipeline import log
+from services.metrics import metrics
+from services.money import from_cents
+from services.profiler import profiler
+from services.sqlite_repository import SqliteRepository
 
 authorization_service = AuthorizationService()
 atm_service = AtmService()
 
+DEFAULT_HISTORY_PAGE_SIZE = 20
+HISTORY_USAGE = 'Usage: history [page_size] [cursor]'
+HISTORY_LAST_USAGE = 'Usage: history last <days>'
+COMMANDS = {'authorize', 'logout', 'withdraw', 'deposit', 'balance', 'history'}
+
+
+# session_id identifies the login session issuing the command and terminal_id the machine it runs on,
+# the interactive terminal uses the defaults. source is where a network connection comes from, its peer
+# address: failed logins are throttled per source and terminal, or per session without either.
+# A command line may start with a request ID, e.g. `@a1b2 withdraw 80`: retrying a withdrawal or deposit
+# with the same ID returns the first response instead of moving money again
+def process_command(command, *args, session_id=DEFAULT_SESSION, terminal_id=DEFAULT_TERMINAL, request_id=None,
+                    source=None):
+    if command.startswith('@') and args:
+        request_id = command[1:]
+        command, *args = args
+
+    # terminals are registered by loading them with cash, see --load-cash and --load-notes
+    if terminal_id not in atm_service.fleet.terminals:
+        return 'Unknown terminal.'
 
-def process_command(command, *args):
     if command.lower() == 'authorize':
+        # nobody can log in at a terminal with an empty cash drawer
+        if atm_service.fleet.is_out_of_service(terminal_id):
+            return 'Out of service.'
         try:
             account_id = args[0]
             pin = args[1]
-            return authorization_service.authorize(account_id, pin)
+            # a peer that reconnects keeps its address, so a new session doesn't start its failure count over,
+            # and terminals behind one gateway share an address but not a count
+            if source is not None or terminal_id != DEFAULT_TERMINAL:
+                source = (source, terminal_id)
+            return authorization_service.authorize(account_id, pin, session_id, source)
         except (ValueError, IndexError) as e:
             return 'Authorization failed.'
     elif command.lower() == 'logout':
-        return authorization_service.logout()
+        return authorization_service.logout(session_id)
 
     # no account has been logged into
-    account_id = authorization_service.get_active_account_id()
+    account_id = authorization_service.get_active_account_id(session_id)
     if not account_id:
         return 'Authorization Required.'
 
     # don't allow accounts to continue running commands after 2 minutes of inactivity
-    is_login_active = authorization_service.is_authorization_active()
+    is_login_active = authorization_service.is_authorization_active(session_id)
     if not is_login_active:
         return 'Your login has time out. Please reauthorize.'
 
     # if we have an active account logged in we should refresh their activity tracker
-    authorization_service.refresh_activity(account_id)
+    authorization_service.refresh_activity(account_id, session_id)
 
     # user commands that require an authorized and active account
     if command.lower() == 'withdraw':
         value = args[0]
-        return atm_service.withdraw(account_id, int(value))
+        return atm_service.withdraw(account_id, int(value), terminal_id, request_id)
     elif command.lower() == 'deposit':
         value = args[0]
-        return atm_service.deposit(account_id, float(value))
+        return atm_service.deposit(account_id, float(value), request_id)
     elif command.lower() == 'balance':
         return atm_service.get_balance(account_id)
     elif command.lower() == 'history':
-        return atm_service.get_history_by_account_id(account_id)
+        # history today | history last <days>
+        if args and args[0].lower() == 'today':
+            start_of_today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            return atm_service.get_history_since(account_id, int(start_of_today.timestamp()))
+        if args and args[0].lower() == 'last':
+            if len(args) != 2 or not args[1].isdigit():
+                return HISTORY_LAST_USAGE
+            days = int(args[1])
+            if days <= 0:
+                return 'Please enter a number of days greater than zero.'
+            return atm_service.get_history_since(account_id, int(time.time()) - days * 24 * 60 * 60)
+
+        # history [page_size] [cursor]
+        try:
+            page_size = int(args[0]) if args else DEFAULT_HISTORY_PAGE_SIZE
+        except ValueError:
+            return HISTORY_USAGE
+        if page_size <= 0:
+            return 'Please enter a page size greater than zero.'
+        cursor = args[1] if len(args) > 1 else None
+        return atm_service.get_history_by_account_id(account_id, page_size, cursor)
     else:
         return 'Command not recognized. Please try again.'
 
 
+def command_label(command, *args):
+    # keeps metric labels bounded no matter what terminals send
+    if command in COMMANDS:
+        return command  # the usual case, checked first since this runs on every instrumented command
+    if command.startswith('@') and args:
+        command = args[0]
+    command = command.lower()
+    return command if command in COMMANDS else 'unknown'
+
+
+def enable_metrics(port):
+    metrics.enable()
+    metrics.instrument(sys.modules[__name__], 'process_command', 'atm_command_seconds', command_label)
+    for method in ('withdraw', 'deposit', 'get_balance', 'get_history_by_account_id'):
+        metrics.instrument(AtmService, method, 'atm_service_seconds')
+    for method in ('authorize', 'logout', 'is_authorization_active'):
+        metrics.instrument(AuthorizationService, method, 'atm_service_seconds')
+    # the fleet keeps its aggregates current on every drawer change, so a scrape just reads them
+    metrics.gauge('atm_terminals', 'Registered terminals.', lambda: len(atm_service.fleet.terminals))
+    metrics.gauge('atm_cash_dollars', 'Cash in every terminal\'s drawer.',
+                  lambda: from_cents(atm_service.fleet.total_cash))
+    metrics.gauge('atm_terminals_low_cash', 'Terminals below their refill threshold.',
+                  lambda: len(atm_service.fleet.low_cash))
+    metrics.gauge('atm_terminals_out_of_service', 'Terminals with an empty drawer.',
+                  lambda: len(atm_service.fleet.out_of_service))
+    return metrics.serve(port)
+
+
+def enable_profiling(directory, sample_rate):
+    # profiles a sample of sessions into directory, SIGUSR1 stops and writes the profiles or starts again
+    profiler.instrument(sys.modules[__name__], 'process_command', command_label,
+                        lambda *args, session_id=DEFAULT_SESSION, **kwargs: session_id)
+    profiler.start(directory, sample_rate)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: write_profiles(profiler.toggle()))
+
+
+def write_profiles(paths):
+    for path in paths:
+        log.info('Profile written', path=path)
+
+
+def parse_cash_load(value):
+    # TERMINAL=AMOUNT, e.g. lobby=5000
+    terminal_id, _, amount = value.partition('=')
+    try:
+        amount = float(amount)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected TERMINAL=AMOUNT, got {value!r}')
+    if not terminal_id or not math.isfinite(amount) or amount <= 0:
+        raise argparse.ArgumentTypeError(f'expected TERMINAL=AMOUNT, got {value!r}')
+    return terminal_id, amount
+
+
+def parse_notes_load(value):
+    # TERMINAL=DENOMINATION:NOTES,..., e.g. lobby=20:100,50:40
+    terminal_id, _, cassettes = value.partition('=')
+    try:
+        notes = {int(denomination): int(count)
+                 for denomination, count in (cassette.split(':') for cassette in cassettes.split(','))}
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected TERMINAL=DENOMINATION:NOTES,..., got {value!r}')
+    if not terminal_id or any(denomination <= 0 or count <= 0 for denomination, count in notes.items()):
+        raise argparse.ArgumentTypeError(f'expected TERMINAL=DENOMINATION:NOTES,..., got {value!r}')
+    return terminal_id, notes
+
+
 def main():
+    parser = argparse.ArgumentParser(description='ATM program')
+    parser.add_argument('--data-dir', help='directory for the durable transaction ledger')
+    parser.add_argument('--database', help='SQLite database holding accounts and history, instead of --data-dir')
+    parser.add_argument('--log-file', default='atm_service.log', help='structured JSON lines log, rotated by size')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics at http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--profile-dir', help='profile a sample of sessions, writing pstats files per command here')
+    parser.add_argument('--profile-sample', type=float, default=0.01,
+                        help='fraction of sessions profiled when serving or replaying, the interactive session '
+                             'is always profiled')
+    parser.add_argument('--serve', action='store_true', help='serve many terminals over TCP instead of stdin')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8023)
+    parser.add_argument('--max-in-flight', type=int, default=256, help='commands processed at once when serving')
+    parser.add_argument('--shards', type=int, help='partition accounts across this many worker processes')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='threads processing commands when serving or replaying')
+    parser.add_argument('--load-cash', metavar='TERMINAL=AMOUNT', type=parse_cash_load, action='append', default=[],
+                        help='add cash to a terminal\'s drawer at startup, registering the terminal if it is new')
+    parser.add_argument('--load-notes', metavar='TERMINAL=DENOMINATION:NOTES,...', type=parse_notes_load,
+                        action='append', default=[],
+                        help='add notes to a terminal\'s cassettes at startup, registering the terminal if it is new')
+    parser.add_argument('--batch', metavar='INPUT', help='replay a JSONL file of {session, command, args} records')
+    parser.add_argument('--output', help='JSONL file for batch results, defaults to stdout')
+    options = parser.parse_args()
+    if options.data_dir and options.database:
+        parser.error('--data-dir and --database are alternatives')
+    if options.shards and (options.data_dir or options.database):
+        parser.error('--shards keeps accounts in memory, it can\'t be combined with --data-dir or --database')
+
+    log.start(options.log_file)
+    if options.metrics_port:
+        enable_metrics(options.metrics_port)
+    if options.profile_dir:
+        # the interactive terminal is a single session, sampling it would mostly profile nothing
+        interactive = not (options.serve or options.batch)
+        enable_profiling(options.profile_dir, 1.0 if interactive else options.profile_sample)
+
+    # accounts live in the shard processes, which process_command reaches through the router
+    global atm_service
+    router = None
+    if options.shards:
+        router = ShardRouter(options.shards, options.log_file)
+        atm_service = router
+
+    # without a data directory all state lives in memory and is lost on exit
+    ledger = None
+    if options.data_dir:
+        ledger = Ledger(options.data_dir)
+        atm_service.attach_ledger(ledger)
+    elif options.database:
+        ledger = SqliteRepository(options.database)
+        authorization_service.load_pins(ledger)
+        atm_service.attach_ledger(ledger)
+
+    # loads are recorded in the ledger like any other, so a restart keeps what was loaded before
+    for terminal_id, amount in options.load_cash:
+        atm_service.load_cash(terminal_id, amount)
+    for terminal_id, notes in options.load_notes:
+        atm_service.load_notes(terminal_id, notes)
+
+    try:
+        if options.serve:
+            serve(process_command, authorization_service.new_session_id, authorization_service.logout,
+                  options.host, options.port, options.max_in_flight, options.workers, atm_service.fleet.terminals)
+        elif options.batch:
+            run_batch(options.batch, options.output, options.workers)
+        else:
+            run_terminal()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if ledger:
+            ledger.close()
+        if router:
+            router.close()
+        if profiler.running:
+            write_profiles(profiler.stop())
+        log.stop()
+
+
+def run_batch(input_path, output_path, workers):
+    output_file = open(output_path, 'w') if output_path else sys.stdout
+    try:
+        with open(input_path, 'r') as input_file:
+            report = replay(input_file, output_file, process_command, workers)
+    finally:
+        if output_path:
+            output_file.close()
+    print(f"Replayed {report['records']} records in {report['seconds']:.2f}s "
+          f"({report['records_per_second']:.0f} records/s)", file=sys.stderr)
+
+
+def run_terminal():
     print('Welcome to my ATM! Please login.')
 
     while True:
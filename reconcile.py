@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+from services.account_snapshot import AccountSnapshot
+from services.ledger import SNAPSHOT_FILENAME
+from services.money import from_cents, to_cents
+from services.transaction_history import WITHDRAWAL
+
+HISTORY_BATCH_ROWS = 65536  # history rows converted to columns at a time
+SELECT_ACCOUNTS = 'SELECT account_id, balance_cents FROM accounts ORDER BY account_id'
+SELECT_HISTORY = 'SELECT account_id, amount_cents, balance_cents, kind, terminal_id FROM history ' \
+                 'ORDER BY account_id, position'
+COUNT_HISTORY = 'SELECT COUNT(*) FROM history'
+SELECT_TERMINALS = 'SELECT terminals.terminal_id, cash_cents, COALESCE(loaded_cents, 0) FROM terminals ' \
+                   'LEFT JOIN cash_loads ON cash_loads.terminal_id = terminals.terminal_id ' \
+                   'ORDER BY terminals.terminal_id'
+
+
+# balances and history as columns, every amount in cents.
+# Account i's events are amounts[offsets[i]:offsets[i + 1]], oldest first. Cash drawers are optional,
+# event_terminals then indexes terminal_ids for every event
+class AuditColumns:
+
+    def __init__(self, ids, balances, offsets, amounts, event_balances, kinds,
+                 terminal_ids=None, terminal_cash=None, terminal_loaded=None, event_terminals=None, orphans=()):
+        self.ids = ids
+        self.balances = balances
+        self.offsets = offsets
+        self.amounts = amounts
+        self.event_balances = event_balances
+        self.kinds = kinds
+        self.terminal_ids = terminal_ids
+        self.terminal_cash = terminal_cash
+        self.terminal_loaded = terminal_loaded
+        self.event_terminals = event_terminals
+        # account ids with history but no account
+        self.orphans = orphans
+
+
+def load_sqlite(path):
+    # everything is read in one WAL read transaction, a consistent view that never blocks the service's writer.
+    # History is streamed in batches into columns allocated up front, so it is never all held as Python rows
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA query_only=ON')
+    try:
+        connection.execute('BEGIN')
+        accounts = connection.execute(SELECT_ACCOUNTS).fetchall()
+        terminals = connection.execute(SELECT_TERMINALS).fetchall()
+        ids = np.array([account_id for account_id, _ in accounts], dtype=str)
+        terminal_ids = np.array([terminal_id for terminal_id, _, _ in terminals], dtype=str)
+
+        (count,) = connection.execute(COUNT_HISTORY).fetchone()
+        rows = np.empty(count, dtype=np.int64)
+        found = np.empty(count, dtype=bool)
+        amounts = np.empty(count, dtype=np.int64)
+        event_balances = np.empty(count, dtype=np.int64)
+        kinds = np.empty(count, dtype=np.int8)
+        event_terminals = np.empty(count, dtype=np.int64)
+        orphans = set()
+        history = connection.execute(SELECT_HISTORY)
+        start = 0
+        while batch := history.fetchmany(HISTORY_BATCH_ROWS):
+            end = start + len(batch)
+            event_accounts, amounts[start:end], event_balances[start:end], kinds[start:end], event_terminal_ids = \
+                zip(*batch)
+            event_accounts = np.array(event_accounts, dtype=str)
+            rows[start:end], found[start:end] = _positions(ids, event_accounts)
+            orphans.update(event_accounts[~found[start:end]].tolist())
+            # events at a terminal that was never registered are counted against index len(terminal_ids)
+            positions, known = _positions(terminal_ids, np.array(event_terminal_ids, dtype=str))
+            positions[~known] = len(terminal_ids)
+            event_terminals[start:end] = positions
+            start = end
+        connection.execute('COMMIT')
+    finally:
+        connection.close()
+
+    # history is ordered by account, so each account's events are the run between its first and last row
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows[found], minlength=len(ids)), out=offsets[1:])
+
+    return AuditColumns(
+        ids, np.fromiter((balance for _, balance in accounts), dtype=np.int64, count=len(accounts)), offsets,
+        amounts[found], event_balances[found], kinds[found],
+        terminal_ids,
+        np.array([cash for _, cash, _ in terminals], dtype=np.int64),
+        np.array([loaded for _, _, loaded in terminals], dtype=np.int64),
+        event_terminals[found], sorted(orphans))
+
+
+def _positions(sorted_ids, values):
+    # each value's index in sorted_ids, and whether it is there at all
+    positions = np.searchsorted(sorted_ids, values)
+    present = positions < len(sorted_ids)
+    present[present] = sorted_ids[positions[present]] == values[present]
+    return positions, present
+
+
+def load_account_snapshot(directory):
+    # the memory-mapped account snapshot of a ledger data directory's latest state. It doesn't include records
+    # logged since, and history there doesn't say which terminal paid out, so drawers aren't audited
+    with open(os.path.join(directory, SNAPSHOT_FILENAME), 'r') as snapshot_file:
+        state = json.load(snapshot_file)['state']
+    if 'accounts' not in state:
+        raise ValueError(f'{directory} has no account snapshot yet')
+    snapshot = AccountSnapshot(os.path.join(directory, state['accounts']))
+    amounts, event_balances, kinds = snapshot.events[1], snapshot.events[2], snapshot.events[3]
+    return AuditColumns(snapshot.ids, np.asarray(snapshot.cents), np.asarray(snapshot.history_offsets),
+                        np.asarray(amounts), np.asarray(event_balances), np.asarray(kinds))
+
+
+# checks, for every account and drawer at once:
+#   history - each event's balance is the previous event's balance plus its amount
+#   balance - the balance is the opening balance plus the signed sum of the account's history, where the
+#             opening balance is the balance before the first event, or the one given in openings
+#   cash - each drawer holds the cash loaded into it less what was dispensed from it
+#   orphan - history belongs to an account that exists
+# Returns a list of discrepancies, each a dict naming the check, the account or terminal and the amounts
+def audit(columns, openings=None):
+    # openings: account_id -> opening balance in dollars, for accounts whose opening balance is known
+    discrepancies = [{'check': 'orphan', 'account_id': account_id} for account_id in columns.orphans]
+    offsets, amounts, event_balances = columns.offsets, columns.amounts, columns.event_balances
+    counts = np.diff(offsets)
+    has_history = counts > 0
+    first = offsets[:-1][has_history]
+
+    # history: compare every event with the one before it, except each account's first
+    chained = np.ones(len(amounts), dtype=bool)
+    chained[first] = False
+    broken = np.flatnonzero(chained & (event_balances != np.roll(event_balances, 1) + amounts))
+    # the account each broken event belongs to
+    for row in np.unique(np.searchsorted(offsets, broken, side='right') - 1):
+        discrepancies.append({'check': 'history', 'account_id': str(columns.ids[row])})
+
+    # balance: sums per account in one pass, accounts without history sum to zero
+    sums = np.zeros(len(columns.ids), dtype=np.int64)
+    if len(amounts):
+        sums[has_history] = np.add.reduceat(amounts, first)
+    opening = columns.balances.copy()  # no history: opening balance and balance are the same
+    opening[has_history] = event_balances[first] - amounts[first]
+    for account_id, balance in (openings or {}).items():
+        row = int(np.searchsorted(columns.ids, account_id))
+        if row < len(columns.ids) and columns.ids[row] == account_id:
+            opening[row] = to_cents(balance)
+    expected = opening + sums
+    for row in np.flatnonzero(expected != columns.balances):
+        discrepancies.append({'check': 'balance', 'account_id': str(columns.ids[row]),
+                              'expected': from_cents(int(expected[row])),
+                              'actual': from_cents(int(columns.balances[row]))})
+
+    # cash: what every drawer dispensed, summed per terminal in one pass
+    if columns.terminal_ids is not None and len(columns.terminal_ids):
+        withdrawals = columns.kinds == WITHDRAWAL
+        dispensed = np.zeros(len(columns.terminal_ids) + 1, dtype=np.int64)
+        np.add.at(dispensed, columns.event_terminals[withdrawals], -amounts[withdrawals])
+        expected_cash = columns.terminal_loaded - dispensed[:-1]
+        for row in np.flatnonzero(expected_cash != columns.terminal_cash):
+            discrepancies.append({'check': 'cash', 'terminal_id': str(columns.terminal_ids[row]),
+                                  'expected': from_cents(int(expected_cash[row])),
+                                  'actual': from_cents(int(columns.terminal_cash[row]))})
+    return discrepancies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile ATM balances, history and cash drawers')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--database', help='SQLite database the ATM runs with')
+    source.add_argument('--data-dir', help='ledger data directory, its latest account snapshot is audited')
+    options = parser.parse_args()
+
+    started = time.perf_counter()
+    columns = load_sqlite(options.database) if options.database else load_account_snapshot(options.data_dir)
+    loaded = time.perf_counter()
+    discrepancies = audit(columns)
+    for discrepancy in discrepancies:
+        print(json.dumps(discrepancy))
+    print(f'Audited {len(columns.ids)} accounts and {len(columns.amounts)} events: '
+          f'{len(discrepancies)} discrepancies (loaded in {loaded - started:.2f}s, '
+          f'checked in {time.perf_counter() - loaded:.2f}s)', file=sys.stderr)
+    sys.exit(1 if discrepancies else 0)
+
+
+if __name__ == '__main__':
+    main()
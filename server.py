@@ -0,0 +1,108 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from services.log_pipeline import log
+
+# longest command line accepted from a terminal
+MAX_LINE_LENGTH = 1024
+
+
+# line protocol: each terminal sends one command per line, e.g. `withdraw 80`,
+# and receives one JSON encoded string per line with the result.
+# A connection may say which terminal it is with `terminal <terminal_id>`, its withdrawals are then paid out of
+# that terminal's drawer instead of the default one
+class AtmServer:
+
+    def __init__(self, handler, new_session_id, end_session, max_in_flight=256, workers=8, terminals=None):
+        # handler(command, *args, session_id=..., source=..., terminal_id=...) is main.process_command,
+        # terminal_id only once the connection has identified its terminal.
+        # terminals: the terminal ids a connection may identify as, any when None
+        self.handler = handler
+        self.new_session_id = new_session_id
+        self.end_session = end_session
+        self.max_in_flight = max_in_flight
+        self.terminals = terminals
+        self.connections = 0
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._server = None
+
+    async def start(self, host='127.0.0.1', port=8023):
+        self._server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_LINE_LENGTH)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        self._executor.shutdown(wait=True)
+
+    async def handle_connection(self, reader, writer):
+        # every connection is its own terminal with its own login session. Failed logins are throttled by the
+        # peer's address and the terminal it names, which a client can't change by reconnecting the way it
+        # gets a new session
+        session_id = self.new_session_id()
+        peer = writer.get_extra_info('peername')
+        options = {'session_id': session_id, 'source': peer[0] if isinstance(peer, tuple) else None}
+        self.connections += 1
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (asyncio.LimitOverrunError, ValueError):
+                    writer.write(json.dumps('Command too long.').encode() + b'\n')
+                    break
+                if not line:
+                    break
+
+                parts = line.decode(errors='replace').split()
+                if not parts:
+                    continue
+                if parts[0].lower() == 'end':
+                    break
+
+                if parts[0].lower() == 'terminal' and len(parts) == 2:
+                    result = self._identify(parts[1], options)
+                else:
+                    # requests beyond max_in_flight wait here, which stops this connection being read
+                    async with self._in_flight:
+                        result = await loop.run_in_executor(self._executor, self._dispatch, parts, options)
+
+                writer.write(json.dumps(str(result)).encode() + b'\n')
+                # backpressure: stop reading from a terminal that isn't reading its responses
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            self.end_session(session_id)
+            writer.close()
+
+    def _identify(self, terminal_id, options):
+        if self.terminals is not None and terminal_id not in self.terminals:
+            return 'Unknown terminal.'
+        options['terminal_id'] = terminal_id
+        return f'Terminal {terminal_id} ready.'
+
+    def _dispatch(self, parts, options):
+        try:
+            return self.handler(parts[0], *parts[1:], **options)
+        except Exception:
+            log.exception('Command failed', command=parts[0], session_id=options['session_id'])
+            return 'Unable to process your request at this time.'
+
+
+def serve(handler, new_session_id, end_session, host='127.0.0.1', port=8023, max_in_flight=256, workers=8,
+          terminals=None):
+    async def run():
+        server = AtmServer(handler, new_session_id, end_session, max_in_flight, workers, terminals)
+        bound_port = await server.start(host, port)
+        print(f'Serving ATM terminals on {host}:{bound_port}')
+        await server.serve_forever()
+
+    asyncio.run(run())
@@ -0,0 +1,101 @@
+import os
+import shutil
+
+import numpy as np
+
+from services.transaction_history import LazyHistories
+
+# a snapshot is a directory with one .npy file per column, all memory-mapped read-only when opened.
+# ids is sorted and indexes the per-account columns, history_offsets[row]:history_offsets[row + 1]
+# is the account's slice of the event columns
+ACCOUNT_COLUMNS = ('ids', 'cents', 'float_display', 'history_offsets')
+EVENT_COLUMNS = ('timestamps', 'amounts', 'balances', 'kinds')
+EVENT_DTYPES = (np.int64, np.int64, np.int64, np.int8)
+
+
+# balances and history for every account, opened in constant time whatever the number of accounts.
+# Lookups binary search the id column, so only the pages they touch are ever read from disk
+class AccountSnapshot:
+
+    def __init__(self, path):
+        self.path = path
+        columns = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+                   for name in ACCOUNT_COLUMNS + EVENT_COLUMNS}
+        self.ids = columns['ids']
+        self.cents = columns['cents']
+        self.float_display = columns['float_display']
+        self.history_offsets = columns['history_offsets']
+        self.events = [columns[name] for name in EVENT_COLUMNS]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return (str(account_id) for account_id in self.ids)
+
+    def find(self, account_id):
+        # row of the account, or None
+        row = int(np.searchsorted(self.ids, account_id))
+        if row < len(self.ids) and self.ids[row] == account_id:
+            return row
+        return None
+
+    def history_columns(self, account_id):
+        # (timestamps, amounts, balances, kinds) views of the account's events, oldest first, or None
+        row = self.find(account_id)
+        if row is None:
+            return None
+        start, end = int(self.history_offsets[row]), int(self.history_offsets[row + 1])
+        return [column[start:end] for column in self.events]
+
+    def history_length(self, account_id):
+        # number of events, 0 for unknown accounts
+        row = self.find(account_id)
+        if row is None:
+            return 0
+        return int(self.history_offsets[row + 1] - self.history_offsets[row])
+
+
+def write_account_snapshot(path, balances, histories):
+    # writes every account in an AccountStore and its history, then atomically moves the directory into place
+    account_ids = sorted(balances)
+    cents, float_display = balances.export(account_ids)
+
+    history_offsets = np.zeros(len(account_ids) + 1, dtype=np.int64)
+    parts = [[] for _ in EVENT_COLUMNS]
+    for row, account_id in enumerate(account_ids):
+        columns = history_columns(histories, account_id)
+        if columns is not None:
+            for part, column in zip(parts, columns):
+                part.append(column)
+        history_offsets[row + 1] = history_offsets[row] + (len(columns[0]) if columns is not None else 0)
+
+    arrays = {
+        'ids': np.array(account_ids, dtype=str),
+        'cents': cents,
+        'float_display': float_display,
+        'history_offsets': history_offsets
+    }
+    for name, dtype, part in zip(EVENT_COLUMNS, EVENT_DTYPES, parts):
+        arrays[name] = np.concatenate(part).astype(dtype, copy=False) if part else np.zeros(0, dtype=dtype)
+
+    temp_path = path + '.tmp'
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    for name, array in arrays.items():
+        with open(os.path.join(temp_path, f'{name}.npy'), 'wb') as column_file:
+            np.save(column_file, array)
+            column_file.flush()
+            os.fsync(column_file.fileno())
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(temp_path, path)
+
+
+def history_columns(histories, account_id):
+    # an account's history columns without loading it, for plain dicts of AccountHistory and LazyHistories alike
+    if isinstance(histories, LazyHistories):
+        return histories.columns(account_id)
+    history = histories.get(account_id)
+    if history is None:
+        return None
+    return [history.timestamps, history.amounts, history.balances, history.kinds]
@@ -0,0 +1,232 @@
+import threading
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from services.money import from_cents, to_cents
+
+# rows are allocated in fixed size blocks so the arrays never move once created,
+# which keeps concurrent writers to existing accounts safe while new accounts are added
+BLOCK_SIZE = 1 << 16
+
+# a balance that doesn't fit an int64 cell is refused rather than left to wrap around
+MIN_CENTS, MAX_CENTS = int(np.iinfo(np.int64).min), int(np.iinfo(np.int64).max)
+
+
+def checked(cents):
+    if not MIN_CENTS <= cents <= MAX_CENTS:
+        raise OverflowError(f'Balance of {cents} cents is out of range')
+    return cents
+
+
+def display(cents, float_display):
+    # balances display in dollars, with a decimal part once a float amount has been written to the account
+    if float_display:
+        return cents / 100
+    return from_cents(cents)
+
+
+# balances for every account as int64 cents, densely indexed by account_id.
+# Reads and writes through the mapping interface are in dollars, so it can stand in for the old dict.
+# With a base AccountSnapshot the rows here are an overlay: accounts are read from the memory-mapped snapshot
+# until their first write copies them in, and the overlay is folded into the next snapshot that gets written.
+class AccountStore(MutableMapping):
+
+    def __init__(self, balances=None, base=None):
+        self.index = {}  # account_id -> row
+        self.account_ids = []  # row -> account_id
+        self._cents = []
+        # balances that have had a float applied display as floats, matching what the old dict of floats showed
+        self._float_display = []
+        self._lock = threading.Lock()
+        self.base = base
+        # base rows hidden by an overlay row or a delete
+        self._shadowed = np.zeros(len(base) if base is not None else 0, dtype=bool)
+        self._shadowed_count = 0
+        if balances:
+            for account_id, balance in balances.items():
+                self[account_id] = balance
+
+    def __getitem__(self, account_id):
+        return display(*self.read(account_id))
+
+    def read(self, account_id):
+        # (cents, float_display) for the account, display() turns them into the balance __getitem__ returns
+        row = self.index.get(account_id)
+        if row is None:
+            base_row = self._base_row(account_id)
+            return int(self.base.cents[base_row]), bool(self.base.float_display[base_row])
+        block, offset = divmod(row, BLOCK_SIZE)
+        return int(self._cents[block][offset]), bool(self._float_display[block][offset])
+
+    def __setitem__(self, account_id, value):
+        cents = checked(to_cents(value))
+        block, offset = divmod(self._row(account_id), BLOCK_SIZE)
+        self._cents[block][offset] = cents
+        self._float_display[block][offset] = isinstance(value, float)
+
+    def __delitem__(self, account_id):
+        with self._lock:
+            if account_id not in self.index:
+                self._shadow(self._base_row(account_id))
+                return
+            row = self.index.pop(account_id)
+            last_row = len(self.account_ids) - 1
+            # keep rows dense by moving the last account into the freed row
+            if row != last_row:
+                moved_account_id = self.account_ids[last_row]
+                self._copy_row(last_row, row)
+                self.account_ids[row] = moved_account_id
+                self.index[moved_account_id] = row
+            self.account_ids.pop()
+
+    def __iter__(self):
+        account_ids = list(self.account_ids)
+        if self.base is not None:
+            account_ids.extend(str(account_id) for account_id in self.base.ids[~self._shadowed])
+        return iter(account_ids)
+
+    def __len__(self):
+        base_size = len(self.base) - self._shadowed_count if self.base is not None else 0
+        return len(self.account_ids) + base_size
+
+    def __contains__(self, account_id):
+        if account_id in self.index:
+            return True
+        try:
+            self._base_row(account_id)
+        except KeyError:
+            return False
+        return True
+
+    def add(self, account_id, value):
+        # applies a dollar amount to a balance, callers serialize writes to the same account.
+        # Raises OverflowError, leaving the balance as it was, when the result doesn't fit
+        row = self.index.get(account_id)
+        if row is None:
+            self._base_row(account_id)  # raises KeyError for unknown accounts
+            row = self._row(account_id)
+        block, offset = divmod(row, BLOCK_SIZE)
+        self._cents[block][offset] = checked(int(self._cents[block][offset]) + to_cents(value))
+        if isinstance(value, float):
+            self._float_display[block][offset] = True
+
+    def get_cents(self, account_id):
+        row = self.index.get(account_id)
+        if row is None:
+            return int(self.base.cents[self._base_row(account_id)])
+        block, offset = divmod(row, BLOCK_SIZE)
+        return int(self._cents[block][offset])
+
+    def ids_for(self, rows):
+        return [self.account_ids[row] for row in rows]
+
+    def export(self, account_ids):
+        # (cents, float_display) arrays for the accounts, in the order given
+        cents = np.empty(len(account_ids), dtype=np.int64)
+        float_display = np.empty(len(account_ids), dtype=bool)
+        for position, account_id in enumerate(account_ids):
+            row = self.index.get(account_id)
+            if row is None:
+                base_row = self._base_row(account_id)
+                cents[position] = self.base.cents[base_row]
+                float_display[position] = self.base.float_display[base_row]
+            else:
+                block, offset = divmod(row, BLOCK_SIZE)
+                cents[position] = self._cents[block][offset]
+                float_display[position] = self._float_display[block][offset]
+        return cents, float_display
+
+    # vectorized sweeps over every account, callers must keep other writers out while these run
+
+    def assess_overdraft_fees(self, fee_cents):
+        # charges every overdrawn account, returns the rows charged
+        if self.base is not None:
+            self._copy_in((self.base.cents < 0) & ~self._shadowed)
+        charged = []
+        for base, cents, float_display in self._columns():
+            overdrawn = cents < 0
+            cents[overdrawn] -= fee_cents
+            float_display[overdrawn] = True
+            charged.extend((np.flatnonzero(overdrawn) + base).tolist())
+        return charged
+
+    def accrue_interest(self, rate):
+        # credits rate * balance to every account in credit, rounded down to the cent.
+        # Returns the rows credited and the interest each was paid in cents
+        if self.base is not None:
+            self._copy_in((self.base.cents > 0) & ~self._shadowed)
+        rows = []
+        interest_paid = []
+        for base, cents, float_display in self._columns():
+            interest = np.floor(np.maximum(cents, 0) * rate).astype(np.int64)
+            credited = interest > 0
+            cents += interest
+            float_display[credited] = True
+            rows.extend((np.flatnonzero(credited) + base).tolist())
+            interest_paid.extend(interest[credited].tolist())
+        return rows, interest_paid
+
+    def total_liability(self):
+        # cents owed to account holders, overdrawn accounts don't offset it
+        total = sum(int(cents[cents > 0].sum()) for _, cents, _ in self._columns())
+        if self.base is not None:
+            total += int(self.base.cents[(self.base.cents > 0) & ~self._shadowed].sum())
+        return total
+
+    def _columns(self):
+        # (first row, cents, float_display) views over the used part of every block
+        remaining = len(self.account_ids)
+        for block, cents in enumerate(self._cents):
+            size = min(remaining, BLOCK_SIZE)
+            if size <= 0:
+                return
+            yield block * BLOCK_SIZE, cents[:size], self._float_display[block][:size]
+            remaining -= size
+
+    def _row(self, account_id):
+        row = self.index.get(account_id)
+        if row is not None:
+            return row
+        with self._lock:
+            row = self.index.get(account_id)
+            if row is None:
+                row = len(self.account_ids)
+                if row == len(self._cents) * BLOCK_SIZE:
+                    self._cents.append(np.zeros(BLOCK_SIZE, dtype=np.int64))
+                    self._float_display.append(np.zeros(BLOCK_SIZE, dtype=bool))
+                try:
+                    base_row = self._base_row(account_id)
+                except KeyError:
+                    pass
+                else:
+                    # the new row starts from the snapshot's balance before it becomes visible
+                    block, offset = divmod(row, BLOCK_SIZE)
+                    self._cents[block][offset] = self.base.cents[base_row]
+                    self._float_display[block][offset] = self.base.float_display[base_row]
+                    self._shadow(base_row)
+                self.account_ids.append(account_id)
+                self.index[account_id] = row
+        return row
+
+    def _copy_row(self, source, destination):
+        source_block, source_offset = divmod(source, BLOCK_SIZE)
+        block, offset = divmod(destination, BLOCK_SIZE)
+        self._cents[block][offset] = self._cents[source_block][source_offset]
+        self._float_display[block][offset] = self._float_display[source_block][source_offset]
+
+    def _base_row(self, account_id):
+        # the account's row in the base snapshot, raises KeyError when it isn't visible there
+        row = self.base.find(account_id) if self.base is not None else None
+        if row is None or self._shadowed[row]:
+            raise KeyError(account_id)
+        return row
+
+    def _shadow(self, base_row):
+        self._shadowed[base_row] = True
+        self._shadowed_count += 1
+
+    def _copy_in(self, base_mask):
+        # copies the selected base rows into the overlay so a sweep can update them in place
+        for account_id in self.base.ids[base_mask]:
+            self._row(str(account_id))
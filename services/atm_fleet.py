@@ -0,0 +1,168 @@
+import threading
+
+from services.cassettes import FEWEST_NOTES, accepts, plan_dispense
+from services.money import from_cents, to_cents
+
+# terminal used when a command doesn't say which machine it came from
+DEFAULT_TERMINAL = 'default'
+# terminals holding less cash than this need a refill
+DEFAULT_REFILL_THRESHOLD = 2000.00
+
+
+class AtmTerminal:
+    __slots__ = ('terminal_id', 'cash', 'refill_threshold', 'notes', 'strategy')
+
+    def __init__(self, terminal_id, cash, refill_threshold, notes=None, strategy=FEWEST_NOTES):
+        self.terminal_id = terminal_id
+        self.cash = cash  # cents
+        self.refill_threshold = refill_threshold  # cents
+        # denomination -> notes left in its cassette, in dollars. None for a single undifferentiated drawer
+        self.notes = notes
+        self.strategy = strategy
+
+
+# registry of ATM terminals, each with its own cash drawer.
+# Fleet-wide aggregates are updated on every change to a drawer so reading them never scans the terminals.
+# A terminal registered with notes has a cassette per denomination instead, which run out independently:
+# its cash is whatever its cassettes add up to and withdrawals take the notes the dispense solver picks.
+class AtmFleet:
+
+    def __init__(self):
+        self.terminals = {}
+        self.total_cash = 0  # cents
+        self.low_cash = set()  # terminal ids below their refill threshold
+        self.out_of_service = set()  # terminal ids with an empty drawer
+        # every drawer change is a short critical section, so one lock keeps drawers and aggregates consistent
+        self.lock = threading.Lock()
+
+    def register(self, terminal_id, cash, refill_threshold=DEFAULT_REFILL_THRESHOLD, notes=None,
+                 strategy=FEWEST_NOTES):
+        # notes: denomination -> notes for a terminal with cassettes, cash is ignored then
+        with self.lock:
+            if terminal_id in self.terminals:
+                raise ValueError(f'Terminal {terminal_id} is already registered.')
+            terminal = AtmTerminal(terminal_id, 0, to_cents(refill_threshold), strategy=strategy)
+            self.terminals[terminal_id] = terminal
+            if notes is None:
+                self._set_cash(terminal, to_cents(cash))
+            else:
+                self._set_notes(terminal, notes)
+
+    def get_cash(self, terminal_id):
+        return from_cents(self.terminals[terminal_id].cash)
+
+    def set_cash(self, terminal_id, cash):
+        # a terminal with cassettes becomes a single drawer
+        with self.lock:
+            terminal = self.terminals[terminal_id]
+            terminal.notes = None
+            self._set_cash(terminal, to_cents(cash))
+
+    def get_notes(self, terminal_id):
+        # denomination -> notes, or None for a terminal without cassettes
+        notes = self.terminals[terminal_id].notes
+        return dict(notes) if notes is not None else None
+
+    def set_notes(self, terminal_id, notes, strategy=None):
+        with self.lock:
+            terminal = self.terminals[terminal_id]
+            if strategy is not None:
+                terminal.strategy = strategy
+            self._set_notes(terminal, notes)
+
+    def get_cassettes(self):
+        # terminal_id -> {'notes', 'strategy'} for every terminal with cassettes, callers hold the lock
+        return {terminal_id: {'notes': dict(terminal.notes), 'strategy': terminal.strategy}
+                for terminal_id, terminal in self.terminals.items() if terminal.notes is not None}
+
+    def denominations(self, terminal_id):
+        notes = self.terminals[terminal_id].notes
+        return sorted(notes) if notes is not None else None
+
+    def accepts(self, terminal_id, amount):
+        # whether the terminal could ever dispense exactly amount
+        return accepts(amount, self.denominations(terminal_id))
+
+    def load(self, terminal_id, amount, notes=None):
+        # notes: the denominations making up amount, required for a terminal with cassettes
+        with self.lock:
+            terminal = self.terminals[terminal_id]
+            if terminal.notes is None:
+                self._set_cash(terminal, terminal.cash + to_cents(amount))
+                return
+            if notes is None:
+                raise ValueError(f'Terminal {terminal_id} has cassettes, load it with notes.')
+            self._set_notes(terminal, self._add_notes(terminal.notes, notes, 1))
+
+    def reserve(self, terminal_id, amount):
+        # takes up to amount out of the drawer, returns how much was actually available
+        return self.reserve_notes(terminal_id, amount)[0]
+
+    def reserve_notes(self, terminal_id, amount):
+        # like reserve(), also returning the notes taken, or None for a terminal without cassettes.
+        # Cassettes that can't make the full amount give the largest amount below it they can make
+        if amount <= 0:
+            raise ValueError(f'Cannot reserve {amount} from terminal {terminal_id}.')
+        while True:
+            with self.lock:
+                terminal = self.terminals[terminal_id]
+                if terminal.notes is None:
+                    reserved = min(to_cents(amount), terminal.cash)
+                    self._set_cash(terminal, terminal.cash - reserved)
+                    return from_cents(reserved), None
+                notes, strategy = terminal.notes, terminal.strategy
+
+            # the solver runs without holding up every other terminal. Every change to a terminal's notes
+            # replaces its dict, so the plan is taken only if nothing changed them meanwhile, else it is redone
+            reserved, taken = plan_dispense(amount, notes, strategy)
+            with self.lock:
+                if terminal.notes is notes:
+                    self._set_notes(terminal, self._add_notes(notes, taken, -1))
+                    return reserved, taken
+
+    def remove_notes(self, terminal_id, notes):
+        # takes exactly these notes out, for replaying withdrawals recorded with their notes
+        with self.lock:
+            terminal = self.terminals[terminal_id]
+            self._set_notes(terminal, self._add_notes(terminal.notes, notes, -1))
+
+    def is_out_of_service(self, terminal_id):
+        return terminal_id in self.out_of_service
+
+    def get_summary(self):
+        with self.lock:
+            return {
+                'terminals': len(self.terminals),
+                'total_cash': from_cents(self.total_cash),
+                'low_cash': sorted(self.low_cash),
+                'out_of_service': sorted(self.out_of_service)
+            }
+
+    @staticmethod
+    def _add_notes(notes, change, sign):
+        # denominations may arrive as strings from JSON records
+        notes = dict(notes)
+        for denomination, count in change.items():
+            denomination = int(denomination)
+            notes[denomination] = notes.get(denomination, 0) + sign * count
+        return notes
+
+    def _set_notes(self, terminal, notes):
+        terminal.notes = {int(denomination): count for denomination, count in notes.items()}
+        self._set_cash(terminal, to_cents(sum(denomination * count
+                                              for denomination, count in terminal.notes.items())))
+
+    def _set_cash(self, terminal, cash):
+        self.total_cash += cash - terminal.cash
+        terminal.cash = cash
+
+        if cash < terminal.refill_threshold:
+            self.low_cash.add(terminal.terminal_id)
+        else:
+            self.low_cash.discard(terminal.terminal_id)
+
+        # In the real world this should probably also send some sort of message to whomever fills the ATM
+        if cash <= 0:
+            self.out_of_service.add(terminal.terminal_id)
+        else:
+            self.out_of_service.discard(terminal.terminal_id)
@@ -1,10 +1,27 @@
-import logging
-from datetime import datetime
+import math
+import os
+import threading
+import time
 
-# Set up logging configuration
-logging.basicConfig(filename='atm_service.log', level=logging.INFO)
-# Create a logger instance
-logger = logging.getLogger(__name__)
+from services.account_snapshot import AccountSnapshot, write_account_snapshot
+from services.account_store import AccountStore, display
+from services.atm_fleet import DEFAULT_TERMINAL, AtmFleet
+from services.cassettes import FEWEST_NOTES, describe
+from services.idempotency import ResultCache
+from services.locking import LockStripes
+from services.log_pipeline import log
+from services.metrics import metrics
+from services.money import from_cents, to_cents
+from services.repository import MemoryRepository
+from services.transaction_history import (DEPOSIT, FEE, INTEREST, WITHDRAWAL, AccountHistory, LazyHistories,
+                                          format_event)
+from services.withdrawal_policy import WithdrawalPolicy
+
+# daily withdrawal limits apply to a rolling 24 hour window
+DAILY_WITHDRAWAL_WINDOW = 24 * 60 * 60
+# how long a response is returned again for a retried request ID, and how many are kept
+REQUEST_ID_TTL = 600
+MAX_REQUEST_IDS = 100000
 
 
 # singleton atm service
@@ -14,159 +31,467 @@ class AtmService:
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
             cls._instance = super().__new__(cls)
-            cls.atm_balance = 10000.00
-            cls.account_balances = {
-                '2859459814': 10.24,
-                '1434597300': 90000.55,
-                '7089382418': 0.00,
-                '2001377812': 60.00
-            }
-            cls.transaction_history = {
-                '2859459814': [],
-                '1434597300': [],
-                '7089382418': [],
-                '2001377812': []
-            }
+            # every terminal has its own cash drawer, all of them share the accounts
+            cls.fleet = AtmFleet()
+            # per-account daily withdrawal caps in dollars, accounts without an entry are uncapped
+            cls.daily_withdrawal_limits = {}
+            cls.ledger = None
+            # (account_id, request_id) -> ((command, *arguments), response), for withdrawals and deposits
+            # retried by terminals
+            cls.recent_results = ResultCache(REQUEST_ID_TTL, MAX_REQUEST_IDS)
+            # dispense, overdraft and fee rules, compiled once
+            cls.withdrawal_policy = WithdrawalPolicy()
+
+            # lock-free reads: a writer bumps the account's version to odd while its transaction runs and back to
+            # even when it is done, after publishing the account's state from before the transaction as its view.
+            # Readers use the live state when the version is even and unchanged across the read, the view otherwise.
+            # End of day sweeps bump sweep_version the same way for every account at once
+            cls.versions = {}  # account_id -> version
+            cls.views = {}  # account_id -> (balance, history length), only while a transaction runs
+            cls.sweep_version = 0
+            # held by the thread taking a snapshot
+            cls.snapshot_lock = threading.Lock()
+
+            # transactions on one account are serialized by its stripe, different accounts run in parallel.
+            # Cash drawers are shared by everyone so they get their own short critical section in the fleet.
+            cls.account_locks = LockStripes()
+
+            # seeded accounts, replaced by attach_ledger() when there is durable state
+            cls._instance.restore(MemoryRepository().load_state())
 
         return cls._instance
 
-    def withdraw(self, account_id, value):
-        account_balance = self.account_balances[account_id]
-        is_money_available_in_atm = (self.atm_balance - value) >= 0
+    # cash in the default terminal's drawer
+    @property
+    def atm_balance(self):
+        return self.fleet.get_cash(DEFAULT_TERMINAL)
+
+    @atm_balance.setter
+    def atm_balance(self, value):
+        self.fleet.set_cash(DEFAULT_TERMINAL, value)
+
+    # replaces all state with a snapshot in the format get_state() returns.
+    # An account snapshot the state refers to is looked up in directory
+    def restore(self, state, directory=None):
+        cassettes = state.get('atm_cassettes', {})
+        for terminal_id, cash in state['atm_cash'].items():
+            if terminal_id not in self.fleet.terminals:
+                self.fleet.register(terminal_id, 0)
+            if terminal_id in cassettes:
+                self.fleet.set_notes(terminal_id, cassettes[terminal_id]['notes'], cassettes[terminal_id]['strategy'])
+            else:
+                self.fleet.set_cash(terminal_id, cash)
+
+        if 'accounts' in state:
+            self._open_account_snapshot(os.path.join(directory, state['accounts']))
+            return
+        self.account_balances = AccountStore(state['account_balances'])
+        histories = state['transaction_history']
+        if isinstance(histories, LazyHistories):
+            self.transaction_history = histories
+        else:
+            self.transaction_history = {account_id: AccountHistory.from_columns(columns)
+                                        for account_id, columns in histories.items()}
+
+    # restore state from a durable ledger and record every future transaction to it.
+    # A SqliteRepository can stand in for the Ledger: it recovers its tables as the state and stores
+    # every record written to it.
+    # The service takes the ledger's snapshots itself once a transaction's locks are released, see _snapshot_if_due()
+    def attach_ledger(self, ledger):
+        state, records = ledger.recover()
+        if state:
+            self.restore(state, getattr(ledger, 'directory', None))
+
+        for record in records:
+            if 'cash_loaded' in record:
+                self._load_cash(record['terminal_id'], record['cash_loaded'])
+                continue
+            if 'notes_loaded' in record:
+                self._load_notes(record['terminal_id'], record['notes_loaded'], record['strategy'])
+                continue
+
+            account_id = record['account_id']
+            timestamp, amount, balance, kind = record['history']
+            # cash is replayed as a delta because concurrent withdrawals may be logged out of order
+            if kind == WITHDRAWAL and 'notes' in record:
+                self.fleet.remove_notes(record['terminal_id'], record['notes'])
+            elif kind == WITHDRAWAL:
+                self.fleet.reserve(record['terminal_id'], from_cents(-amount))
+            self.account_balances[account_id] = record['balance']
+            self.transaction_history.setdefault(account_id, AccountHistory()).append(*record['history'])
+
+        self.ledger = ledger
+
+    # consistent copy of all state along with the last ledger sequence it includes.
+    # With a ledger, accounts and their history are written to a memory-mapped account snapshot the state
+    # refers to, and the service switches over to it so everything written since the last one is folded in
+    def get_state(self):
+        with self.account_locks.all_locks(), self.fleet.lock:
+            sequence = self.ledger.sequence if self.ledger else 0
+            state = {'atm_cash': {terminal_id: from_cents(terminal.cash)
+                                  for terminal_id, terminal in self.fleet.terminals.items()},
+                     'atm_cassettes': self.fleet.get_cassettes()}
+            if self.ledger is None:
+                state['account_balances'] = dict(self.account_balances)
+                state['transaction_history'] = {account_id: history.to_columns()
+                                                for account_id, history in self.transaction_history.items()}
+                return sequence, state
+
+            path = self.ledger.account_snapshot_path(sequence)
+            write_account_snapshot(path, self.account_balances, self.transaction_history)
+            self._open_account_snapshot(path)
+            state['accounts'] = os.path.basename(path)
+            return sequence, state
+
+    def _open_account_snapshot(self, path):
+        # balances are served from the mapped snapshot and history loads per account on first use,
+        # so this takes the same time however many accounts there are
+        snapshot = AccountSnapshot(path)
+        self.account_balances = AccountStore(base=snapshot)
+        self.transaction_history = LazyHistories(snapshot.history_columns, snapshot, snapshot.history_length)
+
+    # adds cash to a terminal's drawer, registering the terminal the first time it is loaded
+    def load_cash(self, terminal_id, amount):
+        # the terminal's stripe keeps the load and its ledger record together for snapshots
+        with self.account_locks.lock_for(terminal_id):
+            self._load_cash(terminal_id, amount)
+            if self.ledger:
+                self.ledger.append({'terminal_id': terminal_id, 'cash_loaded': amount})
+        self._snapshot_if_due()
+
+    def _load_cash(self, terminal_id, amount):
+        if terminal_id not in self.fleet.terminals:
+            self.fleet.register(terminal_id, 0)
+        self.fleet.load(terminal_id, amount)
+
+    # adds notes to a terminal's cassettes, registering it as a terminal with cassettes the first time.
+    # notes: denomination -> notes, in dollars. strategy: how the terminal picks notes, see services.cassettes
+    def load_notes(self, terminal_id, notes, strategy=FEWEST_NOTES):
+        with self.account_locks.lock_for(terminal_id):
+            self._load_notes(terminal_id, notes, strategy)
+            if self.ledger:
+                self.ledger.append({'terminal_id': terminal_id, 'notes_loaded': notes, 'strategy': strategy})
+        self._snapshot_if_due()
+
+    def _load_notes(self, terminal_id, notes, strategy):
+        if terminal_id not in self.fleet.terminals:
+            self.fleet.register(terminal_id, 0, notes={}, strategy=strategy)
+        self.fleet.load(terminal_id, sum(int(denomination) * count for denomination, count in notes.items()), notes)
+
+    # request_id: optional ID chosen by the terminal, a retry with the same ID returns the first response
+    # without moving money again
+    def withdraw(self, account_id, value, terminal_id=DEFAULT_TERMINAL, request_id=None):
+        with self.account_locks.lock_for(account_id):
+            self._begin(account_id)
+            try:
+                if request_id is None:
+                    result = self._withdraw(account_id, value, terminal_id)
+                else:
+                    result = self._run_once('withdraw', account_id, request_id, self._withdraw, value, terminal_id)
+            finally:
+                self._end(account_id)
+        self._snapshot_if_due()
+        return result
+
+    def _withdraw(self, account_id, value, terminal_id):
+        # reserving a negative amount would put cash into the drawer
+        if value <= 0:
+            log.warning('Negative withdrawal attempted', account_id=account_id)
+            metrics.increment('atm_withdrawals_total', 'rejected')
+            return 'Please withdraw an amount greater than zero.'
+
+        balance_cents, float_display = self.account_balances.read(account_id)
 
         # account already overdrawn
-        if account_balance < 0:
-            logging.warning('Already Overdrawn', {'account_id': account_id})
+        if balance_cents < 0:
+            log.warning('Already Overdrawn', account_id=account_id)
+            metrics.increment('atm_withdrawals_total', 'rejected')
             return 'Your account is overdrawn! You may not make withdrawals at this time.'
 
         # empty atm
-        # In the real world this should probably send some sort of message to whomever fills the ATM
-        # Should also prevent any more users from logging in and display a message like 'Out of service'.
-        if self.atm_balance == 0:
-            logging.warning('Empty ATM', {'account_id': account_id})
+        if self.fleet.is_out_of_service(terminal_id):
+            log.warning('Empty ATM', account_id=account_id)
+            metrics.increment('atm_withdrawals_total', 'rejected')
             return 'Unable to process your withdrawal at this time.'
 
-        # must be a multiple of 20
-        if value % 20 != 0:
-            logging.warning('Not multiple of 20', {'account_id': account_id})
-            return 'Please enter a multiple of $20.'
-
-        # doesn't overdraw
-        if (not is_money_available_in_atm and account_balance >= self.atm_balance) or account_balance >= value:
-            if is_money_available_in_atm:
-                self.atm_balance -= value
-                self.account_balances[account_id] -= value
-                self.write_history(account_id, -value, self.account_balances[account_id])
-                logging.info('Withdrawal successful',
-                             extra={'account_id': account_id,
-                                    'amount': value,
-                                    'balance': self.account_balances[account_id]}
-                             )
-                return f'Amount dispensed: ${value}. \n ' \
-                       f'Current balance: ${self.account_balances[account_id]}.'
-            else:
-                amount_to_dispense = self.atm_balance
-                self.atm_balance -= amount_to_dispense
-                self.account_balances[account_id] -= amount_to_dispense
-                self.write_history(account_id, -amount_to_dispense, self.account_balances[account_id])
-                logging.info('Withdrawal successful',
-                             extra={'account_id': account_id,
-                                    'amount': amount_to_dispense,
-                                    'balance': self.account_balances[account_id]}
-                             )
-                return f'Unable to dispense full amount requested at this time. \n' \
-                       f'Amount dispensed: ${amount_to_dispense}. \n ' \
-                       f'Current balance: ${self.account_balances[account_id]}.'
-
-        # overdraws
-        if (not is_money_available_in_atm and account_balance < self.atm_balance) or account_balance < value:
-            if is_money_available_in_atm:
-                self.atm_balance -= value
-                # user withdrawal
-                self.account_balances[account_id] -= value
-                self.write_history(account_id, -value, self.account_balances[account_id])
-                logging.info('Withdrawal successful',
-                             extra={'account_id': account_id,
-                                    'amount': value,
-                                    'balance': self.account_balances[account_id]}
-                             )
-
-                # overdraft fee
-                self.account_balances[account_id] -= 5.00
-                self.write_history(account_id, -5, self.account_balances[account_id])
-                logging.info('Overdraft',
-                             extra={'account_id': account_id, 'balance': self.account_balances[account_id]})
-
-                return f'Amount dispensed: ${value}. \n ' \
-                       f'You have been charged an overdraft fee of $5. ' \
-                       f'Current balance: ${self.account_balances[account_id]}.'
-            else:
-                amount_to_dispense = self.atm_balance
-                self.atm_balance -= amount_to_dispense
-                self.account_balances[account_id] -= amount_to_dispense
-                self.write_history(account_id, -amount_to_dispense, self.account_balances[account_id])
-                logging.info('Withdrawal successful',
-                             extra={'account_id': account_id,
-                                    'amount': value,
-                                    'balance': self.account_balances[account_id]}
-                             )
-
-                self.account_balances[account_id] -= 5.00
-                self.write_history(account_id, -5, self.account_balances[account_id])
-                logging.info('Overdraft',
-                             extra={'account_id': account_id, 'balance': self.account_balances[account_id]})
-
-                return f'Unable to dispense full amount requested at this time. \n' \
-                       f'Amount dispensed: ${amount_to_dispense}. \n ' \
-                       f'You have been charged an overdraft fee of $5. ' \
-                       f'Current balance: ${self.account_balances[account_id]}.'
-
-    def deposit(self, account_id, value):
+        # must be a multiple of 20, or for a terminal with cassettes an amount its denominations can make
+        if not self.fleet.accepts(terminal_id, value):
+            denominations = self.fleet.denominations(terminal_id)
+            if denominations is None:
+                log.warning('Not multiple of 20', account_id=account_id)
+                metrics.increment('atm_withdrawals_total', 'rejected')
+                return 'Please enter a multiple of $20.'
+            log.warning('Amount not dispensable', account_id=account_id)
+            metrics.increment('atm_withdrawals_total', 'rejected')
+            return f'Please enter an amount that can be made from {describe(denominations)} notes.'
+
+        remaining_daily_limit = self.get_remaining_daily_withdrawal(account_id)
+        if remaining_daily_limit is not None and value > remaining_daily_limit:
+            log.warning('Daily withdrawal limit reached', account_id=account_id)
+            metrics.increment('atm_withdrawals_total', 'rejected')
+            return f'Daily withdrawal limit reached. ' \
+                   f'You may withdraw up to ${remaining_daily_limit} more today.'
+
+        # reserve the cash, dispensing whatever is left if the atm can't cover the full amount
+        amount_to_dispense, notes = self.fleet.reserve_notes(terminal_id, value)
+        if amount_to_dispense <= 0:
+            log.warning('Empty ATM', account_id=account_id)
+            metrics.increment('atm_withdrawals_total', 'rejected')
+            return 'Unable to process your withdrawal at this time.'
+
+        # one lookup decides the rest, one write applies the withdrawal and any fee together
+        dispensed_cents = to_cents(amount_to_dispense)
+        decision = self.withdrawal_policy.decide(amount_to_dispense != value, balance_cents < dispensed_cents)
+        balance_cents -= dispensed_cents
+        balance = display(balance_cents, float_display)
+        self.account_balances.add(account_id, -(amount_to_dispense + decision.fee))
+
+        # the withdrawal and its fee are one ledger entry, so a crash can't recover one without the other
+        records = []
+        self.write_history(account_id, -amount_to_dispense, balance, terminal_id=terminal_id, notes=notes,
+                           batch=records)
+        log.info('Withdrawal successful', account_id=account_id, amount=amount_to_dispense, balance=balance)
+        if decision.fee:
+            # like any float amount, a fee in cents makes the balance show cents from here on
+            balance = display(balance_cents - decision.fee_cents, float_display or isinstance(decision.fee, float))
+            self.write_history(account_id, -decision.fee, balance, FEE, batch=records)
+            log.info(decision.fee_name, account_id=account_id, balance=balance)
+        if self.ledger:
+            self.ledger.append_all(records)
+
+        metrics.increment('atm_withdrawals_total', decision.outcome)
+        return decision.message.format(amount=amount_to_dispense, balance=balance)
+
+    def deposit(self, account_id, value, request_id=None):
+        with self.account_locks.lock_for(account_id):
+            self._begin(account_id)
+            try:
+                if request_id is None:
+                    result = self._deposit(account_id, value)
+                else:
+                    result = self._run_once('deposit', account_id, request_id, self._deposit, value)
+            finally:
+                self._end(account_id)
+        self._snapshot_if_due()
+        return result
+
+    # callers hold the account's lock, so a retry arriving while the first attempt runs waits for its response.
+    # A retry must repeat the request exactly, an ID reused for a different command, amount or terminal is
+    # refused rather than answered with another request's response
+    def _run_once(self, command, account_id, request_id, operation, *args):
+        key = (account_id, request_id)
+        request = (command, *args)
+        now = time.monotonic()
+        entry = self.recent_results.get(key, now)
+        if entry is not None:
+            first_request, result = entry
+            if first_request != request:
+                log.warning('Request ID reused', account_id=account_id, request_id=request_id)
+                metrics.increment('atm_conflicting_requests_total', command)
+                return 'This request ID was already used for a different transaction.'
+            metrics.increment('atm_repeated_requests_total', command)
+            return result
+        result = operation(account_id, *args)
+        self.recent_results.put(key, (request, result), now)
+        return result
+
+    def _deposit(self, account_id, value):
+        # float() accepts 'nan' and 'inf', which no balance can hold
+        if not math.isfinite(value):
+            log.warning('Non-finite deposit attempted', account_id=account_id)
+            metrics.increment('atm_deposits_total', 'rejected')
+            return 'Please enter a valid amount.'
         if value <= 0:
-            logging.warning('Negative deposit attempted', {'account_id': account_id})
+            log.warning('Negative deposit attempted', account_id=account_id)
+            metrics.increment('atm_deposits_total', 'rejected')
             return 'Please deposit an amount greater than zero.'
-        self.account_balances[account_id] += value
+        try:
+            self.account_balances.add(account_id, value)
+        except OverflowError:
+            log.warning('Deposit exceeds the largest balance', account_id=account_id, amount=value)
+            metrics.increment('atm_deposits_total', 'rejected')
+            return 'Unable to accept a deposit of this size.'
         self.write_history(account_id, value, self.account_balances[account_id])
-        logging.info('Deposit successful',
-                     extra={'account_id': account_id,
-                            'amount': value,
-                            'balance': self.account_balances[account_id]}
-                     )
+        log.info('Deposit successful', account_id=account_id, amount=value,
+                 balance=self.account_balances[account_id])
+        metrics.increment('atm_deposits_total', 'accepted')
         return f'Current balance: {self.account_balances[account_id]}.'
 
+    # end of day: charges every overdrawn account in one vectorized pass, returns how many were charged.
+    # Every fee is logged as a single ledger entry, so the sweep costs one commit however many accounts it charges
+    def assess_overdraft_fees(self, fee=5.00):
+        with self.account_locks.all_locks():
+            self.sweep_version += 1
+            try:
+                charged = self.account_balances.ids_for(self.account_balances.assess_overdraft_fees(to_cents(fee)))
+                records = []
+                for account_id in charged:
+                    self.write_history(account_id, -fee, self.account_balances[account_id], FEE, batch=records)
+                if self.ledger and records:
+                    self.ledger.append_all(records)
+            finally:
+                self.sweep_version += 1
+        self._snapshot_if_due()
+        return len(charged)
+
+    # credits rate * balance to every account in credit in one vectorized pass, returns how many were credited.
+    # Like the overdraft sweep, it is logged as a single ledger entry
+    def accrue_interest(self, rate):
+        with self.account_locks.all_locks():
+            self.sweep_version += 1
+            try:
+                rows, interest_paid = self.account_balances.accrue_interest(rate)
+                records = []
+                for account_id, interest in zip(self.account_balances.ids_for(rows), interest_paid):
+                    self.write_history(account_id, from_cents(interest), self.account_balances[account_id],
+                                       INTEREST, batch=records)
+                if self.ledger and records:
+                    self.ledger.append_all(records)
+            finally:
+                self.sweep_version += 1
+        self._snapshot_if_due()
+        return len(rows)
+
+    # total owed to account holders, in dollars
+    def get_total_liability(self):
+        return from_cents(self.account_balances.total_liability())
+
     def get_balance(self, account_id):
         try:
-            return f'Current Balance: ${self.account_balances[account_id]}'
+            balance, _ = self.read_view(account_id)
         except KeyError:
             return 'Account not found.'
+        return f'Current Balance: ${balance}'
+
+    # (balance, history length) as of the last completed transaction on the account, without waiting for
+    # one that is running. Raises KeyError for unknown accounts
+    def read_view(self, account_id):
+        while True:
+            sweep_version = self.sweep_version
+            if sweep_version % 2:
+                # end of day sweeps are rare and change every account, readers wait for them to finish
+                with self.account_locks.lock_for(account_id):
+                    return self._live_view(account_id)
+
+            version = self.versions.get(account_id, 0)
+            view = self._live_view(account_id) if version % 2 == 0 else self.views.get(account_id)
+            if view is not None and self.versions.get(account_id, 0) == version \
+                    and self.sweep_version == sweep_version:
+                if view[0] is None:
+                    raise KeyError(account_id)
+                return view
+
+    def _live_view(self, account_id):
+        # a lazily loaded history stays unloaded, balance reads don't need its events
+        if isinstance(self.transaction_history, LazyHistories):
+            return self.account_balances.get(account_id), self.transaction_history.length(account_id)
+        history = self.transaction_history.get(account_id)
+        return self.account_balances.get(account_id), len(history) if history is not None else 0
 
-    def write_history(self, account_id, value, balance):
-        formatted_date = datetime.now().date().strftime('%Y-%m-%d')
-        formatted_time = datetime.now().time().strftime('%H:%M:%S')
+    # callers hold the account's lock
+    def _begin(self, account_id):
+        version = self.versions.get(account_id, 0)
+        self.views[account_id] = self._live_view(account_id)
+        self.versions[account_id] = version + 1
 
-        history = [formatted_date, formatted_time, value, balance]
-        # inserting at the start of the list
-        self.transaction_history[account_id].insert(0, history)
+    def _end(self, account_id):
+        self.versions[account_id] += 1
+        del self.views[account_id]
 
-    def get_history_by_account_id(self, account_id):
+    # called once an operation has released its locks. A snapshot takes every account lock, so taking one
+    # while still holding an account's stripe could wait on a thread waiting for that stripe. It also keeps
+    # a snapshot from landing between the balance and ledger records of one transaction
+    def _snapshot_if_due(self):
+        if self.ledger is None or not getattr(self.ledger, 'snapshot_due', False):
+            return
+        # snapshot_due stays set until a snapshot completes, threads finishing meanwhile leave it to the one
+        # taking it rather than each writing the accounts again
+        if not self.snapshot_lock.acquire(blocking=False):
+            return
         try:
-            account_history = self.transaction_history[account_id]
-        except KeyError:
-            return 'No history found.'
+            if self.ledger.snapshot_due:
+                self.ledger.snapshot(*self.get_state())
+        finally:
+            self.snapshot_lock.release()
 
-        if account_history:
-            history_string = f''
-            for event in account_history:
-                history_string += f'{event[0]} {event[1]} {event[2]} {event[3]} \n'
-            return history_string[:len(history_string) - 2]
-        else:
-            return 'No history found.'
+    def get_remaining_daily_withdrawal(self, account_id):
+        limit = self.daily_withdrawal_limits.get(account_id)
+        if limit is None:
+            return None
+        now = int(time.time())
+        withdrawn = self.transaction_history[account_id].withdrawn_between(now - DAILY_WITHDRAWAL_WINDOW + 1)
+        return from_cents(max(to_cents(limit) - withdrawn, 0))
+
+    # callers hold the account's lock
+    # terminal_id is the terminal that dispensed the cash for a withdrawal
+    def write_history(self, account_id, value, balance, kind=None, terminal_id=DEFAULT_TERMINAL, notes=None,
+                      batch=None):
+        # notes: the notes a withdrawal took from the terminal's cassettes, if it has them
+        # batch: a list the ledger record is added to instead of being appended, so a caller can append the
+        # records of one transaction together
+        if kind is None:
+            kind = DEPOSIT if value > 0 else WITHDRAWAL
+        history = [int(time.time()), to_cents(value), to_cents(balance), kind]
+        self.transaction_history[account_id].append(*history)
 
+        if self.ledger:
+            record = {
+                'account_id': account_id,
+                'terminal_id': terminal_id,
+                'balance': balance,
+                'history': history
+            }
+            if notes:
+                record['notes'] = notes
+            if batch is None:
+                self.ledger.append(record)
+            else:
+                batch.append(record)
 
+    def iter_history_lines(self, account_id, start=None, end=None):
+        # lazily formats history, newest first, optionally limited to start <= event time < end.
+        # History is append-only, so the events up to the view's length are a stable snapshot
+        account_history = self.transaction_history.get(account_id)
+        if account_history is None:
+            return
+        _, size = self.read_view(account_id)
+        low, high = account_history.positions_between(start, end)
+        for event in account_history.iter_events(min(high, size), min(low, size)):
+            yield format_event(*event)
 
+    def get_history_since(self, account_id, start):
+        history_string = ' \n'.join(self.iter_history_lines(account_id, start))
+        return history_string if history_string else 'No history found.'
 
+    def get_history_page(self, account_id, limit, cursor=None):
+        # returns up to `limit` formatted lines and a continuation token for the next page, or None
+        account_history = self.transaction_history.get(account_id)
+        if account_history is None:
+            return [], None
 
+        _, before = self.read_view(account_id)
+        if cursor is not None:
+            if not 0 < int(cursor) <= before:
+                raise ValueError(f'Invalid history cursor: {cursor}')
+            before = int(cursor)
 
+        events, next_before = account_history.page(limit, before)
+        lines = [format_event(*event) for event in events]
+        return lines, None if next_before is None else str(next_before)
 
+    def get_history_by_account_id(self, account_id, limit=None, cursor=None):
+        if limit is None:
+            history_string = ' \n'.join(self.iter_history_lines(account_id))
+            return history_string if history_string else 'No history found.'
 
+        try:
+            lines, next_cursor = self.get_history_page(account_id, limit, cursor)
+        except ValueError:
+            return 'Invalid history cursor.'
 
+        if not lines:
+            return 'No history found.'
+        history_string = ' \n'.join(lines)
+        if next_cursor:
+            history_string += f' \nMore history available: history {limit} {next_cursor}'
+        return history_string
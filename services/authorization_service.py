@@ -1,10 +1,34 @@
+import heapq
+import itertools
+import secrets
+import threading
 import time
-import logging
 
-# Set up logging configuration
-logging.basicConfig(filename='authorization_service.py', level=logging.INFO)
-# Create a logger instance
-logger = logging.getLogger(__name__)
+from services.credentials import verify_pin
+from services.log_pipeline import log
+from services.metrics import metrics
+from services.repository import MemoryRepository
+from services.throttle import FailureThrottle
+
+# sessions are logged out after 2 minutes of inactivity
+SESSION_TIMEOUT = 120
+# session used by the interactive terminal in main.py
+DEFAULT_SESSION = 'default'
+# failed attempts allowed within the window before an account or terminal is locked out
+MAX_FAILED_ATTEMPTS = 5
+FAILED_ATTEMPT_WINDOW = 300
+LOCKOUT_SECONDS = 900
+# accounts and terminals with recent failures that are tracked at once
+MAX_TRACKED_FAILURES = 100000
+
+
+class Session:
+    __slots__ = ('session_id', 'account_id', 'last_activity')
+
+    def __init__(self, session_id, account_id, last_activity):
+        self.session_id = session_id
+        self.account_id = account_id
+        self.last_activity = last_activity
 
 
 # singleton authorization service
@@ -14,58 +38,141 @@ class AuthorizationService:
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
             cls._instance = super().__new__(cls)
-            cls.account_information = {
-                '2859459814': '7386',
-                '1434597300': '4557',
-                '7089382418': '0075',
-                '2001377812': '5950'
-            }
-
-            cls.account_activity = {}
+            # account_id -> (salt, PIN digest)
+            cls.account_information = MemoryRepository().load_pins()
+            cls.account_failures = FailureThrottle(MAX_FAILED_ATTEMPTS, FAILED_ATTEMPT_WINDOW, LOCKOUT_SECONDS,
+                                                   MAX_TRACKED_FAILURES)
+            cls.terminal_failures = FailureThrottle(MAX_FAILED_ATTEMPTS, FAILED_ATTEMPT_WINDOW, LOCKOUT_SECONDS,
+                                                    MAX_TRACKED_FAILURES)
+
+            # session_id -> Session, one per logged in terminal
+            cls.sessions = {}
+            # min-heap of (deadline, tiebreaker, session). Entries are never updated in place:
+            # refreshes only touch the session, and stale entries are fixed up when they reach the top
+            cls.expiry_heap = []
+            cls._heap_counter = itertools.count()
+            cls._lock = threading.RLock()
         return cls._instance
 
-    # function to initially authorize users
-    def authorize(self, account_id, entered_pin):
-        self.logout()  # logout any currently logged in account
+    # replaces the seeded credentials with the ones held by a repository
+    def load_pins(self, repository):
+        pins = repository.load_pins()
+        with self._lock:
+            self.account_information = pins
+
+    # last activity time of every logged in account
+    @property
+    def account_activity(self):
+        return {session.account_id: session.last_activity for session in self.sessions.values()}
+
+    def new_session_id(self):
+        return secrets.token_urlsafe(16)
 
-        # validate auth request
-        if account_id not in self.account_information:
-            logging.warning('Bad auth. Wrong account_id.')
-            return 'Authorization failed.'
+    # function to initially authorize users.
+    # terminal_id is the machine or network peer the attempt comes from, failures are throttled per terminal.
+    # Without one the session stands in for it
+    def authorize(self, account_id, entered_pin, session_id=DEFAULT_SESSION, terminal_id=None):
+        source = terminal_id or session_id
+        with self._lock:
+            self.logout(session_id)  # logout any account currently logged in on this session
+            self.expire_sessions()
 
-        expected_pin = self.account_information[account_id]
-        if entered_pin != expected_pin:
-            logging.warning('Bad auth. Wrong pin.', {'account_id': account_id})
-            return 'Authorization failed.'
+            # locked out accounts and terminals are turned away before any PIN verification work
+            now = time.time()
+            if self.terminal_failures.is_locked(source, now) or self.account_failures.is_locked(account_id, now):
+                log.warning('Bad auth. Locked out.', account_id=account_id, terminal_id=source)
+                metrics.increment('atm_authorizations_total', 'locked_out')
+                return 'Too many failed attempts. Try again later.'
 
-        self.account_activity[account_id] = time.time()
-        logging.info('Successful Authorization', extra={'account_id': account_id})
+            # validate auth request
+            stored_pin = self.account_information.get(account_id)
+            if stored_pin is None:
+                self._record_failure(None, source, now)
+                log.warning('Bad auth. Wrong account_id.')
+                metrics.increment('atm_authorizations_total', 'auth_failure')
+                return 'Authorization failed.'
+
+        # key derivation runs outside the lock so it doesn't serialize every other login
+        pin_matches = verify_pin(entered_pin, stored_pin)
+
+        with self._lock:
+            if not pin_matches:
+                self._record_failure(account_id, source, time.time())
+                log.warning('Bad auth. Wrong pin.', account_id=account_id)
+                metrics.increment('atm_authorizations_total', 'auth_failure')
+                return 'Authorization failed.'
+
+            self.account_failures.reset(account_id)
+            session = Session(session_id, account_id, time.time())
+            self.sessions[session_id] = session
+            heapq.heappush(self.expiry_heap,
+                           (session.last_activity + SESSION_TIMEOUT, next(self._heap_counter), session))
+            log.info('Successful Authorization', account_id=account_id)
+            metrics.increment('atm_authorizations_total', 'success')
 
         return f'{account_id} successfully authorized.'
 
-    def logout(self):
-        account_id = list(self.account_activity.keys())[0] if self.account_activity else None
-        if not account_id:
+    def logout(self, session_id=DEFAULT_SESSION):
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+        if not session:
             return 'No account is currently authorized.'
 
-        del self.account_activity[account_id]
-        logging.info('Logout', extra={'account_id': account_id})
-        return f'Account {account_id} logged out.'
+        log.info('Logout', account_id=session.account_id)
+        metrics.increment('atm_logouts_total', 'logout')
+        return f'Account {session.account_id} logged out.'
 
-    def get_active_account_id(self):
-        return list(self.account_activity.keys())[0] if self.account_activity else None
+    def get_active_account_id(self, session_id=DEFAULT_SESSION):
+        session = self.sessions.get(session_id)
+        return session.account_id if session else None
 
-    def is_authorization_active(self):
-        if not self.account_activity:
+    def is_authorization_active(self, session_id=DEFAULT_SESSION):
+        session = self.sessions.get(session_id)
+        if not session:
             return False
-        account_id, activity_time_in_sec = list(self.account_activity.items())[0]
         current_time_in_seconds = time.time()
-        difference = current_time_in_seconds - activity_time_in_sec
-        if difference > 120:
+        difference = current_time_in_seconds - session.last_activity
+        if difference > SESSION_TIMEOUT:
             # if account has been inactive for over 2 minutes, log them out
-            self.logout()
+            with self._lock:
+                self._expire(session)
             return False
+        self.expire_sessions(current_time_in_seconds)
         return True
 
-    def refresh_activity(self, account_id):
-        self.account_activity[account_id] = time.time()
+    def refresh_activity(self, account_id, session_id=DEFAULT_SESSION):
+        session = self.sessions.get(session_id)
+        if session and session.account_id == account_id:
+            session.last_activity = time.time()
+
+    # log out every session that has been inactive for too long, amortized O(log n) per session
+    def expire_sessions(self, now=None):
+        if now is None:
+            now = time.time()
+        # cheap check without the lock for the common case where nothing is due
+        if not self.expiry_heap or self.expiry_heap[0][0] >= now:
+            return
+
+        with self._lock:
+            while self.expiry_heap and self.expiry_heap[0][0] < now:
+                _, _, session = heapq.heappop(self.expiry_heap)
+                if self.sessions.get(session.session_id) is not session:
+                    continue  # logged out or replaced since this entry was pushed
+                deadline = session.last_activity + SESSION_TIMEOUT
+                if deadline >= now:
+                    # refreshed since this entry was pushed
+                    heapq.heappush(self.expiry_heap, (deadline, next(self._heap_counter), session))
+                    continue
+                self._expire(session)
+
+    def _expire(self, session):
+        if self.sessions.get(session.session_id) is session:
+            del self.sessions[session.session_id]
+            log.info('Timeout logout', account_id=session.account_id)
+            metrics.increment('atm_logouts_total', 'timeout')
+
+    def _record_failure(self, account_id, source, now):
+        if account_id is not None and self.account_failures.record_failure(account_id, now):
+            log.warning('Account locked out', account_id=account_id)
+        if self.terminal_failures.record_failure(source, now):
+            log.warning('Terminal locked out', terminal_id=source)
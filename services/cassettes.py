@@ -0,0 +1,102 @@
+from functools import lru_cache
+from math import gcd
+
+# how a terminal with cassettes picks the notes for a withdrawal
+FEWEST_NOTES = 'fewest_notes'
+EVEN_WEAR = 'even_wear'  # draws on the fullest cassettes, so they run out together
+# plans kept by the solver, they're keyed by inventory class so a handful cover most withdrawals
+PLAN_CACHE_SIZE = 4096
+# terminals without cassettes dispense in multiples of this
+LEGACY_NOTE = 20
+
+
+def plan_dispense(amount, notes, strategy=FEWEST_NOTES):
+    # notes: denomination -> notes in the cassette, all in dollars.
+    # Returns the largest amount up to `amount` the cassettes can make, and the notes making it up
+    cash = sum(denomination * count for denomination, count in notes.items())
+    if amount >= cash:
+        # nothing to choose, so the solver never sizes its table by an amount the terminal can't hold
+        return cash, {denomination: count for denomination, count in notes.items() if count}
+    denominations = tuple(sorted(notes, reverse=True))
+    # only as many notes as could possibly fit in the amount matter, so every well stocked cassette
+    # falls into the same inventory class and shares its cached plans
+    counts = tuple(min(notes[denomination], int(amount // denomination)) for denomination in denominations)
+    dispensed, taken = _solve(int(amount), denominations, counts, _weights(denominations, notes, strategy))
+    return dispensed, {denomination: count for denomination, count in zip(denominations, taken) if count}
+
+
+def accepts(amount, denominations):
+    # whether amount could be dispensed at all, given enough notes. Without denominations the terminal is a
+    # single cash drawer paying out multiples of $20
+    if not denominations:
+        return amount % LEGACY_NOTE == 0
+    if amount <= 0 or amount != int(amount):
+        return False
+    unit = 0
+    for denomination in denominations:
+        unit = gcd(unit, int(denomination))
+    if amount % unit:
+        return False
+    makeable = _makeable(tuple(sorted({int(denomination) // unit for denomination in denominations})))
+    return amount // unit >= len(makeable) or makeable[int(amount // unit)]
+
+
+def describe(denominations):
+    # '$20, $50 and $100'
+    names = [f'${denomination}' for denomination in sorted(denominations)]
+    return ' and '.join([', '.join(names[:-1]), names[-1]]) if len(names) > 1 else names[0]
+
+
+def _weights(denominations, notes, strategy):
+    if strategy == FEWEST_NOTES:
+        return (1,) * len(denominations)
+    # a note costs more the emptier its cassette is, in powers of two of fill level
+    fill = [notes[denomination].bit_length() for denomination in denominations]
+    return tuple(2 ** (max(fill) - level) for level in fill)
+
+
+@lru_cache(maxsize=None)
+def _makeable(sizes):
+    # sizes have no common factor, so every amount from (smallest - 1) * (largest - 1) up can be made
+    # (Schur's bound on the Frobenius number). Only the amounts below it need a table, whose size depends on
+    # the denominations and not on the amount asked for
+    limit = (sizes[0] - 1) * (sizes[-1] - 1)
+    makeable = [False] * limit
+    for total in range(limit):
+        makeable[total] = total == 0 or any(size <= total and makeable[total - size] for size in sizes)
+    return makeable
+
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def _solve(amount, denominations, counts, weights):
+    # bounded knapsack over amounts in units of the denominations' gcd: best[total] is the cheapest
+    # (cost, notes, counts) making exactly total. Each cassette is split into bundles of 1, 2, 4, ... notes
+    # so a cassette of n notes costs log(n) passes instead of n
+    unit = 0
+    for denomination in denominations:
+        unit = gcd(unit, denomination)
+    target = amount // unit
+    best = [None] * (target + 1)
+    best[0] = (0, 0, (0,) * len(denominations))
+
+    for index, (denomination, count, weight) in enumerate(zip(denominations, counts, weights)):
+        size = denomination // unit
+        bundle = 1
+        while count > 0:
+            notes = min(bundle, count)
+            count -= notes
+            bundle *= 2
+            for total in range(target, size * notes - 1, -1):
+                previous = best[total - size * notes]
+                if previous is None:
+                    continue
+                cost = previous[0] + weight * notes, previous[1] + notes
+                current = best[total]
+                if current is None or cost < current[:2]:
+                    taken = list(previous[2])
+                    taken[index] += notes
+                    best[total] = (*cost, tuple(taken))
+
+    for total in range(target, -1, -1):
+        if best[total] is not None:
+            return total * unit, best[total][2]
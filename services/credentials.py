@@ -0,0 +1,20 @@
+import hashlib
+import hmac
+import secrets
+
+# a 4 digit PIN has only 10000 values, so guessing is bounded by the authorization service's failure throttles
+# rather than by key derivation cost; the hash keeps PINs out of storage and memory dumps without making
+# every login slow
+PIN_HASH_ITERATIONS = 10000
+
+
+def hash_pin(pin, salt=None):
+    # returns (salt, digest) as stored for an account
+    if salt is None:
+        salt = secrets.token_bytes(16)
+    return salt, hashlib.pbkdf2_hmac('sha256', pin.encode(), salt, PIN_HASH_ITERATIONS)
+
+
+def verify_pin(pin, stored):
+    salt, digest = stored
+    return hmac.compare_digest(hash_pin(pin, salt)[1], digest)
@@ -0,0 +1,34 @@
+import threading
+from collections import OrderedDict
+
+
+# responses to recent requests by request ID, so a retried request gets the first response instead of running
+# twice. Entries expire ttl seconds after they were stored and the oldest are evicted beyond capacity,
+# so memory stays capped however many requests arrive
+class ResultCache:
+
+    def __init__(self, ttl=600, capacity=100000):
+        self.ttl = ttl
+        self.capacity = capacity
+        self._entries = OrderedDict()  # key -> (expires, result), oldest first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= now:
+            return None
+        return entry[1]
+
+    def put(self, key, result, now):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (now + self.ttl, result)
+            # every entry lives for the same ttl, so the expired ones are always at the front
+            while self._entries:
+                expires, _ = next(iter(self._entries.values()))
+                if expires > now and len(self._entries) <= self.capacity:
+                    break
+                self._entries.popitem(last=False)
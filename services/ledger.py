@@ -0,0 +1,191 @@
+import json
+import os
+import shutil
+import threading
+
+LOG_FILENAME = 'ledger.log'
+SNAPSHOT_FILENAME = 'snapshot.json'
+# directories of memory-mapped account snapshots, suffixed with the sequence they include
+ACCOUNTS_PREFIX = 'accounts-'
+
+
+# append-only write-ahead ledger with group commit and compacted snapshots.
+# Each log line is one entry: a record, or the list of records append_all() wrote together, so a crash
+# never recovers part of one
+class Ledger:
+
+    def __init__(self, directory, synchronous=True, group_size=64, snapshot_every=10000):
+        # synchronous: append() only returns once its record is fsynced
+        # group_size: with synchronous=False, fsync once this many records are pending
+        # snapshot_every: compact the log into a snapshot after this many records
+        self.directory = directory
+        self.synchronous = synchronous
+        self.group_size = group_size
+        self.snapshot_every = snapshot_every
+
+        self.sequence = 0
+        self.snapshot_sequence = 0
+        self.fsync_count = 0
+
+        self._durable_sequence = 0
+        self._syncing = False
+        self._condition = threading.Condition()
+        self._snapshot_lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.log_path = os.path.join(directory, LOG_FILENAME)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILENAME)
+        self._file = None
+
+    def recover(self):
+        # returns the last snapshot state (or None) and the records written after it
+        state = None
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r') as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            self.snapshot_sequence = snapshot['sequence']
+            state = snapshot['state']
+
+        records = []
+        valid_length = 0
+        if os.path.exists(self.log_path):
+            with open(self.log_path, 'rb') as log_file:
+                for line in log_file:
+                    # a torn final write from a crash is discarded
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        sequence, record = json.loads(line)
+                    except ValueError:
+                        break
+                    valid_length += len(line)
+                    if sequence > self.snapshot_sequence:
+                        if isinstance(record, list):
+                            records.extend(record)
+                        else:
+                            records.append(record)
+                    self.sequence = max(self.sequence, sequence)
+
+        self.sequence = max(self.sequence, self.snapshot_sequence)
+        self._durable_sequence = self.sequence
+
+        self._file = open(self.log_path, 'ab')
+        self._file.truncate(valid_length)
+        return state, records
+
+    def append(self, record):
+        return self._append(record)
+
+    def append_all(self, records):
+        # the records of one transaction as a single entry, with a single fsync
+        return self._append(list(records))
+
+    def _append(self, entry):
+        if self._file is None:
+            self.recover()
+
+        with self._condition:
+            self.sequence += 1
+            sequence = self.sequence
+            line = json.dumps([sequence, entry], separators=(',', ':')) + '\n'
+            self._file.write(line.encode())
+            pending = sequence - self._durable_sequence
+
+        if self.synchronous or pending >= self.group_size:
+            self.commit(sequence)
+        return sequence
+
+    @property
+    def snapshot_due(self):
+        return self.sequence - self.snapshot_sequence >= self.snapshot_every
+
+    def commit(self, sequence=None):
+        # group commit: one caller fsyncs on behalf of every record written so far,
+        # everyone else waiting on an already covered sequence just wakes up
+        with self._condition:
+            if sequence is None:
+                sequence = self.sequence
+            while self._durable_sequence < sequence:
+                if self._syncing:
+                    self._condition.wait()
+                    continue
+                self._syncing = True
+                target = self.sequence
+                self._file.flush()
+                self._condition.release()
+                try:
+                    os.fsync(self._file.fileno())
+                finally:
+                    self._condition.acquire()
+                    self._syncing = False
+                self.fsync_count += 1
+                self._durable_sequence = target
+                self._condition.notify_all()
+
+    def snapshot(self, sequence, state):
+        if not self._snapshot_lock.acquire(blocking=False):
+            return  # another thread is already compacting
+        try:
+            self.commit(sequence)
+
+            temp_path = self.snapshot_path + '.tmp'
+            with open(temp_path, 'w') as snapshot_file:
+                json.dump({'sequence': sequence, 'state': state}, snapshot_file, separators=(',', ':'))
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            os.replace(temp_path, self.snapshot_path)
+            self._fsync_directory()
+            self.snapshot_sequence = sequence
+            self._remove_stale_account_snapshots(state.get('accounts'))
+
+            # records up to the snapshot are no longer needed, keep only the tail
+            with self._condition:
+                while self._syncing:
+                    self._condition.wait()
+                self._compact_log(sequence)
+                self._durable_sequence = self.sequence
+        finally:
+            self._snapshot_lock.release()
+
+    def account_snapshot_path(self, sequence):
+        # where the service writes the account snapshot a snapshot's state refers to by name
+        return os.path.join(self.directory, f'{ACCOUNTS_PREFIX}{sequence}')
+
+    def close(self):
+        if self._file is None:
+            return
+        self.commit()
+        self._file.close()
+        self._file = None
+
+    def _compact_log(self, sequence):
+        self._file.flush()
+        with open(self.log_path, 'rb') as log_file:
+            tail = [line for line in log_file if json.loads(line)[0] > sequence]
+        self._file.close()
+
+        temp_path = self.log_path + '.tmp'
+        with open(temp_path, 'wb') as log_file:
+            log_file.writelines(tail)
+            log_file.flush()
+            os.fsync(log_file.fileno())
+        os.replace(temp_path, self.log_path)
+        self._fsync_directory()
+        self._file = open(self.log_path, 'ab')
+
+    def _remove_stale_account_snapshots(self, current):
+        # only the snapshot the newest state refers to is ever read again. Snapshots still being written are
+        # left alone, and removing one that is mapped is safe because the mapping keeps the data alive
+        for name in os.listdir(self.directory):
+            if name.startswith(ACCOUNTS_PREFIX) and name != current and not name.endswith('.tmp'):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def _fsync_directory(self):
+        try:
+            directory_fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return  # not supported on every platform
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
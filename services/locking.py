@@ -0,0 +1,26 @@
+import threading
+from contextlib import contextmanager
+
+
+# a fixed pool of locks shared out by key, so unrelated accounts rarely contend
+# while memory stays constant no matter how many accounts exist
+class LockStripes:
+
+    def __init__(self, stripes=64):
+        # reentrant, so a thread may take a stripe it already holds. all_locks() must never be taken while
+        # holding a single stripe though, a thread waiting for that stripe may hold one it needs
+        self._locks = [threading.RLock() for _ in range(stripes)]
+
+    def lock_for(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+    @contextmanager
+    def all_locks(self):
+        # always acquired in the same order so two callers can't deadlock each other
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(self._locks):
+                lock.release()
@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+import time
+import traceback
+from queue import Empty, SimpleQueue
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+# records written per batch, and records allowed to wait before new ones are dropped
+BATCH_SIZE = 512
+MAX_PENDING = 100000
+
+_STOP = object()
+
+
+# structured logging off the transaction hot path.
+# Callers only enqueue a tuple, a background thread formats batches of records as JSON lines
+# and writes them to a size-rotated file. Until start() is called every record is discarded.
+class StructuredLog:
+
+    def __init__(self):
+        self.dropped = 0
+        self._queue = None
+        self._thread = None
+
+    def start(self, filename, max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT):
+        if self._queue is not None:
+            return
+        writer = _RotatingWriter(filename, max_bytes, backup_count)
+        records = SimpleQueue()
+        self._thread = threading.Thread(target=self._write_batches, args=(records, writer),
+                                        name='structured-log', daemon=True)
+        self._thread.start()
+        self._queue = records
+
+    def stop(self):
+        # writes everything already logged before returning
+        records, self._queue = self._queue, None
+        if records is None:
+            return
+        records.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def info(self, event, **fields):
+        records = self._queue
+        if records is not None:
+            self._enqueue(records, 'INFO', event, fields)
+
+    def warning(self, event, **fields):
+        records = self._queue
+        if records is not None:
+            self._enqueue(records, 'WARNING', event, fields)
+
+    def exception(self, event, **fields):
+        # called from an except block, the traceback is formatted here since the exception is gone by the
+        # time the writer gets to the record
+        records = self._queue
+        if records is not None:
+            self._enqueue(records, 'ERROR', event, {**fields, 'traceback': traceback.format_exc()})
+
+    def _enqueue(self, records, level, event, fields):
+        # a writer that can't keep up costs dropped records, never transaction latency or unbounded memory
+        if records.qsize() >= MAX_PENDING:
+            self.dropped += 1
+            return
+        records.put((time.time(), level, event, fields))
+
+    def _write_batches(self, records, writer):
+        try:
+            while True:
+                batch = [records.get()]
+                while len(batch) < BATCH_SIZE:
+                    try:
+                        batch.append(records.get_nowait())
+                    except Empty:
+                        break
+
+                stopping = batch[-1] is _STOP
+                if stopping:
+                    batch.pop()
+                writer.write([format_record(*record) for record in batch])
+                if stopping:
+                    return
+        finally:
+            writer.close()
+
+
+def format_record(timestamp, level, event, fields):
+    return json.dumps({'time': round(timestamp, 6), 'level': level, 'event': event, **fields},
+                      default=str) + '\n'
+
+
+class _RotatingWriter:
+
+    def __init__(self, filename, max_bytes, backup_count):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._file = open(filename, 'a')
+        self._size = self._file.tell()
+
+    def write(self, lines):
+        # one write per batch, split only where the file has to rotate
+        chunk = []
+        for line in lines:
+            if self._size and self._size + len(line) > self.max_bytes:
+                self._file.write(''.join(chunk))
+                chunk = []
+                self._rotate()
+            chunk.append(line)
+            self._size += len(line)
+        self._file.write(''.join(chunk))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def _rotate(self):
+        # atm_service.log -> atm_service.log.1 -> ... -> atm_service.log.<backup_count>
+        self._file.close()
+        for number in range(self.backup_count - 1, 0, -1):
+            source = f'{self.filename}.{number}'
+            if os.path.exists(source):
+                os.replace(source, f'{self.filename}.{number + 1}')
+        if self.backup_count > 0:
+            os.replace(self.filename, f'{self.filename}.1')
+        self._file = open(self.filename, 'w')
+        self._size = 0
+
+
+# shared by every service
+log = StructuredLog()
@@ -0,0 +1,298 @@
+import functools
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# histogram bucket upper bounds in seconds, roughly three per decade from 1us to 1s
+BUCKET_BOUNDS = [1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+                 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0]
+_BUCKET_BOUNDS_NS = np.array([int(bound * 1e9) for bound in BUCKET_BOUNDS], dtype=np.int64)
+# latencies a thread buffers per histogram before they are bucketed together
+FOLD_SAMPLES = 1024
+
+
+class Histogram:
+    __slots__ = ('counts', 'total_ns')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)  # the last bucket is +Inf
+        self.total_ns = 0
+
+    def observe_many(self, elapsed_ns):
+        # buckets a batch of latencies in one vectorized pass
+        samples = np.array(elapsed_ns, dtype=np.int64)
+        buckets = np.bincount(np.searchsorted(_BUCKET_BOUNDS_NS, samples), minlength=len(self.counts))
+        for bucket, count in enumerate(buckets.tolist()):
+            self.counts[bucket] += count
+        self.total_ns += int(samples.sum())
+
+    def add(self, other):
+        for bucket, count in enumerate(other.counts):
+            self.counts[bucket] += count
+        self.total_ns += other.total_ns
+
+
+# one thread's latencies for one histogram and label. Only that thread appends, without a lock, and the
+# buffered samples are folded into the histogram under the lock once FOLD_SAMPLES build up or a reader asks.
+# Appends only ever add to the end, so folding the first n samples never loses one appended meanwhile
+class _Cell(list):
+    __slots__ = ('histogram', 'lock')
+
+    def __init__(self):
+        super().__init__()
+        self.histogram = Histogram()
+        self.lock = threading.Lock()
+
+    def fold(self):
+        with self.lock:
+            self._fold()
+
+    def merge_into(self, merged, key):
+        with self.lock:
+            self._fold()
+            if any(self.histogram.counts):
+                if key not in merged:
+                    merged[key] = Histogram()
+                merged[key].add(self.histogram)
+
+    def clear(self):
+        with self.lock:
+            del self[:]
+            self.histogram = Histogram()
+
+    def _fold(self):
+        count = len(self)
+        if count:
+            self.histogram.observe_many(self[:count])
+            del self[:count]
+
+
+# counters and latency histograms with a single label each, rendered as Prometheus text.
+# Every recording method returns straight away while disabled, and timing wrappers are only
+# installed by instrument(), so disabled metrics add no wrappers to the hot path.
+# Each thread records into its own cells, so threads serving commands at once never lose each other's
+# updates and recording takes no lock; reading merges every thread's cells.
+# Enabled, an instrumented call costs about 0.55us more than the call itself (CPython 3.11 on a small VM).
+# 0.35us of that is calling through a wrapper and reading the clock twice, which any timing wrapper pays;
+# benchmarks/run_benchmarks.py measures both.
+class Metrics:
+
+    def __init__(self):
+        self.enabled = False
+        self.definitions = {}  # name -> (type, label name, help)
+        self.gauges = {}  # name -> function returning the current value
+        self._local = threading.local()
+        # (counters, histogram cells) of every thread that recorded. reset() clears them in place, since
+        # instrumented wrappers keep hold of their cells
+        self._cells = []
+        self._lock = threading.Lock()
+        self._instrumented = []
+
+    @property
+    def counters(self):
+        # (name, label value) -> count
+        merged = {}
+        for counters, _ in self._all_cells():
+            for key, count in dict(counters).items():
+                merged[key] = merged.get(key, 0) + count
+        return merged
+
+    @property
+    def histograms(self):
+        # (name, label value) -> Histogram
+        merged = {}
+        for _, cells in self._all_cells():
+            for key, cell in dict(cells).items():
+                cell.merge_into(merged, key)
+        return merged
+
+    def define(self, name, metric_type, label_name, help_text):
+        self.definitions[name] = (metric_type, label_name, help_text)
+
+    def gauge(self, name, help_text, read):
+        # an unlabelled value read on every render, for state that something else already keeps up to date
+        self.define(name, 'gauge', None, help_text)
+        self.gauges[name] = read
+
+    def increment(self, name, label_value):
+        if not self.enabled:
+            return
+        try:
+            counters = self._local.cells[0]
+        except AttributeError:
+            counters = self._thread_cells()[0]
+        key = (name, label_value)
+        counters[key] = counters.get(key, 0) + 1
+
+    def observe(self, name, label_value, elapsed_ns):
+        if not self.enabled:
+            return
+        cell = self._cell(name, label_value)
+        cell.append(elapsed_ns)
+        if len(cell) >= FOLD_SAMPLES:
+            cell.fold()
+
+    def instrument(self, owner, attribute, histogram_name, label=None):
+        # wraps owner.attribute (a method on a class, or a function on a module) with a latency histogram.
+        # label(*args) picks the label value per call, the attribute name is used otherwise.
+        # Each thread looks its cell up once, so a call only reads the clock twice and appends. With a label,
+        # calls whose first argument is their own label, like process_command's known commands, are looked up
+        # by it and skip label()
+        original = getattr(owner, attribute)
+        metrics = self
+        clock = time.perf_counter_ns
+        bound = threading.local()  # this wrapper's cells for the calling thread
+
+        if label is None:
+            @functools.wraps(original)
+            def timed(*args, **kwargs):
+                started = clock()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    elapsed_ns = clock() - started
+                    try:
+                        cell = bound.cell
+                    except AttributeError:
+                        cell = bound.cell = metrics._cell(histogram_name, attribute)
+                    cell.append(elapsed_ns)
+                    if len(cell) >= FOLD_SAMPLES:
+                        cell.fold()
+        else:
+            @functools.wraps(original)
+            def timed(*args, **kwargs):
+                started = clock()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    elapsed_ns = clock() - started
+                    try:
+                        cell = bound.by_first.get(args[0])
+                    except (AttributeError, IndexError, TypeError):
+                        cell = None
+                    if cell is None:
+                        cell = metrics._labelled_cell(bound, histogram_name, label, args)
+                    cell.append(elapsed_ns)
+                    if len(cell) >= FOLD_SAMPLES:
+                        cell.fold()
+
+        setattr(owner, attribute, timed)
+        self._instrumented.append((owner, attribute, original))
+        return timed
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        while self._instrumented:
+            owner, attribute, original = self._instrumented.pop()
+            setattr(owner, attribute, original)
+
+    def reset(self):
+        for counters, cells in self._all_cells():
+            counters.clear()
+            for cell in list(cells.values()):
+                cell.clear()
+
+    def _thread_cells(self):
+        # this thread's (counters, histogram cells), only ever written by this thread
+        try:
+            return self._local.cells
+        except AttributeError:
+            cells = self._local.cells = ({}, {})
+            with self._lock:
+                self._cells.append(cells)
+            return cells
+
+    def _cell(self, name, label_value):
+        try:
+            cells = self._local.cells[1]
+        except AttributeError:
+            cells = self._thread_cells()[1]
+        cell = cells.get((name, label_value))
+        if cell is None:
+            cell = cells[(name, label_value)] = _Cell()
+        return cell
+
+    def _labelled_cell(self, bound, histogram_name, label, args):
+        label_value = label(*args)
+        cell = self._cell(histogram_name, label_value)
+        # only label values are kept as keys, so the cache stays as small as the label's value set
+        if args and isinstance(args[0], str) and args[0] == label_value:
+            try:
+                bound.by_first[label_value] = cell
+            except AttributeError:
+                bound.by_first = {label_value: cell}
+        return cell
+
+    def _all_cells(self):
+        with self._lock:
+            return list(self._cells)
+
+    def render(self):
+        # Prometheus text exposition format
+        lines = []
+        counters = dict(self.counters)
+        histograms = dict(self.histograms)
+        for name, (metric_type, label_name, help_text) in sorted(self.definitions.items()):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            if metric_type == 'gauge':
+                lines.append(f'{name} {self.gauges[name]()}')
+                continue
+            if metric_type == 'counter':
+                for (metric_name, label_value), count in sorted(counters.items()):
+                    if metric_name == name:
+                        lines.append(f'{name}{{{label_name}="{label_value}"}} {count}')
+                continue
+
+            for (metric_name, label_value), histogram in sorted(histograms.items()):
+                if metric_name != name:
+                    continue
+                label = f'{label_name}="{label_value}"'
+                cumulative = 0
+                for bound, count in zip(BUCKET_BOUNDS + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{label}}} {histogram.total_ns / 1e9}')
+                lines.append(f'{name}_count{{{label}}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        # serves render() at /metrics from a background thread, returns the server
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+        return server
+
+
+# shared by every service
+metrics = Metrics()
+metrics.define('atm_command_seconds', 'histogram', 'command', 'process_command latency by command.')
+metrics.define('atm_service_seconds', 'histogram', 'method', 'Service method latency.')
+metrics.define('atm_withdrawals_total', 'counter', 'outcome', 'Withdrawals by outcome.')
+metrics.define('atm_deposits_total', 'counter', 'outcome', 'Deposits by outcome.')
+metrics.define('atm_repeated_requests_total', 'counter', 'command', 'Retried requests answered from the cache.')
+metrics.define('atm_conflicting_requests_total', 'counter', 'command',
+               'Requests refused for reusing a request ID with different parameters.')
+metrics.define('atm_authorizations_total', 'counter', 'outcome', 'Authorization attempts by outcome.')
+metrics.define('atm_logouts_total', 'counter', 'reason', 'Logouts by reason.')
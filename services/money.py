@@ -0,0 +1,12 @@
+# balances and amounts are kept as integer cents internally to avoid float rounding
+
+
+def to_cents(value):
+    return int(round(value * 100))
+
+
+def from_cents(cents):
+    # whole dollar amounts display without a decimal part, like the original int values did
+    if cents % 100 == 0:
+        return cents // 100
+    return cents / 100
@@ -0,0 +1,129 @@
+import cProfile
+import functools
+import os
+import pstats
+import random
+import threading
+import time
+import zlib
+
+# sessions are sampled by a hash of their id into this many buckets
+SAMPLE_BUCKETS = 10000
+
+# held while a profile is enabled. From Python 3.12 cProfile allows one enabled profile per process,
+# so a call made while another is being profiled, nested or on another thread, runs unprofiled
+_profiling = threading.Lock()
+
+
+# opt-in cProfile attribution of command dispatch, with one pstats file per command written when stopped.
+# Sampling is per session, so a sampled session is profiled for every command it sends and the others only
+# pay for a hash of their session id. The hash is salted afresh by every start(), so each round samples
+# different sessions and a long-lived session id isn't left out of every round. One call is profiled at a time.
+# Each thread keeps its own profile per command, since cProfile only sees the thread that enabled it,
+# and the profiles are merged when written.
+# Like metrics, wrappers are only installed by instrument() and do nothing but check a flag while stopped.
+class Profiler:
+
+    def __init__(self):
+        self.running = False
+        self.directory = None
+        self.sample_rate = 0.0
+        self._threshold = 0
+        self._salt = 0
+        self._started = None
+        self._local = threading.local()
+        self._profiles = []  # (label, cProfile.Profile) for every thread and label since start()
+        self._lock = threading.Lock()
+        self._instrumented = []
+
+    def instrument(self, owner, attribute, label, sample_key):
+        # wraps owner.attribute (a method on a class, or a function on a module) so sampled calls are profiled
+        # along with everything beneath them. label(*args) names the pstats file the call is added to, like a
+        # metrics label, and sample_key(*args, **kwargs) returns the session id sampling is decided by
+        original = getattr(owner, attribute)
+        profiler = self
+
+        @functools.wraps(original)
+        def profiled(*args, **kwargs):
+            if not profiler.running or not profiler.is_sampled(sample_key(*args, **kwargs)) \
+                    or not _profiling.acquire(blocking=False):
+                return original(*args, **kwargs)
+            try:
+                profile = profiler._profile_for(label(*args))
+                profile.enable()
+            except ValueError:  # another profiling tool is active
+                _profiling.release()
+                return original(*args, **kwargs)
+            try:
+                return original(*args, **kwargs)
+            finally:
+                profile.disable()
+                _profiling.release()
+
+        setattr(owner, attribute, profiled)
+        self._instrumented.append((owner, attribute, original))
+        return profiled
+
+    def uninstrument(self):
+        while self._instrumented:
+            owner, attribute, original = self._instrumented.pop()
+            setattr(owner, attribute, original)
+
+    def is_sampled(self, key):
+        return zlib.crc32(str(key).encode(), self._salt) % SAMPLE_BUCKETS < self._threshold
+
+    def start(self, directory, sample_rate=0.01):
+        # sample_rate: fraction of sessions profiled
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self.directory = directory
+            self.sample_rate = sample_rate
+            self._threshold = int(sample_rate * SAMPLE_BUCKETS)
+            self._salt = random.getrandbits(32)
+            self._started = time.strftime('%Y%m%d-%H%M%S')
+            self.running = True
+
+    def stop(self):
+        # writes <directory>/<label>-<start time>.pstats per command profiled since start(), returns the paths
+        with self._lock:
+            self.running = False
+            profiles, self._profiles = self._profiles, []
+            self._local = threading.local()
+
+        merged = {}
+        for label, profile in profiles:
+            if not profile.getstats():
+                continue  # never enabled, pstats refuses an empty profile
+            if label in merged:
+                merged[label].add(profile)
+            else:
+                merged[label] = pstats.Stats(profile)
+
+        paths = []
+        for label, stats in sorted(merged.items()):
+            path = os.path.join(self.directory, f'{label}-{self._started}.pstats')
+            stats.dump_stats(path)
+            paths.append(path)
+        return paths
+
+    def toggle(self):
+        # stops and writes the profiles when running, starts again with the last settings otherwise
+        if self.running:
+            return self.stop()
+        self.start(self.directory, self.sample_rate)
+        return []
+
+    def _profile_for(self, label):
+        profiles = getattr(self._local, 'profiles', None)
+        if profiles is None:
+            profiles = self._local.profiles = {}
+        profile = profiles.get(label)
+        if profile is None:
+            profile = profiles[label] = cProfile.Profile()
+            with self._lock:
+                self._profiles.append((label, profile))
+        return profile
+
+
+# shared by every service
+profiler = Profiler()
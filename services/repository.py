@@ -0,0 +1,33 @@
+from services.atm_fleet import DEFAULT_TERMINAL
+from services.credentials import hash_pin
+from services.transaction_history import AccountHistory
+
+# account_id -> (PIN, opening balance) for the accounts every fresh ATM starts with
+DEFAULT_ACCOUNTS = {
+    '2859459814': ('7386', 10.24),
+    '1434597300': ('4557', 90000.55),
+    '7089382418': ('0075', 0.00),
+    '2001377812': ('5950', 60.00)
+}
+# cash in the default terminal's drawer
+DEFAULT_ATM_CASH = 10000.00
+
+
+# accounts held in process memory, nothing survives a restart.
+# Repositories hand out state in the ledger's snapshot format so AtmService restores from either the same way.
+class MemoryRepository:
+
+    def __init__(self, accounts=None, atm_cash=DEFAULT_ATM_CASH):
+        self.accounts = DEFAULT_ACCOUNTS if accounts is None else accounts
+        self.atm_cash = atm_cash
+
+    def load_state(self):
+        return {
+            'atm_cash': {DEFAULT_TERMINAL: self.atm_cash},
+            'account_balances': {account_id: balance for account_id, (_, balance) in self.accounts.items()},
+            'transaction_history': {account_id: AccountHistory().to_columns() for account_id in self.accounts}
+        }
+
+    def load_pins(self):
+        # account_id -> (salt, PIN digest)
+        return {account_id: hash_pin(pin) for account_id, (pin, _) in self.accounts.items()}
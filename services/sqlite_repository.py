@@ -0,0 +1,301 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from services.atm_fleet import DEFAULT_TERMINAL
+from services.account_store import display
+from services.money import from_cents, to_cents
+from services.repository import MemoryRepository
+from services.transaction_history import WITHDRAWAL, LazyHistories
+
+# prepared statements kept per connection, sqlite3 caches them by SQL text
+STATEMENT_CACHE_SIZE = 64
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS accounts (
+    account_id TEXT PRIMARY KEY,
+    pin_salt BLOB NOT NULL,
+    pin_digest BLOB NOT NULL,
+    balance_cents INTEGER NOT NULL,
+    float_display INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS history (
+    position INTEGER PRIMARY KEY AUTOINCREMENT,
+    account_id TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    amount_cents INTEGER NOT NULL,
+    balance_cents INTEGER NOT NULL,
+    kind INTEGER NOT NULL,
+    terminal_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_by_account ON history (account_id, position);
+CREATE TABLE IF NOT EXISTS terminals (
+    terminal_id TEXT PRIMARY KEY,
+    cash_cents INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cash_loads (
+    terminal_id TEXT PRIMARY KEY,
+    loaded_cents INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cassettes (
+    terminal_id TEXT NOT NULL,
+    denomination INTEGER NOT NULL,
+    notes INTEGER NOT NULL,
+    strategy TEXT NOT NULL,
+    PRIMARY KEY (terminal_id, denomination)
+);
+'''
+
+INSERT_ACCOUNT = 'INSERT INTO accounts (account_id, pin_salt, pin_digest, balance_cents, float_display) ' \
+                 'VALUES (?, ?, ?, ?, ?)'
+# float_display: the balance was last written as a float, so it displays with a decimal part as it does in memory
+UPDATE_BALANCE = 'UPDATE accounts SET balance_cents = ?, float_display = ? WHERE account_id = ?'
+# for databases from before float_display existed, whose balances displayed as from_cents() does
+ADD_FLOAT_DISPLAY = 'ALTER TABLE accounts ADD COLUMN float_display INTEGER NOT NULL DEFAULT 0'
+INSERT_HISTORY = 'INSERT INTO history (account_id, timestamp, amount_cents, balance_cents, kind, terminal_id) ' \
+                 'VALUES (?, ?, ?, ?, ?, ?)'
+INSERT_TERMINAL = 'INSERT OR IGNORE INTO terminals (terminal_id, cash_cents) VALUES (?, 0)'
+ADD_CASH = 'UPDATE terminals SET cash_cents = cash_cents + ? WHERE terminal_id = ?'
+ADD_NOTES = 'INSERT INTO cassettes (terminal_id, denomination, notes, strategy) VALUES (?, ?, ?, ?) ' \
+            'ON CONFLICT (terminal_id, denomination) DO UPDATE SET notes = notes + excluded.notes'
+# every cent ever loaded into each drawer, so the drawers can be reconciled against what was dispensed
+ADD_LOADED = 'INSERT INTO cash_loads (terminal_id, loaded_cents) VALUES (?, ?) ' \
+             'ON CONFLICT (terminal_id) DO UPDATE SET loaded_cents = loaded_cents + excluded.loaded_cents'
+# for databases from before cash_loads existed: assume what they hold now plus what they dispensed was loaded
+BACKFILL_LOADED = 'INSERT INTO cash_loads (terminal_id, loaded_cents) ' \
+                  'SELECT terminal_id, cash_cents - (SELECT COALESCE(SUM(amount_cents), 0) FROM history ' \
+                  'WHERE history.terminal_id = terminals.terminal_id AND kind = ?) FROM terminals'
+REMOVE_NOTES = 'UPDATE cassettes SET notes = notes - ? WHERE terminal_id = ? AND denomination = ?'
+SELECT_BALANCES = 'SELECT account_id, balance_cents, float_display FROM accounts'
+SELECT_ACCOUNT = 'SELECT 1 FROM accounts WHERE account_id = ?'
+SELECT_PINS = 'SELECT account_id, pin_salt, pin_digest FROM accounts'
+SELECT_ACCOUNT_HISTORY = 'SELECT timestamp, amount_cents, balance_cents, kind FROM history ' \
+                         'WHERE account_id = ? ORDER BY position'
+COUNT_ACCOUNT_HISTORY = 'SELECT COUNT(*) FROM history WHERE account_id = ?'
+SELECT_TERMINALS = 'SELECT terminal_id, cash_cents FROM terminals'
+SELECT_CASSETTES = 'SELECT terminal_id, denomination, notes, strategy FROM cassettes'
+
+
+# accounts, history and cash drawers in a SQLite database, so state survives restarts without a database server.
+# It stands in for the Ledger: AtmService writes the same records to it, and appends are group committed so a
+# whole batch of withdrawals lands in a single transaction. The database runs in WAL mode so reader threads,
+# each borrowing a connection from a small pool, never block the writer or each other.
+class SqliteRepository:
+
+    def __init__(self, path, synchronous=True, group_size=64, readers=4, seed=None):
+        # synchronous: append() only returns once its record is committed
+        # group_size: with synchronous=False, commit once this many records are pending
+        # readers: connections kept for reader threads
+        # seed: repository the accounts are copied from when the database is new, the default accounts otherwise
+        self.path = path
+        self.synchronous = synchronous
+        self.group_size = group_size
+
+        self.sequence = 0
+        self.commit_count = 0
+
+        self._pending = []
+        self._durable_sequence = 0
+        self._syncing = False
+        self._condition = threading.Condition()
+
+        self._writer = self._connect()
+        self._writer.execute('PRAGMA journal_mode=WAL')
+        tracked_loads = self._writer.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cash_loads'").fetchone()
+        self._writer.executescript(SCHEMA)
+        if 'float_display' not in [column[1] for column in self._writer.execute('PRAGMA table_info(accounts)')]:
+            with self._writer:
+                self._writer.execute(ADD_FLOAT_DISPLAY)
+        if self._writer.execute('SELECT COUNT(*) FROM accounts').fetchone()[0] == 0:
+            self._seed(seed or MemoryRepository())
+        elif not tracked_loads:
+            with self._writer:
+                self._writer.execute(BACKFILL_LOADED, (WITHDRAWAL,))
+
+        self._readers = queue.LifoQueue()
+        self._reader_count = readers
+        self._created_readers = 0
+        self._reader_lock = threading.Lock()
+
+    def load_state(self):
+        # history is left in the database and loaded per account on first use
+        with self.reader() as connection:
+            # one read transaction, so both tables come from the same WAL snapshot
+            connection.execute('BEGIN')
+            try:
+                balances = {account_id: display(balance, float_display)
+                            for account_id, balance, float_display in connection.execute(SELECT_BALANCES)}
+                terminals = {terminal_id: from_cents(cash)
+                             for terminal_id, cash in connection.execute(SELECT_TERMINALS)}
+                cassettes = {}
+                for terminal_id, denomination, notes, strategy in connection.execute(SELECT_CASSETTES):
+                    cassette = cassettes.setdefault(terminal_id, {'notes': {}, 'strategy': strategy})
+                    cassette['notes'][denomination] = notes
+            finally:
+                connection.execute('COMMIT')
+
+        return {
+            'atm_cash': terminals,
+            'atm_cassettes': cassettes,
+            'account_balances': balances,
+            'transaction_history': LazyHistories(self.load_history_columns, list(balances), self.count_history)
+        }
+
+    def load_pins(self):
+        with self.reader() as connection:
+            return {account_id: (salt, digest) for account_id, salt, digest in connection.execute(SELECT_PINS)}
+
+    def load_history(self, account_id):
+        # (timestamp, amount, balance, kind) rows in cents, oldest first.
+        # Records still waiting for a group commit are written first so none are missing
+        self.commit()
+        with self.reader() as connection:
+            return connection.execute(SELECT_ACCOUNT_HISTORY, (account_id,)).fetchall()
+
+    def count_history(self, account_id):
+        # number of events in the database. An account with records waiting for a group commit has had its
+        # history loaded, so it is only ever asked about accounts with nothing pending
+        with self.reader() as connection:
+            return connection.execute(COUNT_ACCOUNT_HISTORY, (account_id,)).fetchone()[0]
+
+    def load_history_columns(self, account_id):
+        # the account's history as (timestamps, amounts, balances, kinds) columns, or None for unknown accounts
+        rows = self.load_history(account_id)
+        if not rows:
+            with self.reader() as connection:
+                if connection.execute(SELECT_ACCOUNT, (account_id,)).fetchone() is None:
+                    return None
+            return [[], [], [], []]
+        return [list(column) for column in zip(*rows)]
+
+    @contextmanager
+    def reader(self):
+        # borrows a read-only connection, opening one while fewer than `readers` exist and blocking otherwise
+        try:
+            connection = self._readers.get_nowait()
+        except queue.Empty:
+            with self._reader_lock:
+                create = self._created_readers < self._reader_count
+                if create:
+                    self._created_readers += 1
+            if create:
+                connection = self._connect()
+                connection.execute('PRAGMA query_only=ON')
+            else:
+                connection = self._readers.get()
+        try:
+            yield connection
+        finally:
+            self._readers.put(connection)
+
+    # Ledger interface
+
+    def recover(self):
+        # the tables already include every committed record, so there is nothing to replay
+        return self.load_state(), []
+
+    def append(self, record):
+        return self.append_all([record])
+
+    def append_all(self, records):
+        # the records of one transaction, always written in the same database transaction
+        with self._condition:
+            self.sequence += 1
+            sequence = self.sequence
+            self._pending.extend(records)
+            pending = sequence - self._durable_sequence
+
+        if self.synchronous or pending >= self.group_size:
+            self.commit(sequence)
+        return sequence
+
+    def commit(self, sequence=None):
+        # group commit: one caller writes every pending record in a single transaction,
+        # everyone else waiting on an already covered sequence just wakes up.
+        # A failed write keeps its records pending and raises, so each waiter retries them and sees the error
+        # if it persists, rather than returning as if its record were committed
+        with self._condition:
+            if sequence is None:
+                sequence = self.sequence
+            while self._durable_sequence < sequence:
+                if self._syncing:
+                    self._condition.wait()
+                    continue
+                self._syncing = True
+                target = self.sequence
+                records, self._pending = self._pending, []
+                written = False
+                self._condition.release()
+                try:
+                    self._write(records)
+                    written = True
+                finally:
+                    self._condition.acquire()
+                    self._syncing = False
+                    if not written:
+                        self._pending[:0] = records
+                    self._condition.notify_all()
+                self.commit_count += 1
+                self._durable_sequence = target
+
+    def snapshot(self, sequence, state):
+        pass  # the tables are always current
+
+    def close(self):
+        if self._writer is None:
+            return
+        self.commit()
+        self._writer.close()
+        self._writer = None
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+
+    def _write(self, records):
+        with self._writer:  # one transaction, rolled back if any statement fails
+            for record in records:
+                if 'cash_loaded' in record:
+                    self._writer.execute(INSERT_TERMINAL, (record['terminal_id'],))
+                    self._writer.execute(ADD_CASH, (to_cents(record['cash_loaded']), record['terminal_id']))
+                    self._writer.execute(ADD_LOADED, (record['terminal_id'], to_cents(record['cash_loaded'])))
+                    continue
+                if 'notes_loaded' in record:
+                    self._writer.execute(INSERT_TERMINAL, (record['terminal_id'],))
+                    for denomination, notes in record['notes_loaded'].items():
+                        self._writer.execute(ADD_NOTES, (record['terminal_id'], int(denomination), notes,
+                                                         record['strategy']))
+                        self._writer.execute(ADD_CASH, (to_cents(int(denomination) * notes), record['terminal_id']))
+                        self._writer.execute(ADD_LOADED, (record['terminal_id'], to_cents(int(denomination) * notes)))
+                    continue
+
+                timestamp, amount, balance, kind = record['history']
+                self._writer.execute(UPDATE_BALANCE, (balance, isinstance(record.get('balance'), float),
+                                                      record['account_id']))
+                self._writer.execute(INSERT_HISTORY, (record['account_id'], timestamp, amount, balance, kind,
+                                                      record['terminal_id']))
+                if kind == WITHDRAWAL:
+                    self._writer.execute(ADD_CASH, (amount, record['terminal_id']))
+                for denomination, notes in record.get('notes', {}).items():
+                    self._writer.execute(REMOVE_NOTES, (notes, record['terminal_id'], int(denomination)))
+
+    def _seed(self, repository):
+        state = repository.load_state()
+        pins = repository.load_pins()
+        with self._writer:
+            self._writer.executemany(INSERT_ACCOUNT, [
+                (account_id, *pins[account_id], to_cents(balance), isinstance(balance, float))
+                for account_id, balance in state['account_balances'].items()])
+            self._writer.executemany(INSERT_HISTORY, [
+                (account_id, *event, DEFAULT_TERMINAL)
+                for account_id, columns in state['transaction_history'].items() for event in zip(*columns)])
+            self._writer.executemany('INSERT INTO terminals (terminal_id, cash_cents) VALUES (?, ?)',
+                                     [(terminal_id, to_cents(cash)) for terminal_id, cash in state['atm_cash'].items()])
+            self._writer.executemany(ADD_LOADED, [(terminal_id, to_cents(cash))
+                                                  for terminal_id, cash in state['atm_cash'].items()])
+
+    def _connect(self):
+        # connections are shared between threads, but only ever used by one at a time
+        connection = sqlite3.connect(self.path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        connection.execute('PRAGMA synchronous=FULL')
+        return connection
@@ -0,0 +1,60 @@
+from collections import OrderedDict, deque
+
+
+# sliding-window failure counters with lockout, keyed by account or terminal.
+# Each key keeps at most max_failures timestamps and the table keeps at most capacity keys, so memory stays
+# capped however many keys an attacker tries. Once full, a new key evicts the least recently failed key that
+# isn't locked out, and is not tracked at all if every key is locked: flooding the table with fresh keys
+# never lifts a lockout.
+class FailureThrottle:
+
+    def __init__(self, max_failures=5, window=300, lockout=900, capacity=100000):
+        self.max_failures = max_failures
+        self.window = window  # seconds the failures have to fall within
+        self.lockout = lockout  # seconds a key stays locked once it has max_failures in the window
+        self.capacity = capacity
+        self._entries = OrderedDict()  # key -> recent failure times, least recently failed first
+        # key -> locked until, in the order the lockouts end since every lockout is equally long
+        self._locked = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries) + len(self._locked)
+
+    def is_locked(self, key, now):
+        return self._locked.get(key, 0) > now
+
+    def record_failure(self, key, now):
+        # returns True when this failure locks the key
+        self._evict_expired(now)
+        if key in self._locked:
+            return False
+        times = self._entries.get(key)
+        if times is None:
+            if len(self) >= self.capacity:
+                if not self._entries:
+                    return False
+                self._entries.popitem(last=False)
+            times = self._entries[key] = deque(maxlen=self.max_failures)
+        else:
+            self._entries.move_to_end(key)
+
+        times.append(now)
+        if len(times) == self.max_failures and times[0] > now - self.window:
+            del self._entries[key]
+            self._locked[key] = now + self.lockout
+            return True
+        return False
+
+    def reset(self, key):
+        self._entries.pop(key, None)
+        self._locked.pop(key, None)
+
+    def _evict_expired(self, now):
+        # both tables are ordered so that stale entries are always at the front
+        while self._entries:
+            times = next(iter(self._entries.values()))
+            if times[-1] > now - self.window:
+                break
+            self._entries.popitem(last=False)
+        while self._locked and next(iter(self._locked.values())) <= now:
+            self._locked.popitem(last=False)
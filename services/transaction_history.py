@@ -0,0 +1,157 @@
+import threading
+from array import array
+from bisect import bisect_left
+from collections.abc import MutableMapping
+from datetime import datetime
+
+from services.money import from_cents
+
+# event kinds
+DEPOSIT = 1
+WITHDRAWAL = 2
+FEE = 3
+INTEREST = 4
+
+
+def format_event(timestamp, amount, balance):
+    formatted = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+    return f'{formatted} {from_cents(amount)} {from_cents(balance)}'
+
+
+# append-only, array backed history for a single account
+# events are stored oldest first as epoch seconds and integer cents, and iterated newest first
+class AccountHistory:
+    __slots__ = ('timestamps', 'amounts', 'balances', 'kinds', 'withdrawn')
+
+    def __init__(self):
+        self.timestamps = array('q')
+        self.amounts = array('q')
+        self.balances = array('q')
+        self.kinds = array('b')
+        # running total of cash withdrawn up to and including each event
+        self.withdrawn = array('q')
+
+    def append(self, timestamp, amount, balance, kind=None):
+        if kind is None:
+            kind = DEPOSIT if amount > 0 else WITHDRAWAL
+        # timestamps must stay sorted for range lookups, so a clock stepping backwards is clamped
+        if self.timestamps and timestamp < self.timestamps[-1]:
+            timestamp = self.timestamps[-1]
+
+        withdrawn = self.withdrawn[-1] if self.withdrawn else 0
+        if kind == WITHDRAWAL:
+            withdrawn -= amount
+
+        self.timestamps.append(timestamp)
+        self.amounts.append(amount)
+        self.balances.append(balance)
+        self.kinds.append(kind)
+        self.withdrawn.append(withdrawn)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __iter__(self):
+        return self.iter_events()
+
+    def iter_events(self, before=None, after=0):
+        # newest first, from just below position `before` down to position `after` (indexes into the columns)
+        if before is None:
+            before = len(self.timestamps)
+        for index in range(before - 1, after - 1, -1):
+            yield self.timestamps[index], self.amounts[index], self.balances[index]
+
+    def page(self, limit, before=None):
+        # positions never shift because the columns are append-only,
+        # so a position is a stable cursor no matter how many events arrive between pages
+        if before is None:
+            before = len(self.timestamps)
+        start = max(before - limit, 0)
+        events = [(self.timestamps[index], self.amounts[index], self.balances[index])
+                  for index in range(before - 1, start - 1, -1)]
+        next_before = start if start > 0 else None
+        return events, next_before
+
+    def positions_between(self, start=None, end=None):
+        # positions of the events with start <= timestamp < end
+        low = 0 if start is None else bisect_left(self.timestamps, start)
+        high = len(self.timestamps) if end is None else bisect_left(self.timestamps, end)
+        return low, max(low, high)
+
+    def iter_between(self, start=None, end=None):
+        low, high = self.positions_between(start, end)
+        return self.iter_events(high, low)
+
+    def withdrawn_between(self, start=None, end=None):
+        # O(log n) via the running totals, no matter how many events fall in the window
+        low, high = self.positions_between(start, end)
+        if low == high:
+            return 0
+        before_window = self.withdrawn[low - 1] if low else 0
+        return self.withdrawn[high - 1] - before_window
+
+    def to_columns(self):
+        return [self.timestamps.tolist(), self.amounts.tolist(), self.balances.tolist(), self.kinds.tolist()]
+
+    @classmethod
+    def from_columns(cls, columns):
+        history = cls()
+        for event in zip(*columns):
+            history.append(*event)
+        return history
+
+
+# account_id -> AccountHistory, loading each account's history on first access,
+# so opening a large store costs nothing per account until that account's history is needed
+class LazyHistories(MutableMapping):
+
+    def __init__(self, load, account_ids, count=None):
+        # load(account_id) returns the account's (timestamps, amounts, balances, kinds) columns, or None
+        # account_ids: every account load() knows about
+        # count(account_id) returns the number of events load() would return, 0 for unknown accounts
+        self._load = load
+        self._account_ids = account_ids
+        self._count = count
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, account_id):
+        history = self._loaded.get(account_id)
+        if history is not None:
+            return history
+        columns = self._load(account_id)
+        if columns is None:
+            raise KeyError(account_id)
+        history = AccountHistory.from_columns(columns)
+        with self._lock:
+            # a concurrent first access may have won, keep whichever copy was published first
+            return self._loaded.setdefault(account_id, history)
+
+    def __setitem__(self, account_id, history):
+        self._loaded[account_id] = history
+
+    def __delitem__(self, account_id):
+        del self._loaded[account_id]
+
+    def __iter__(self):
+        return iter(dict.fromkeys([*self._account_ids, *self._loaded]))
+
+    def __len__(self):
+        return len(dict.fromkeys([*self._account_ids, *self._loaded]))
+
+    def length(self, account_id):
+        # the account's number of events, without loading it if it isn't already and count() was given
+        history = self._loaded.get(account_id)
+        if history is not None:
+            return len(history)
+        if self._count is not None:
+            return self._count(account_id)
+        history = self.get(account_id)
+        return len(history) if history is not None else 0
+
+    def columns(self, account_id):
+        # the account's columns, without loading it if it isn't already
+        history = self._loaded.get(account_id)
+        if history is not None:
+            return [history.timestamps, history.amounts, history.balances, history.kinds]
+        return self._load(account_id)
@@ -0,0 +1,62 @@
+from itertools import product
+
+from services.money import to_cents
+
+# what a withdrawal that dispenses cash is decided on:
+# partial - the terminal couldn't dispense the full amount, overdraws - the amount dispensed exceeds the balance
+FACTS = ('partial', 'overdraws')
+
+
+# one policy rule: when every fact in `when` has the given value, its effects apply.
+# Rules are applied in order, so a later, more specific rule overrides what an earlier one set
+class Rule:
+    __slots__ = ('when', 'effects')
+
+    def __init__(self, when=None, **effects):
+        # effects:
+        #   outcome - label for the atm_withdrawals_total metric
+        #   notice - line shown before the amount dispensed
+        #   fee - fee charged in dollars, with fee_name (its log event) and fee_notice (shown before the balance)
+        self.when = when or {}
+        self.effects = effects
+
+
+WITHDRAWAL_RULES = [
+    Rule(outcome='dispensed'),
+    Rule({'partial': True}, outcome='partial', notice='Unable to dispense full amount requested at this time. \n'),
+    Rule({'overdraws': True}, outcome='overdraft', fee=5.00, fee_name='Overdraft',
+         fee_notice='You have been charged an overdraft fee of $5. '),
+    Rule({'partial': True, 'overdraws': True}, outcome='partial_overdraft')
+]
+
+
+# everything a withdrawal does once the facts are known, precomputed for one combination of facts
+class Decision:
+    __slots__ = ('outcome', 'fee', 'fee_cents', 'fee_name', 'message')
+
+    def __init__(self, outcome, notice='', fee=0, fee_name=None, fee_notice=''):
+        self.outcome = outcome
+        self.fee = fee
+        self.fee_cents = to_cents(fee)
+        self.fee_name = fee_name
+        # filled in with the amount dispensed and the balance
+        self.message = notice + 'Amount dispensed: ${amount}. \n ' + fee_notice + 'Current balance: ${balance}.'
+
+
+# the rules resolved into a flat table with a decision for every combination of facts, so a withdrawal
+# is decided with one lookup however many rules there are
+class WithdrawalPolicy:
+
+    def __init__(self, rules=WITHDRAWAL_RULES):
+        self.table = []
+        # facts are bits of the table index, in FACTS order with the first fact the highest bit
+        for values in product((False, True), repeat=len(FACTS)):
+            facts = dict(zip(FACTS, values))
+            effects = {}
+            for rule in rules:
+                if all(facts[fact] == value for fact, value in rule.when.items()):
+                    effects.update(rule.effects)
+            self.table.append(Decision(**effects))
+
+    def decide(self, partial, overdraws):
+        return self.table[partial << 1 | overdraws]
@@ -0,0 +1,236 @@
+import itertools
+import multiprocessing
+import threading
+import zlib
+from concurrent.futures import Future
+
+from services.atm_fleet import DEFAULT_TERMINAL, AtmFleet
+from services.atm_service import AtmService
+from services.cassettes import FEWEST_NOTES, accepts
+from services.log_pipeline import log
+from services.money import from_cents, to_cents
+from services.repository import DEFAULT_ATM_CASH, MemoryRepository
+
+
+def shard_for(account_id, shards):
+    # stable across processes and restarts, unlike hash()
+    return zlib.crc32(account_id.encode()) % shards
+
+
+# accounts partitioned across worker processes, so account work runs on as many cores as there are shards.
+# It stands in for AtmService in main.process_command: sessions stay in the router process, and every account
+# command is forwarded over a pipe to the one shard that owns the account's balance and history.
+# Cash drawers are shared by all accounts, so they stay in the router: a withdrawal reserves cash from the
+# drawer before it is forwarded, the shard dispenses from that reservation only, and whatever it doesn't
+# dispense goes back in the drawer. Concurrent withdrawals at the same terminal may see a drawer that is
+# briefly short by another's reservation, but cash can never be dispensed twice.
+class ShardRouter:
+
+    def __init__(self, shards, log_file=None):
+        # log_file: each shard logs to log_file.shard-<index>
+        self.fleet = AtmFleet()
+        self.fleet.register(DEFAULT_TERMINAL, DEFAULT_ATM_CASH)
+
+        context = multiprocessing.get_context('spawn')
+        self._request_ids = itertools.count()
+        self._connections = []
+        self._send_locks = []
+        self._pending = []  # per shard: request id -> Future
+        self._exited = []  # per shard: its pipe has closed
+        self._processes = []
+        self._receivers = []
+        for index in range(shards):
+            connection, child_connection = context.Pipe()
+            shard_log_file = f'{log_file}.shard-{index}' if log_file else None
+            process = context.Process(target=run_shard, args=(child_connection, index, shards, shard_log_file),
+                                      name=f'atm-shard-{index}', daemon=True)
+            process.start()
+            child_connection.close()
+            self._connections.append(connection)
+            self._send_locks.append(threading.Lock())
+            self._pending.append({})
+            self._exited.append(False)
+            self._processes.append(process)
+
+        for index, connection in enumerate(self._connections):
+            receiver = threading.Thread(target=self._receive, args=(index, connection),
+                                        name=f'atm-shard-{index}-receiver', daemon=True)
+            receiver.start()
+            self._receivers.append(receiver)
+
+    @property
+    def shards(self):
+        return len(self._connections)
+
+    def call(self, shard, method, *args):
+        # runs method on the shard and waits for its result, many threads can have calls in flight at once
+        return self._submit(shard, method, args).result()
+
+    def close(self):
+        for connection, send_lock in zip(self._connections, self._send_locks):
+            with send_lock:
+                connection.send(None)
+        for process in self._processes:
+            process.join()
+        for receiver in self._receivers:
+            receiver.join()
+
+    # AtmService interface used by process_command
+
+    def withdraw(self, account_id, value, terminal_id=DEFAULT_TERMINAL, request_id=None):
+        out_of_service = self.fleet.is_out_of_service(terminal_id)
+        denominations = self.fleet.denominations(terminal_id)
+        reserved, notes = self.fleet.reserve_notes(terminal_id, value) if value > 0 else (0, None)
+        try:
+            result, unused_cents = self.call(shard_for(account_id, self.shards), 'withdraw',
+                                             account_id, value, terminal_id, request_id, out_of_service,
+                                             to_cents(reserved), denominations, notes)
+        except BaseException:
+            self.fleet.load(terminal_id, reserved, notes)
+            raise
+        # a shard dispenses all of the reservation or none of it, so unused notes are the reserved notes
+        if unused_cents:
+            self.fleet.load(terminal_id, from_cents(unused_cents), notes)
+        return result
+
+    def deposit(self, account_id, value, request_id=None):
+        return self.call(shard_for(account_id, self.shards), 'deposit', account_id, value, request_id)
+
+    def get_balance(self, account_id):
+        return self.call(shard_for(account_id, self.shards), 'get_balance', account_id)
+
+    def get_history_since(self, account_id, start):
+        return self.call(shard_for(account_id, self.shards), 'get_history_since', account_id, start)
+
+    def get_history_by_account_id(self, account_id, limit=None, cursor=None):
+        return self.call(shard_for(account_id, self.shards), 'get_history_by_account_id', account_id, limit, cursor)
+
+    def load_cash(self, terminal_id, amount):
+        if terminal_id not in self.fleet.terminals:
+            self.fleet.register(terminal_id, 0)
+        self.fleet.load(terminal_id, amount)
+
+    def load_notes(self, terminal_id, notes, strategy=FEWEST_NOTES):
+        if terminal_id not in self.fleet.terminals:
+            self.fleet.register(terminal_id, 0, notes={}, strategy=strategy)
+        self.fleet.load(terminal_id, sum(denomination * count for denomination, count in notes.items()), notes)
+
+    # end of day sweeps run on every shard at once
+
+    def assess_overdraft_fees(self, fee=5.00):
+        return sum(self._broadcast('assess_overdraft_fees', fee))
+
+    def accrue_interest(self, rate):
+        return sum(self._broadcast('accrue_interest', rate))
+
+    def get_total_liability(self):
+        return from_cents(sum(self._broadcast('total_liability_cents')))
+
+    def _broadcast(self, method, *args):
+        futures = [self._submit(shard, method, args) for shard in range(self.shards)]
+        return [future.result() for future in futures]
+
+    def _submit(self, shard, method, args):
+        request_id = next(self._request_ids)
+        future = Future()
+        self._pending[shard][request_id] = future
+        # checked after registering, so either this sees the exit or the receiver sees the future
+        if self._exited[shard]:
+            self._pending[shard].pop(request_id, None)
+            raise RuntimeError(f'Shard {shard} exited.')
+        with self._send_locks[shard]:
+            self._connections[shard].send((request_id, method, args))
+        return future
+
+    def _receive(self, shard, connection):
+        pending = self._pending[shard]
+        try:
+            while True:
+                request_id, result = connection.recv()
+                future = pending.pop(request_id)
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except (EOFError, OSError):
+            pass
+        self._exited[shard] = True
+        for future in list(pending.values()):
+            future.set_exception(RuntimeError(f'Shard {shard} exited.'))
+        pending.clear()
+
+
+# stands in for the AtmFleet inside a shard, holding just the cash the router reserved for one withdrawal
+class ReservedCash:
+
+    def __init__(self):
+        self.out_of_service = False
+        self.available = 0  # cents
+        # the terminal's denominations and the notes reserved, None without cassettes
+        self.terminal_denominations = None
+        self.notes = None
+
+    def is_out_of_service(self, terminal_id):
+        return self.out_of_service
+
+    def denominations(self, terminal_id):
+        return self.terminal_denominations
+
+    def accepts(self, terminal_id, amount):
+        return accepts(amount, self.terminal_denominations)
+
+    def reserve_notes(self, terminal_id, amount):
+        reserved = min(to_cents(amount), self.available)
+        if reserved > 0:
+            self.available -= reserved
+        return from_cents(reserved), self.notes
+
+
+def run_shard(connection, index, shards, log_file=None):
+    # worker process entry point: owns the accounts that hash to this shard and serves calls until told to stop
+    if log_file:
+        log.start(log_file)
+    atm_service = AtmService()
+    state = MemoryRepository().load_state()
+    owned = [account_id for account_id in state['account_balances'] if shard_for(account_id, shards) == index]
+    atm_service.restore({
+        'atm_cash': {},
+        'account_balances': {account_id: state['account_balances'][account_id] for account_id in owned},
+        'transaction_history': {account_id: state['transaction_history'][account_id] for account_id in owned}
+    })
+    cash = ReservedCash()
+    atm_service.fleet = cash
+
+    def withdraw(account_id, value, terminal_id, request_id, out_of_service, reserved_cents, denominations, notes):
+        # a repeated request dispenses nothing, so all of the reservation goes back
+        cash.out_of_service = out_of_service
+        cash.available = reserved_cents
+        cash.terminal_denominations = denominations
+        cash.notes = notes
+        result = atm_service.withdraw(account_id, value, terminal_id, request_id)
+        return result, cash.available
+
+    handlers = {
+        'withdraw': withdraw,
+        'deposit': atm_service.deposit,
+        'get_balance': atm_service.get_balance,
+        'get_history_since': atm_service.get_history_since,
+        'get_history_by_account_id': atm_service.get_history_by_account_id,
+        'assess_overdraft_fees': atm_service.assess_overdraft_fees,
+        'accrue_interest': atm_service.accrue_interest,
+        'total_liability_cents': atm_service.account_balances.total_liability
+    }
+    try:
+        while True:
+            message = connection.recv()
+            if message is None:
+                break
+            request_id, method, args = message
+            try:
+                result = handlers[method](*args)
+            except Exception as error:
+                result = error  # raised again in the caller
+            connection.send((request_id, result))
+    finally:
+        connection.close()
+        log.stop()
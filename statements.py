@@ -0,0 +1,222 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import date, datetime, timedelta
+
+from services.money import from_cents
+from services.transaction_history import format_event
+
+# accounts rendered per task, and tasks queued per worker, together these bound memory use
+CHUNK_SIZE = 500
+TASKS_PER_WORKER = 2
+CHECKPOINT_FILENAME = 'checkpoint.json'
+ARCHIVE_PARTS = 'parts'
+
+SELECT_ACCOUNT_IDS = 'SELECT account_id FROM accounts WHERE account_id > ? ORDER BY account_id LIMIT ?'
+SELECT_CUTOFF = 'SELECT COALESCE(MAX(position), 0) FROM history'
+SELECT_PERIOD_EVENTS = 'SELECT timestamp, amount_cents, balance_cents FROM history ' \
+                       'WHERE account_id = ? AND position <= ? AND timestamp >= ? AND timestamp < ? ORDER BY position'
+# the balance at the end of the period: today's balance less everything after the period or after the cutoff
+SELECT_CLOSING_BALANCE = 'SELECT balance_cents - (SELECT COALESCE(SUM(amount_cents), 0) FROM history ' \
+                         'WHERE account_id = ? AND (position > ? OR timestamp >= ?)) ' \
+                         'FROM accounts WHERE account_id = ?'
+
+_connections = {}  # per worker process: database path -> connection
+
+
+def render_statement(account_id, start, end, closing_cents, events):
+    # events: (timestamp, amount, balance) rows in cents, oldest first
+    opening_cents = closing_cents - sum(amount for _, amount, _ in events)
+    last_day = date.fromtimestamp(end - 1)
+    lines = [f'Statement for account {account_id}',
+             f'Period: {date.fromtimestamp(start)} to {last_day}',
+             f'Opening balance: ${from_cents(opening_cents)}']
+    lines.extend(format_event(*event) for event in events)
+    lines.append(f'Closing balance: ${from_cents(closing_cents)}')
+    return '\n'.join(lines) + '\n'
+
+
+def render_chunk(database, cutoff, start, end, account_ids, output):
+    # worker process entry point: renders the statements for a chunk of accounts and writes them to output,
+    # either a directory (one file per account) or the path of a zip file. Returns the number written
+    connection = _connections.get(database)
+    if connection is None:
+        connection = _connections[database] = sqlite3.connect(database)
+        connection.execute('PRAGMA query_only=ON')
+
+    statements = []
+    # a WAL read transaction: a consistent view of the chunk that never blocks the service's writer
+    connection.execute('BEGIN')
+    try:
+        for account_id in account_ids:
+            events = connection.execute(SELECT_PERIOD_EVENTS, (account_id, cutoff, start, end)).fetchall()
+            closing_cents, = connection.execute(SELECT_CLOSING_BALANCE,
+                                                (account_id, cutoff, end, account_id)).fetchone()
+            statements.append((account_id, render_statement(account_id, start, end, closing_cents, events)))
+    finally:
+        connection.execute('COMMIT')
+
+    if output.endswith('.zip'):
+        with zipfile.ZipFile(output + '.tmp', 'w', zipfile.ZIP_DEFLATED) as archive:
+            for account_id, statement in statements:
+                archive.writestr(f'{account_id}.txt', statement)
+        os.replace(output + '.tmp', output)
+    else:
+        for account_id, statement in statements:
+            write_atomically(os.path.join(output, f'{account_id}.txt'), statement)
+    return len(statements)
+
+
+def write_atomically(path, text):
+    with open(path + '.tmp', 'w') as output_file:
+        output_file.write(text)
+    os.replace(path + '.tmp', path)
+
+
+def iter_account_chunks(connection, after, chunk_size):
+    # account ids in order, chunk_size at a time, starting after the account id `after`
+    while True:
+        account_ids = [account_id for account_id, in connection.execute(SELECT_ACCOUNT_IDS, (after, chunk_size))]
+        if not account_ids:
+            return
+        yield account_ids
+        after = account_ids[-1]
+
+
+# renders a statement for every account in a SQLite database (SqliteRepository) for start <= time < end,
+# while the service keeps running against the same database.
+# Only history committed when the job first started is included, every event after that cutoff position is
+# left out, so the statements are the same whether the job runs in one go or is interrupted and resumed.
+# Accounts are streamed in id order and rendered chunk by chunk in worker processes, with only a few chunks
+# queued at a time. The checkpoint in the output directory records the cutoff and the last account id below
+# which every chunk is done, and a job with the same output directory resumes from there.
+# With archive=True the statements end up in one zip file, output/statements.zip, instead of one file each.
+class StatementJob:
+
+    def __init__(self, database, output, start, end, workers=4, archive=False, chunk_size=CHUNK_SIZE):
+        # start, end: epoch seconds
+        self.database = database
+        self.output = output
+        self.start = start
+        self.end = end
+        self.workers = workers
+        self.archive = archive
+        self.chunk_size = chunk_size
+        self.checkpoint_path = os.path.join(output, CHECKPOINT_FILENAME)
+        self.parts_directory = os.path.join(output, ARCHIVE_PARTS)
+        self.archive_path = os.path.join(output, 'statements.zip')
+
+    def run(self):
+        started = time.perf_counter()
+        os.makedirs(self.parts_directory if self.archive else self.output, exist_ok=True)
+        connection = sqlite3.connect(self.database)
+        connection.execute('PRAGMA query_only=ON')
+        try:
+            checkpoint = self.load_checkpoint(connection)
+            count = self._render(connection, checkpoint)
+        finally:
+            connection.close()
+
+        if self.archive:
+            self._combine_parts()
+        os.remove(self.checkpoint_path)
+        if self.archive:
+            shutil.rmtree(self.parts_directory)
+        elapsed = time.perf_counter() - started
+        return {
+            'statements': count,
+            'seconds': elapsed,
+            'statements_per_second': count / elapsed if elapsed else 0.0
+        }
+
+    def load_checkpoint(self, connection):
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'r') as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+            if (checkpoint['start'], checkpoint['end'], checkpoint['archive']) != (self.start, self.end, self.archive):
+                raise ValueError(f'{self.output} holds an unfinished job for another period, remove it first')
+            if self.archive:
+                # parts after the checkpoint are rendered again, possibly split differently
+                for name in os.listdir(self.parts_directory):
+                    if not name.endswith('.zip') or name[:-len('.zip')] > checkpoint['done_through']:
+                        os.remove(os.path.join(self.parts_directory, name))
+            return checkpoint
+
+        cutoff, = connection.execute(SELECT_CUTOFF).fetchone()
+        checkpoint = {'start': self.start, 'end': self.end, 'archive': self.archive, 'cutoff': cutoff,
+                      'done_through': '', 'statements': 0}
+        self._save_checkpoint(checkpoint)
+        return checkpoint
+
+    def _render(self, connection, checkpoint):
+        # chunks finish out of order, the checkpoint only moves past a chunk once every earlier chunk is done
+        in_flight = {}  # future -> last account id of its chunk
+        finished = {}  # last account id -> statements written, for chunks done out of order
+        order = []  # last account ids of the chunks not yet checkpointed, in order
+
+        def advance(done):
+            for future in done:
+                finished[in_flight.pop(future)] = future.result()
+            if not order or order[0] not in finished:
+                return
+            while order and order[0] in finished:
+                checkpoint['done_through'] = order.pop(0)
+                checkpoint['statements'] += finished.pop(checkpoint['done_through'])
+            self._save_checkpoint(checkpoint)
+
+        with ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            for account_ids in iter_account_chunks(connection, checkpoint['done_through'], self.chunk_size):
+                output = os.path.join(self.parts_directory, f'{account_ids[0]}.zip') if self.archive \
+                    else self.output
+                future = pool.submit(render_chunk, self.database, checkpoint['cutoff'], self.start, self.end,
+                                     account_ids, output)
+                in_flight[future] = account_ids[-1]
+                order.append(account_ids[-1])
+                if len(in_flight) >= self.workers * TASKS_PER_WORKER:
+                    advance(wait(in_flight, return_when=FIRST_COMPLETED).done)
+            advance(wait(in_flight).done)
+        return checkpoint['statements']
+
+    def _save_checkpoint(self, checkpoint):
+        write_atomically(self.checkpoint_path, json.dumps(checkpoint))
+
+    def _combine_parts(self):
+        # one entry at a time, so combining doesn't hold more than a single statement in memory
+        with zipfile.ZipFile(self.archive_path + '.tmp', 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name in sorted(os.listdir(self.parts_directory)):
+                with zipfile.ZipFile(os.path.join(self.parts_directory, name)) as part:
+                    for entry in part.namelist():
+                        archive.writestr(entry, part.read(entry))
+        os.replace(self.archive_path + '.tmp', self.archive_path)
+
+
+def parse_day(value):
+    return int(datetime.strptime(value, '%Y-%m-%d').timestamp())
+
+
+def main():
+    today = date.today()
+    parser = argparse.ArgumentParser(description='Render account statements from an ATM database')
+    parser.add_argument('--database', required=True, help='SQLite database the ATM runs with')
+    parser.add_argument('--output', required=True, help='directory for the statements and the job checkpoint')
+    parser.add_argument('--start', default=str(today - timedelta(days=1)), help='first day, YYYY-MM-DD')
+    parser.add_argument('--end', default=str(today), help='day after the last day, YYYY-MM-DD')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--archive', action='store_true', help='write one zip file instead of a file per account')
+    options = parser.parse_args()
+
+    job = StatementJob(options.database, options.output, parse_day(options.start), parse_day(options.end),
+                       options.workers, options.archive)
+    report = job.run()
+    print(f"Rendered {report['statements']} statements in {report['seconds']:.2f}s "
+          f"({report['statements_per_second']:.0f} statements/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from services.account_snapshot import AccountSnapshot, write_account_snapshot
+from services.account_store import AccountStore
+from services.transaction_history import AccountHistory, LazyHistories
+
+
+class TestAccountSnapshot:
+
+    @pytest.fixture
+    def snapshot(self, tmp_path):
+        balances = AccountStore({'3': -20, '1': 100, '2': 10.24})
+        history = AccountHistory()
+        history.append(1000, 5000, 5000)
+        history.append(2000, -4000, 1000)
+        path = os.path.join(str(tmp_path), 'accounts-1')
+        write_account_snapshot(path, balances, {'1': history})
+        return AccountSnapshot(path)
+
+    def test_lookups_are_served_from_the_snapshot(self, snapshot):
+        store = AccountStore(base=snapshot)
+
+        assert store['1'] == 100 and isinstance(store['1'], int)
+        assert store['2'] == 10.24
+        assert store.get_cents('3') == -2000
+        assert '4' not in store
+        with pytest.raises(KeyError):
+            store['4']
+        assert sorted(store) == ['1', '2', '3'] and len(store) == 3
+
+    def test_writes_go_to_the_overlay(self, snapshot):
+        store = AccountStore(base=snapshot)
+
+        store.add('1', -30)
+        store['4'] = 7
+        del store['2']
+
+        assert store['1'] == 70 and snapshot.cents[snapshot.find('1')] == 10000
+        assert store.index.keys() == {'1', '4'}
+        assert '2' not in store
+        assert sorted(store) == ['1', '3', '4'] and len(store) == 3
+
+    def test_sweeps_cover_snapshot_rows(self, snapshot):
+        store = AccountStore(base=snapshot)
+
+        charged = store.ids_for(store.assess_overdraft_fees(500))
+
+        assert charged == ['3']
+        assert store['3'] == -25.0
+        assert store.total_liability() == 11024
+
+    def test_merged_snapshot_includes_the_overlay(self, snapshot, tmp_path):
+        store = AccountStore(base=snapshot)
+        store.add('2', 1.00)
+        store['4'] = 7
+        histories = LazyHistories(snapshot.history_columns, snapshot)
+        histories['1'].append(3000, -1000, 0)
+
+        path = os.path.join(str(tmp_path), 'accounts-2')
+        write_account_snapshot(path, store, histories)
+        merged = AccountSnapshot(path)
+
+        assert dict(AccountStore(base=merged)) == {'1': 100, '2': 11.24, '3': -20, '4': 7}
+        assert [list(column) for column in merged.history_columns('1')] == \
+            [[1000, 2000, 3000], [5000, -4000, -1000], [5000, 1000, 0], [1, 2, 2]]
+        assert len(merged.history_columns('4')[0]) == 0
+
+    def test_history_loads_on_first_access(self, snapshot):
+        histories = LazyHistories(snapshot.history_columns, snapshot)
+
+        assert histories._loaded == {}
+        assert [event[1] for event in histories['1']] == [-4000, 5000]
+        assert list(histories._loaded) == ['1']
+        assert histories.get('5') is None
@@ -0,0 +1,69 @@
+import pytest
+
+from services import account_store
+from services.account_store import AccountStore
+
+
+class TestAccountStore:
+
+    def test_balances_display_like_the_values_applied(self):
+        store = AccountStore({'1': 100, '2': 10.24})
+
+        store.add('1', -120)
+        int_balance = store['1']
+        store.add('1', -5.00)
+
+        assert int_balance == -20 and isinstance(int_balance, int)
+        assert store['1'] == -25.0 and isinstance(store['1'], float)
+        assert store['2'] == 10.24
+
+    def test_cents_arithmetic_has_no_rounding_drift(self):
+        store = AccountStore({'1': 0.0})
+
+        for _ in range(1000):
+            store.add('1', 0.10)
+
+        assert store.get_cents('1') == 10000
+        assert store['1'] == 100.0
+
+    def test_balances_beyond_int64_are_refused(self):
+        store = AccountStore({'1': 0})
+        store.add('1', 5e16)
+
+        with pytest.raises(OverflowError):
+            store.add('1', 5e16)
+        with pytest.raises(OverflowError):
+            store['2'] = 1e17
+
+        assert store['1'] == 5e16
+        assert '2' not in store
+
+    def test_mapping_interface(self):
+        store = AccountStore({'1': 1, '2': 2, '3': 3})
+
+        del store['1']
+
+        assert '1' not in store
+        assert dict(store) == {'3': 3, '2': 2}
+        assert len(store) == 2
+
+    def test_rows_span_blocks(self, monkeypatch):
+        monkeypatch.setattr(account_store, 'BLOCK_SIZE', 4)
+        store = AccountStore({str(number): number - 5 for number in range(10)})
+
+        charged = store.ids_for(store.assess_overdraft_fees(500))
+
+        assert charged == ['0', '1', '2', '3', '4']
+        assert store['0'] == -10.0
+        assert store['9'] == 4
+        assert store.total_liability() == 1000
+
+    def test_accrue_interest_rounds_down_and_skips_overdrawn(self):
+        store = AccountStore({'1': 100.05, '2': -50, '3': 0})
+
+        rows, interest_paid = store.accrue_interest(0.01)
+
+        assert store.ids_for(rows) == ['1']
+        assert interest_paid == [100]
+        assert store['1'] == 101.05
+        assert store['2'] == -50
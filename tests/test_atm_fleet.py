@@ -0,0 +1,96 @@
+import pytest
+
+from services import atm_fleet
+from services.atm_fleet import AtmFleet
+from services.cassettes import plan_dispense
+
+
+class TestAtmFleet:
+
+    @pytest.fixture
+    def fleet(self):
+        fleet = AtmFleet()
+        fleet.register('atm-1', 5000, refill_threshold=1000)
+        fleet.register('atm-2', 500, refill_threshold=1000)
+        return fleet
+
+    def test_register_updates_aggregates(self, fleet):
+        assert fleet.get_summary() == {
+            'terminals': 2,
+            'total_cash': 5500,
+            'low_cash': ['atm-2'],
+            'out_of_service': []
+        }
+
+    def test_register_twice_fails(self, fleet):
+        with pytest.raises(ValueError):
+            fleet.register('atm-1', 100)
+
+    def test_reserve_dispenses_what_is_available(self, fleet):
+        assert fleet.reserve('atm-1', 4100) == 4100
+        assert fleet.reserve('atm-2', 800) == 500
+
+        assert fleet.total_cash == 90000
+        assert fleet.low_cash == {'atm-1', 'atm-2'}
+        assert fleet.is_out_of_service('atm-2')
+        assert not fleet.is_out_of_service('atm-1')
+
+    def test_reserve_rejects_non_positive_amounts(self, fleet):
+        with pytest.raises(ValueError):
+            fleet.reserve('atm-1', -20)
+        with pytest.raises(ValueError):
+            fleet.reserve('atm-1', 0)
+        assert fleet.get_cash('atm-1') == 5000
+
+    def test_load_returns_terminal_to_service(self, fleet):
+        fleet.reserve('atm-2', 500)
+
+        fleet.load('atm-2', 2000)
+
+        assert fleet.get_cash('atm-2') == 2000
+        assert fleet.low_cash == set()
+        assert fleet.out_of_service == set()
+        assert fleet.get_summary()['total_cash'] == 7000
+
+    # cassettes
+    def test_cassettes_dispense_notes(self, fleet):
+        fleet.register('atm-3', 0, refill_threshold=100, notes={20: 5, 50: 2})
+
+        assert fleet.get_cash('atm-3') == 200
+        assert fleet.reserve_notes('atm-3', 90) == (90, {50: 1, 20: 2})
+        assert fleet.get_notes('atm-3') == {20: 3, 50: 1}
+        assert fleet.get_cash('atm-3') == 110
+        assert fleet.reserve('atm-3', 150) == 110
+        assert fleet.is_out_of_service('atm-3')
+
+    def test_cassettes_changed_while_solving_are_planned_again(self, fleet, monkeypatch):
+        fleet.register('atm-3', 0, notes={20: 5, 50: 2})
+        plans = []
+
+        def plan_during_load(amount, notes, strategy):
+            plans.append(dict(notes))
+            if len(plans) == 1:
+                fleet.load('atm-3', 100, {100: 1})
+            return plan_dispense(amount, notes, strategy)
+
+        monkeypatch.setattr(atm_fleet, 'plan_dispense', plan_during_load)
+
+        assert fleet.reserve_notes('atm-3', 100) == (100, {100: 1})
+        assert plans == [{20: 5, 50: 2}, {20: 5, 50: 2, 100: 1}]
+        assert fleet.get_notes('atm-3') == {20: 5, 50: 2, 100: 0}
+
+    def test_cassettes_are_loaded_with_notes(self, fleet):
+        fleet.register('atm-3', 0, notes={20: 1})
+
+        fleet.load('atm-3', 150, {'50': 3})
+
+        assert fleet.get_notes('atm-3') == {20: 1, 50: 3}
+        assert fleet.get_summary()['total_cash'] == 5670
+        with pytest.raises(ValueError):
+            fleet.load('atm-3', 100)
+
+    def test_accepts(self, fleet):
+        fleet.register('atm-3', 0, notes={20: 0, 50: 0})
+
+        assert fleet.accepts('atm-1', 40) and not fleet.accepts('atm-1', 50)
+        assert fleet.accepts('atm-3', 50) and not fleet.accepts('atm-3', 30)
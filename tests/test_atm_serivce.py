@@ -2,6 +2,7 @@ import pytest
 from datetime import datetime
 
 from services.atm_service import AtmService
+from services.transaction_history import AccountHistory
 
 
 class TestAtmService:
@@ -72,6 +73,16 @@ class TestAtmService:
 
         assert result == 'Please enter a multiple of $20.'
 
+    def test_withdraw_negative_amount(self, atm_service):
+        atm_service.atm_balance = 10000
+
+        for _ in range(3):
+            result = atm_service.withdraw('2859459814', -20)
+
+        assert result == 'Please withdraw an amount greater than zero.'
+        assert atm_service.atm_balance == 10000
+        assert atm_service.withdraw('2859459814', 0) == 'Please withdraw an amount greater than zero.'
+
     # Withdrawal exceeding ATM balance scenarios
     def test_withdraw_exceed_atm_balance(self, atm_service):
         atm_service.account_balances['2859459814'] = 200  # Setting a balance for testing
@@ -101,6 +112,48 @@ class TestAtmService:
 
         assert result == 'Your account is overdrawn! You may not make withdrawals at this time.'
 
+    # terminals
+    def test_withdraw_from_another_terminal(self, atm_service):
+        atm_service.account_balances['2859459814'] = 100  # Setting a balance for testing
+        atm_service.atm_balance = 500  # Setting ATM balance for testing
+        if 'lobby' not in atm_service.fleet.terminals:
+            atm_service.fleet.register('lobby', 40)
+
+        result = atm_service.withdraw('2859459814', 60, 'lobby')
+
+        assert result == 'Unable to dispense full amount requested at this time. \n' \
+                         'Amount dispensed: $40. \n Current balance: $60.'
+        assert atm_service.atm_balance == 500
+        assert atm_service.fleet.is_out_of_service('lobby')
+
+    # daily withdrawal limit
+    def test_withdraw_within_daily_limit(self, atm_service):
+        atm_service.transaction_history['2859459814'] = AccountHistory()
+        atm_service.account_balances['2859459814'] = 500  # Setting a balance for testing
+        atm_service.atm_balance = 500  # Setting ATM balance for testing
+        atm_service.daily_withdrawal_limits['2859459814'] = 200
+
+        atm_service.withdraw('2859459814', 120)
+        result = atm_service.withdraw('2859459814', 100)
+
+        del atm_service.daily_withdrawal_limits['2859459814']
+        assert result == 'Daily withdrawal limit reached. You may withdraw up to $80 more today.'
+        assert atm_service.account_balances['2859459814'] == 380
+
+    def test_daily_limit_window_rolls_over(self, atm_service, mocker):
+        atm_service.transaction_history['2859459814'] = AccountHistory()
+        atm_service.account_balances['2859459814'] = 500  # Setting a balance for testing
+        atm_service.atm_balance = 500  # Setting ATM balance for testing
+        atm_service.daily_withdrawal_limits['2859459814'] = 200
+
+        mocker.patch('time.time', return_value=1701358245)
+        atm_service.withdraw('2859459814', 200)
+        mocker.patch('time.time', return_value=1701358245 + 24 * 60 * 60)
+        result = atm_service.withdraw('2859459814', 200)
+
+        del atm_service.daily_withdrawal_limits['2859459814']
+        assert result == 'Amount dispensed: $200. \n Current balance: $100.'
+
     # deposit
     def test_deposit_successful(self, atm_service):
         atm_service.account_balances['2859459814'] = 100  # Setting a balance for testing
@@ -130,6 +183,96 @@ class TestAtmService:
 
         assert result == 'Please deposit an amount greater than zero.'
 
+    @pytest.mark.parametrize('value', [float('nan'), float('inf'), float('-inf')])
+    def test_deposit_non_finite_value(self, atm_service, value):
+        atm_service.account_balances['2859459814'] = 100  # Setting a balance for testing
+
+        result = atm_service.deposit('2859459814', value)
+
+        assert result == 'Please enter a valid amount.'
+        assert atm_service.account_balances['2859459814'] == 100
+
+    def test_deposit_beyond_the_largest_balance(self, atm_service):
+        atm_service.account_balances['2859459814'] = 100  # Setting a balance for testing
+        atm_service.deposit('2859459814', 5e16)
+        history_length = len(atm_service.transaction_history['2859459814'])
+
+        result = atm_service.deposit('2859459814', 5e16)
+
+        assert result == 'Unable to accept a deposit of this size.'
+        assert atm_service.account_balances['2859459814'] == 5e16 + 100
+        assert len(atm_service.transaction_history['2859459814']) == history_length
+
+    # request IDs
+    def test_repeated_withdrawal_request_moves_money_once(self, atm_service):
+        atm_service.account_balances['2859459814'] = 100  # Setting a balance for testing
+        atm_service.atm_balance = 500  # Setting ATM balance for testing
+        history_length = len(atm_service.transaction_history['2859459814'])
+
+        first = atm_service.withdraw('2859459814', 80, request_id='retry-1')
+        repeated = atm_service.withdraw('2859459814', 80, request_id='retry-1')
+
+        assert first == repeated == 'Amount dispensed: $80. \n Current balance: $20.'
+        assert atm_service.account_balances['2859459814'] == 20
+        assert atm_service.atm_balance == 420
+        assert len(atm_service.transaction_history['2859459814']) == history_length + 1
+
+    def test_repeated_deposit_request_moves_money_once(self, atm_service):
+        atm_service.account_balances['2859459814'] = 100  # Setting a balance for testing
+
+        atm_service.deposit('2859459814', 10, request_id='retry-2')
+        atm_service.deposit('2859459814', 10, request_id='retry-2')
+        atm_service.deposit('2859459814', 10, request_id='retry-3')
+
+        assert atm_service.account_balances['2859459814'] == 120
+
+    def test_request_id_reused_for_a_different_transaction(self, atm_service):
+        atm_service.account_balances['2859459814'] = 100  # Setting a balance for testing
+        atm_service.atm_balance = 500  # Setting ATM balance for testing
+        refused = 'This request ID was already used for a different transaction.'
+
+        atm_service.deposit('2859459814', 10, request_id='k1')
+
+        assert atm_service.withdraw('2859459814', 20, request_id='k1') == refused
+        assert atm_service.deposit('2859459814', 20, request_id='k1') == refused
+        assert atm_service.deposit('2859459814', 10, request_id='k1') == 'Current balance: 110.'
+        assert atm_service.account_balances['2859459814'] == 110
+        assert atm_service.atm_balance == 500
+
+    def test_request_ids_are_scoped_to_the_account(self, atm_service):
+        atm_service.account_balances['2859459814'] = 100  # Setting a balance for testing
+        atm_service.account_balances['2001377812'] = 100
+
+        atm_service.deposit('2859459814', 10, request_id='retry-4')
+        result = atm_service.deposit('2001377812', 10, request_id='retry-4')
+
+        assert result == 'Current balance: 110.'
+
+    # end of day
+    def test_assess_overdraft_fees(self, atm_service):
+        atm_service.account_balances['2859459814'] = -50  # Simulating an overdrawn account
+        atm_service.account_balances['2001377812'] = 60
+        # other tests share the service, so any account they left overdrawn is charged as well
+        overdrawn = {account_id for account_id, balance in atm_service.account_balances.items() if balance < 0}
+        history_lengths = {account_id: len(history) for account_id, history in atm_service.transaction_history.items()}
+
+        charged = atm_service.assess_overdraft_fees()
+
+        assert charged == len(overdrawn)
+        assert {account_id for account_id, history in atm_service.transaction_history.items()
+                if len(history) > history_lengths[account_id]} == overdrawn
+        assert '2859459814' in overdrawn and '2001377812' not in overdrawn
+        assert atm_service.account_balances['2859459814'] == -55.0
+        assert atm_service.account_balances['2001377812'] == 60
+        assert next(iter(atm_service.transaction_history['2859459814']))[1:] == (-500, -5500)
+        atm_service.account_balances['2859459814'] = 100
+
+    def test_get_total_liability(self, atm_service):
+        atm_service.account_balances['2859459814'] = -50  # Simulating an overdrawn account
+        expected = sum(balance for balance in atm_service.account_balances.values() if balance > 0)
+
+        assert atm_service.get_total_liability() == pytest.approx(expected)
+
     # get_balance
     def test_get_balance_existing_account(self, atm_service):
         atm_service.account_balances['2859459814'] = 100  # Setting a balance for testing
@@ -144,46 +287,135 @@ class TestAtmService:
         assert result == 'Account not found.'
 
     # write_history
-    def test_write_history_valid_data(self, atm_service):
-        atm_service.transaction_history['2859459814'] = []  # Initializing history for testing
-        date = datetime.now().date().strftime('%Y-%m-%d')
-        time = datetime.now().time().strftime('%H:%M:%S')
+    def test_write_history_valid_data(self, atm_service, mocker):
+        atm_service.transaction_history['2859459814'] = AccountHistory()  # Initializing history for testing
+        mocker.patch('time.time', return_value=1701358245.5)
 
         atm_service.write_history('2859459814', 50, 150)  # Example data for history
 
         expected_history = [
-            [date, time, 50, 150]
+            (1701358245, 5000, 15000)
         ]
-        assert atm_service.transaction_history['2859459814'] == expected_history
+        assert list(atm_service.transaction_history['2859459814']) == expected_history
 
-    def test_write_history_existing_data(self, atm_service):
-        atm_service.transaction_history['2859459814'] = [[
-            '2023-11-30', '15:30:45', 30, 120
-        ]]  # Initializing history for testing
+    def test_write_history_existing_data(self, atm_service, mocker):
+        atm_service.transaction_history['2859459814'] = AccountHistory()  # Initializing history for testing
+        atm_service.transaction_history['2859459814'].append(1701358245, 3000, 12000)
 
-        date = datetime.now().date().strftime('%Y-%m-%d')
-        time = datetime.now().time().strftime('%H:%M:%S')
+        mocker.patch('time.time', return_value=1701444645)
 
-        atm_service.write_history('2859459814', 50, 170)  # Example data for history
+        atm_service.write_history('2859459814', 50.5, 170.5)  # Example data for history
 
         expected_history = [
-            [date, time, 50, 170],
-            ['2023-11-30', '15:30:45', 30, 120]  # Existing data
+            (1701444645, 5050, 17050),
+            (1701358245, 3000, 12000)  # Existing data
         ]
-        assert atm_service.transaction_history['2859459814'] == expected_history
+        assert list(atm_service.transaction_history['2859459814']) == expected_history
 
     # get_history_by_account_id
     def test_get_history_existing_data(self, atm_service):
-        atm_service.transaction_history['2859459814'] = [
-            ['2023-11-30', '15:30:45', 50, 150],
-            ['2023-11-29', '10:20:30', 30, 100]
-        ]  # Simulating existing history
+        history = AccountHistory()
+        history.append(int(datetime(2023, 11, 29, 10, 20, 30).timestamp()), 3000, 10000)
+        history.append(int(datetime(2023, 11, 30, 15, 30, 45).timestamp()), 5000, 15000)
+        atm_service.transaction_history['2859459814'] = history  # Simulating existing history
 
         result = atm_service.get_history_by_account_id('2859459814')
 
         assert result == '2023-11-30 15:30:45 50 150 \n2023-11-29 10:20:30 30 100'
 
+    def test_get_history_fractional_amounts(self, atm_service):
+        history = AccountHistory()
+        history.append(int(datetime(2023, 11, 30, 15, 30, 45).timestamp()), -2010, -1025)
+        atm_service.transaction_history['2859459814'] = history
+
+        result = atm_service.get_history_by_account_id('2859459814')
+
+        assert result == '2023-11-30 15:30:45 -20.1 -10.25'
+
+    def test_get_history_paginated(self, atm_service):
+        history = AccountHistory()
+        for day in range(1, 4):
+            history.append(int(datetime(2023, 11, day, 12, 0, 0).timestamp()), 1000, 1000 * day)
+        atm_service.transaction_history['2859459814'] = history
+
+        first_page = atm_service.get_history_by_account_id('2859459814', 2)
+        last_page = atm_service.get_history_by_account_id('2859459814', 2, '1')
+
+        assert first_page == '2023-11-03 12:00:00 10 30 \n2023-11-02 12:00:00 10 20 \n' \
+                             'More history available: history 2 1'
+        assert last_page == '2023-11-01 12:00:00 10 10'
+
+    def test_get_history_since(self, atm_service):
+        history = AccountHistory()
+        for day in range(1, 4):
+            history.append(int(datetime(2023, 11, day, 12, 0, 0).timestamp()), 1000, 1000 * day)
+        atm_service.transaction_history['2859459814'] = history
+
+        result = atm_service.get_history_since('2859459814', int(datetime(2023, 11, 2).timestamp()))
+
+        assert result == '2023-11-03 12:00:00 10 30 \n2023-11-02 12:00:00 10 20'
+
+    def test_get_history_invalid_cursor(self, atm_service):
+        result = atm_service.get_history_by_account_id('2859459814', 2, '99')
+
+        assert result == 'Invalid history cursor.'
+
+    def test_iter_history_lines_unknown_account(self, atm_service):
+        assert list(atm_service.iter_history_lines('0000000000')) == []
+
     def test_get_history_no_data(self, atm_service):
         result = atm_service.get_history_by_account_id('1434597300')  # Non-existing account
 
         assert result == 'No history found.'
+
+    # cassettes
+    def test_withdraw_from_cassettes(self, atm_service):
+        atm_service.account_balances['2859459814'] = 500
+        atm_service.load_notes('cassettes-1', {20: 10, 50: 1})
+
+        result = atm_service.withdraw('2859459814', 90, 'cassettes-1')
+
+        assert result == 'Amount dispensed: $90. \n Current balance: $410.'
+        assert atm_service.fleet.get_notes('cassettes-1') == {20: 8, 50: 0}
+
+    def test_withdraw_amount_cassettes_cannot_make(self, atm_service):
+        atm_service.account_balances['2859459814'] = 500
+        atm_service.load_notes('cassettes-2', {20: 10, 50: 10})
+
+        result = atm_service.withdraw('2859459814', 30, 'cassettes-2')
+
+        assert result == 'Please enter an amount that can be made from $20 and $50 notes.'
+
+    def test_withdraw_partial_amount_from_cassettes(self, atm_service):
+        atm_service.account_balances['2859459814'] = 500
+        atm_service.load_notes('cassettes-3', {20: 2, 50: 1})
+
+        result = atm_service.withdraw('2859459814', 130, 'cassettes-3')
+
+        assert result == 'Unable to dispense full amount requested at this time. \n' \
+                         'Amount dispensed: $90. \n Current balance: $410.'
+
+    # snapshot-isolated reads
+    def test_reads_during_transaction_see_previous_state(self, atm_service, mocker):
+        atm_service.account_balances['2859459814'] = 100
+        atm_service.transaction_history['2859459814'] = AccountHistory()
+        write_history = atm_service.write_history
+        seen = []
+
+        def write_history_and_read(*args, **kwargs):
+            # the balance is already updated, but the withdrawal hasn't finished
+            write_history(*args, **kwargs)
+            seen.append((atm_service.get_balance('2859459814'),
+                         atm_service.get_history_by_account_id('2859459814')))
+
+        mocker.patch.object(atm_service, 'write_history', side_effect=write_history_and_read)
+
+        atm_service.withdraw('2859459814', 80)
+
+        assert seen == [('Current Balance: $100', 'No history found.')]
+        assert atm_service.get_balance('2859459814') == 'Current Balance: $20'
+        assert atm_service.read_view('2859459814') == (20, 1)
+
+    def test_read_view_unknown_account(self, atm_service):
+        with pytest.raises(KeyError):
+            atm_service.read_view('0000000000')
@@ -0,0 +1,116 @@
+import sys
+import threading
+import time
+
+import pytest
+
+from services.atm_service import AtmService
+from services.ledger import Ledger
+from services.transaction_history import FEE, WITHDRAWAL
+
+
+class TestAtmServiceConcurrency:
+
+    @pytest.fixture
+    def atm_service(self, monkeypatch):
+        AtmService._instance = None
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # switch threads as often as possible to expose races
+        service = AtmService()
+
+        # yield to other threads between a withdrawal's checks and its updates
+        get_remaining_daily_withdrawal = service.get_remaining_daily_withdrawal
+
+        def yielding_get_remaining_daily_withdrawal(account_id):
+            time.sleep(0)
+            return get_remaining_daily_withdrawal(account_id)
+
+        monkeypatch.setattr(service, 'get_remaining_daily_withdrawal', yielding_get_remaining_daily_withdrawal)
+        yield service
+        sys.setswitchinterval(switch_interval)
+        if service.ledger:
+            service.ledger.close()
+        AtmService._instance = None
+
+    @staticmethod
+    def run_threads(target, count, timeout=60):
+        # daemon threads, so a deadlock fails the test instead of hanging the run
+        threads = [threading.Thread(target=target, args=(number,), daemon=True) for number in range(count)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        assert not any(thread.is_alive() for thread in threads), 'threads deadlocked'
+
+    def test_balances_are_conserved(self, atm_service):
+        account_ids = list(atm_service.account_balances)
+        for account_id in account_ids:
+            atm_service.account_balances[account_id] = 1000
+        atm_service.atm_balance = 20000
+        deposits_per_thread = 200
+
+        def transact(number):
+            for iteration in range(deposits_per_thread):
+                account_id = account_ids[(number + iteration) % len(account_ids)]
+                atm_service.deposit(account_id, 20)
+                atm_service.withdraw(account_id, 40)
+
+        self.run_threads(transact, 8)
+
+        fees = sum(-amount for history in atm_service.transaction_history.values()
+                   for amount, kind in zip(history.amounts, history.kinds) if kind == FEE)
+        dispensed = sum(-amount for history in atm_service.transaction_history.values()
+                        for amount, kind in zip(history.amounts, history.kinds) if kind == WITHDRAWAL)
+        deposited = 8 * deposits_per_thread * 20
+
+        assert atm_service.atm_balance == 20000 - dispensed / 100
+        assert sum(atm_service.account_balances.values()) == \
+            pytest.approx(len(account_ids) * 1000 + deposited - (dispensed + fees) / 100)
+        for account_id, history in atm_service.transaction_history.items():
+            assert history.balances[-1] / 100 == pytest.approx(atm_service.account_balances[account_id])
+
+    def test_cash_drawer_is_never_overdrawn(self, atm_service):
+        atm_service.account_balances['1434597300'] = 1000000
+        atm_service.account_balances['2859459814'] = 1000000
+        atm_service.atm_balance = 10000
+
+        def withdraw(number):
+            account_id = '1434597300' if number % 2 else '2859459814'
+            for _ in range(100):
+                atm_service.withdraw(account_id, 60)
+
+        self.run_threads(withdraw, 8)
+
+        dispensed = 2000000 - atm_service.account_balances['1434597300'] - atm_service.account_balances['2859459814']
+        assert atm_service.atm_balance == 0
+        assert dispensed == 10000
+
+    def test_snapshots_while_transactions_run(self, atm_service, tmp_path):
+        atm_service.attach_ledger(Ledger(str(tmp_path), snapshot_every=5))
+        account_ids = list(atm_service.account_balances)
+        for account_id in account_ids:
+            atm_service.account_balances[account_id] = 1000
+
+        def transact(number):
+            for iteration in range(25):
+                account_id = account_ids[(number + iteration) % len(account_ids)]
+                atm_service.deposit(account_id, 20)
+                atm_service.withdraw(account_id, 20)
+            atm_service.load_cash(f'terminal-{number}', 100)
+
+        self.run_threads(transact, 32)
+        atm_service.ledger.close()
+        balances = dict(atm_service.account_balances)
+        cash = atm_service.atm_balance
+
+        AtmService._instance = None
+        restarted = AtmService()
+        restarted.attach_ledger(Ledger(str(tmp_path)))
+
+        assert restarted.ledger.snapshot_sequence > 0
+        for account_id in account_ids:
+            assert restarted.account_balances[account_id] == balances[account_id]
+            assert len(restarted.transaction_history[account_id]) == len(atm_service.transaction_history[account_id])
+        assert restarted.atm_balance == cash
+        assert restarted.fleet.get_cash('terminal-31') == 100
@@ -1,5 +1,8 @@
 import pytest
-from services.authorization_service import AuthorizationService
+
+import main
+from services.atm_service import AtmService
+from services.authorization_service import LOCKOUT_SECONDS, AuthorizationService
 import time
 
 
@@ -107,3 +110,141 @@ class TestAuthorizationService:
 
         # Assert that the account's activity time has been updated
         assert authorization_service.account_activity['2859459814'] == 200
+
+    # sessions
+    def test_sessions_are_independent(self, authorization_service):
+        authorization_service.authorize('2859459814', '7386', 'terminal-1')
+        authorization_service.authorize('1434597300', '4557', 'terminal-2')
+
+        assert authorization_service.get_active_account_id('terminal-1') == '2859459814'
+        assert authorization_service.get_active_account_id('terminal-2') == '1434597300'
+
+        authorization_service.logout('terminal-1')
+
+        assert authorization_service.get_active_account_id('terminal-1') is None
+        assert authorization_service.get_active_account_id('terminal-2') == '1434597300'
+        authorization_service.logout('terminal-2')
+
+    def test_expire_sessions_logs_out_only_inactive_sessions(self, authorization_service, mocker):
+        mocker.patch('time.time', return_value=1000)
+        authorization_service.authorize('2859459814', '7386', 'terminal-1')
+        authorization_service.authorize('1434597300', '4557', 'terminal-2')
+
+        mocker.patch('time.time', return_value=1100)
+        authorization_service.refresh_activity('1434597300', 'terminal-2')
+
+        authorization_service.expire_sessions(1150)
+
+        assert 'terminal-1' not in authorization_service.sessions
+        assert authorization_service.get_active_account_id('terminal-2') == '1434597300'
+
+        authorization_service.expire_sessions(1221)
+
+        assert 'terminal-2' not in authorization_service.sessions
+
+    def test_stale_heap_entries_are_discarded(self, authorization_service, mocker):
+        mocker.patch('time.time', return_value=1000)
+        authorization_service.authorize('2859459814', '7386', 'terminal-1')
+        authorization_service.logout('terminal-1')
+        authorization_service.authorize('2859459814', '7386', 'terminal-1')
+
+        mocker.patch('time.time', return_value=1050)
+        authorization_service.authorize('1434597300', '4557', 'terminal-1')
+        authorization_service.expire_sessions(1121)
+
+        assert authorization_service.get_active_account_id('terminal-1') == '1434597300'
+        authorization_service.logout('terminal-1')
+
+    def test_new_session_ids_are_unique(self, authorization_service):
+        assert authorization_service.new_session_id() != authorization_service.new_session_id()
+
+    # brute-force throttling
+    @pytest.fixture
+    def fresh_authorization_service(self):
+        AuthorizationService._instance = None
+        yield AuthorizationService()
+        AuthorizationService._instance = None
+
+    def test_pins_are_not_stored_in_plaintext(self, fresh_authorization_service):
+        salt, digest = fresh_authorization_service.account_information['2859459814']
+
+        assert digest != '7386' and b'7386' not in digest
+
+    def test_account_locked_after_repeated_failures(self, fresh_authorization_service, mocker):
+        mocker.patch('time.time', return_value=1000)
+        for terminal in range(5):
+            fresh_authorization_service.authorize('2859459814', '0000', f'terminal-{terminal}')
+
+        # the correct PIN is turned away without being checked
+        verify_pin = mocker.patch('services.authorization_service.verify_pin')
+        result = fresh_authorization_service.authorize('2859459814', '7386', 'terminal-9')
+
+        assert result == 'Too many failed attempts. Try again later.'
+        verify_pin.assert_not_called()
+        assert fresh_authorization_service.get_active_account_id('terminal-9') is None
+
+    def test_lockout_expires(self, fresh_authorization_service, mocker):
+        mocker.patch('time.time', return_value=1000)
+        for terminal in range(5):
+            fresh_authorization_service.authorize('2859459814', '0000', f'terminal-{terminal}')
+
+        mocker.patch('time.time', return_value=1000 + LOCKOUT_SECONDS + 1)
+
+        assert fresh_authorization_service.authorize('2859459814', '7386', 'terminal-9') == \
+            '2859459814 successfully authorized.'
+
+    def test_terminal_locked_after_failures_across_accounts(self, fresh_authorization_service, mocker):
+        mocker.patch('time.time', return_value=1000)
+        for account_id in ('2859459814', '1434597300', '7089382418', '2001377812', '0000000000'):
+            fresh_authorization_service.authorize(account_id, '9999', 'terminal-1', 'atm-1')
+
+        assert fresh_authorization_service.authorize('2859459814', '7386', 'terminal-1', 'atm-1') == \
+            'Too many failed attempts. Try again later.'
+        # the same account can still log in elsewhere
+        assert fresh_authorization_service.authorize('2859459814', '7386', 'terminal-2', 'atm-2') == \
+            '2859459814 successfully authorized.'
+
+    def test_reconnecting_peer_stays_throttled(self, fresh_authorization_service, mocker, monkeypatch):
+        monkeypatch.setattr(main, 'authorization_service', fresh_authorization_service)
+        monkeypatch.setattr(AtmService, '_instance', None)
+        monkeypatch.setattr(main, 'atm_service', AtmService())  # with cash in its drawer
+        mocker.patch('time.time', return_value=1000)
+        # a new connection, and so a new session, for every guess
+        for number, account_id in enumerate(('2859459814', '1434597300', '7089382418', '2001377812', '0000000000')):
+            main.process_command('authorize', account_id, '9999', session_id=f'connection-{number}',
+                                 source='203.0.113.7')
+
+        assert main.process_command('authorize', '2859459814', '7386', session_id='connection-5',
+                                    source='203.0.113.7') == 'Too many failed attempts. Try again later.'
+        assert main.process_command('authorize', '2859459814', '7386', session_id='connection-6',
+                                    source='198.51.100.2') == '2859459814 successfully authorized.'
+
+    def test_terminals_behind_one_address_are_throttled_apart(self, fresh_authorization_service, mocker,
+                                                              monkeypatch):
+        monkeypatch.setattr(main, 'authorization_service', fresh_authorization_service)
+        monkeypatch.setattr(AtmService, '_instance', None)
+        atm_service = AtmService()
+        atm_service.fleet.register('lobby', 500)
+        atm_service.fleet.register('drive-through', 500)
+        monkeypatch.setattr(main, 'atm_service', atm_service)
+        mocker.patch('time.time', return_value=1000)
+        for number, account_id in enumerate(('2859459814', '1434597300', '7089382418', '2001377812', '0000000000')):
+            main.process_command('authorize', account_id, '9999', session_id=f'connection-{number}',
+                                 terminal_id='lobby', source='203.0.113.7')
+
+        assert main.process_command('authorize', '2859459814', '7386', session_id='connection-5',
+                                    terminal_id='lobby', source='203.0.113.7') == \
+            'Too many failed attempts. Try again later.'
+        assert main.process_command('authorize', '2859459814', '7386', session_id='connection-6',
+                                    terminal_id='drive-through', source='203.0.113.7') == \
+            '2859459814 successfully authorized.'
+
+    def test_successful_login_clears_account_failures(self, fresh_authorization_service, mocker):
+        mocker.patch('time.time', return_value=1000)
+        for terminal in range(4):
+            fresh_authorization_service.authorize('2859459814', '0000', f'terminal-{terminal}')
+        fresh_authorization_service.authorize('2859459814', '7386', 'terminal-8')
+        fresh_authorization_service.authorize('2859459814', '0000', 'terminal-7')
+
+        assert fresh_authorization_service.authorize('2859459814', '7386', 'terminal-9') == \
+            '2859459814 successfully authorized.'
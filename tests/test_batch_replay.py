@@ -0,0 +1,65 @@
+import io
+import json
+
+from batch_replay import replay
+
+
+class TestBatchReplay:
+
+    @staticmethod
+    def records(*records):
+        return io.StringIO(''.join(json.dumps(record) + '\n' for record in records))
+
+    @staticmethod
+    def handler(calls):
+        def handle(command, *args, session_id):
+            calls.append((session_id, command, args))
+            return f'{command} {" ".join(args)}'.strip()
+        return handle
+
+    def test_replay_writes_one_result_per_record(self):
+        calls = []
+        output = io.StringIO()
+
+        report = replay(self.records({'session': 's1', 'command': 'withdraw', 'args': [80]},
+                                     {'session': 's1', 'command': 'balance'}),
+                        output, self.handler(calls))
+
+        results = [json.loads(line) for line in output.getvalue().splitlines()]
+        assert calls == [('s1', 'withdraw', ('80',)), ('s1', 'balance', ())]
+        assert results == [
+            {'line': 1, 'session': 's1', 'command': 'withdraw', 'result': 'withdraw 80'},
+            {'line': 2, 'session': 's1', 'command': 'balance', 'result': 'balance'}
+        ]
+        assert report['records'] == 2
+
+    def test_terminal_is_passed_when_given(self):
+        output = io.StringIO()
+        options = []
+
+        replay(self.records({'session': 's1', 'terminal': 'lobby', 'command': 'balance'}), output,
+               lambda command, *args, **kwargs: options.append(kwargs))
+
+        assert options == [{'session_id': 's1', 'terminal_id': 'lobby'}]
+
+    def test_invalid_records_are_reported(self):
+        output = io.StringIO()
+
+        replay(io.StringIO('not json\n\n{"command": "balance"}\n'), output, self.handler([]))
+
+        results = [json.loads(line) for line in output.getvalue().splitlines()]
+        assert results == [{'line': 1, 'error': 'Invalid record.'}, {'line': 3, 'error': 'Invalid record.'}]
+
+    def test_sharded_replay_keeps_session_order(self):
+        calls = []
+        output = io.StringIO()
+        records = [{'session': f's{number % 7}', 'command': 'deposit', 'args': [number]} for number in range(500)]
+
+        report = replay(self.records(*records), output, self.handler(calls), workers=4)
+
+        results = [json.loads(line) for line in output.getvalue().splitlines()]
+        assert report['records'] == 500
+        assert sorted(result['line'] for result in results) == list(range(1, 501))
+        for session_number in range(7):
+            session_calls = [int(args[0]) for session_id, _, args in calls if session_id == f's{session_number}']
+            assert session_calls == list(range(session_number, 500, 7))
@@ -0,0 +1,35 @@
+import pytest
+
+import main
+from benchmarks.run_benchmarks import metrics_overhead, run_size
+from services.atm_service import AtmService
+from services.authorization_service import AuthorizationService
+
+
+class TestBenchmarks:
+
+    @pytest.fixture
+    def reset_singletons(self):
+        atm_service, authorization_service = main.atm_service, main.authorization_service
+        yield
+        AtmService._instance = None
+        AuthorizationService._instance = None
+        main.atm_service, main.authorization_service = atm_service, authorization_service
+
+    def test_run_size_reports_every_operation(self, reset_singletons):
+        result = run_size(200, repeat=20, seed=1)
+
+        assert result['accounts'] == 200
+        assert 'AtmService.withdraw' in result['operations']
+        assert 'main.process_command[withdraw]' in result['operations']
+        for timing in result['operations'].values():
+            assert timing['calls'] == 20
+            assert 0 < timing['p50_ns'] <= timing['p99_ns']
+
+    def test_metrics_overhead_stays_near_a_bare_timing_wrapper(self):
+        overhead = metrics_overhead()
+
+        # reading the clock twice through a wrapper is the floor, recording adds well under that again
+        floor = overhead['timing_wrapper_ns'] - overhead['plain_ns']
+        assert overhead['instrumented_ns'] - overhead['plain_ns'] < 1.8 * floor
+        assert overhead['labelled_ns'] - overhead['plain_ns'] < 2.0 * floor
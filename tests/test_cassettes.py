@@ -0,0 +1,55 @@
+from services.cassettes import EVEN_WEAR, _solve, accepts, describe, plan_dispense
+
+
+class TestCassettes:
+
+    def test_fewest_notes(self):
+        assert plan_dispense(180, {20: 50, 50: 50, 100: 50}) == (180, {100: 1, 20: 4})
+
+    def test_avoids_a_denomination_that_would_leave_an_odd_remainder(self):
+        # greedy would take a $50 and be stuck with $10
+        assert plan_dispense(60, {20: 10, 50: 10}) == (60, {20: 3})
+
+    def test_even_wear_spares_an_emptier_cassette(self):
+        assert plan_dispense(180, {20: 50, 50: 50, 100: 1}, EVEN_WEAR) == (180, {50: 2, 20: 4})
+
+    def test_partial_dispense_when_notes_run_out(self):
+        assert plan_dispense(130, {20: 1, 50: 50}) == (120, {50: 2, 20: 1})
+        assert plan_dispense(60, {20: 0, 50: 0}) == (0, {})
+
+    def test_amount_beyond_the_cassettes_takes_every_note(self):
+        _solve.cache_clear()
+
+        assert plan_dispense(100000000, {20: 3, 50: 0, 100: 2}) == (260, {20: 3, 100: 2})
+        assert _solve.cache_info().misses == 0
+
+    def test_plans_are_shared_by_inventory_class(self):
+        _solve.cache_clear()
+
+        plan_dispense(180, {20: 500, 50: 400, 100: 300})
+        plan_dispense(180, {20: 499, 50: 12, 100: 2})
+
+        assert _solve.cache_info().hits == 1
+
+    def test_accepts(self):
+        assert accepts(70, [20, 50])
+        assert not accepts(30, [20, 50])
+        assert accepts(40, None)
+        assert not accepts(30, None)
+
+    def test_accepts_matches_the_solver(self):
+        for denominations in ([20, 50], [20, 50, 100], [30, 45, 100], [7, 11]):
+            for amount in range(1, 500):
+                unlimited = {denomination: amount // denomination for denomination in denominations}
+                assert accepts(amount, denominations) == (plan_dispense(amount, unlimited)[0] == amount)
+
+    def test_accepts_large_amounts_without_solving(self):
+        _solve.cache_clear()
+
+        assert accepts(100000010, [20, 50, 100])
+        assert not accepts(100000015, [20, 50, 100])
+        assert _solve.cache_info().misses == 0
+
+    def test_describe(self):
+        assert describe([100, 20, 50]) == '$20, $50 and $100'
+        assert describe([20]) == '$20'
@@ -0,0 +1,33 @@
+from services.idempotency import ResultCache
+
+
+class TestResultCache:
+
+    def test_returns_stored_result_until_it_expires(self):
+        cache = ResultCache(ttl=60)
+
+        cache.put('a', 'first', 0)
+
+        assert cache.get('a', 59) == 'first'
+        assert cache.get('a', 60) is None
+        assert cache.get('b', 0) is None
+
+    def test_expired_entries_are_evicted(self):
+        cache = ResultCache(ttl=60)
+
+        cache.put('a', 'first', 0)
+        cache.put('b', 'second', 30)
+        cache.put('c', 'third', 61)
+
+        assert len(cache) == 2
+
+    def test_capacity_evicts_oldest(self):
+        cache = ResultCache(ttl=60, capacity=2)
+
+        cache.put('a', 'first', 0)
+        cache.put('b', 'second', 1)
+        cache.put('c', 'third', 2)
+
+        assert cache.get('a', 3) is None
+        assert cache.get('c', 3) == 'third'
+        assert len(cache) == 2
@@ -0,0 +1,243 @@
+import os
+import threading
+import time
+
+import pytest
+
+from services.atm_service import AtmService
+from services.cassettes import EVEN_WEAR
+from services.ledger import Ledger
+
+
+class TestLedger:
+
+    @pytest.fixture
+    def atm_service(self):
+        AtmService._instance = None
+        service = AtmService()
+        yield service
+        if service.ledger:
+            service.ledger.close()
+        AtmService._instance = None
+
+    # append / recover
+    def test_recover_returns_appended_records(self, tmp_path):
+        ledger = Ledger(str(tmp_path))
+        ledger.recover()
+        ledger.append({'value': 1})
+        ledger.append({'value': 2})
+        ledger.close()
+
+        state, records = Ledger(str(tmp_path)).recover()
+
+        assert state is None
+        assert records == [{'value': 1}, {'value': 2}]
+
+    def test_recover_discards_torn_write(self, tmp_path):
+        ledger = Ledger(str(tmp_path))
+        ledger.recover()
+        ledger.append({'value': 1})
+        ledger.close()
+        with open(os.path.join(str(tmp_path), 'ledger.log'), 'ab') as log_file:
+            log_file.write(b'[2,{"val')  # simulating a crash mid-write
+
+        recovered = Ledger(str(tmp_path))
+        state, records = recovered.recover()
+        recovered.append({'value': 2})
+        recovered.close()
+
+        assert records == [{'value': 1}]
+        assert Ledger(str(tmp_path)).recover()[1] == [{'value': 1}, {'value': 2}]
+
+    # group commit
+    def test_asynchronous_appends_are_group_committed(self, tmp_path):
+        ledger = Ledger(str(tmp_path), synchronous=False, group_size=10)
+        ledger.recover()
+
+        for value in range(25):
+            ledger.append({'value': value})
+        ledger.close()
+
+        assert ledger.fsync_count == 3
+
+    def test_concurrent_synchronous_appends_share_fsyncs(self, tmp_path, monkeypatch):
+        fsync = os.fsync
+
+        def slow_fsync(fd):
+            # a disk slow enough that appends pile up behind each fsync
+            time.sleep(0.002)
+            fsync(fd)
+
+        monkeypatch.setattr(os, 'fsync', slow_fsync)
+        ledger = Ledger(str(tmp_path))
+        ledger.recover()
+
+        writers, appends = 8, 50
+
+        def append_records():
+            for value in range(appends):
+                ledger.append({'value': value})
+
+        threads = [threading.Thread(target=append_records) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        ledger.close()
+
+        # every fsync covers the records of several writers, about four on this disk
+        assert ledger.fsync_count <= writers * appends // 3
+        assert len(Ledger(str(tmp_path)).recover()[1]) == writers * appends
+
+    def test_records_appended_together_are_one_entry(self, tmp_path):
+        ledger = Ledger(str(tmp_path))
+        ledger.recover()
+
+        ledger.append_all([{'value': 1}, {'value': 2}, {'value': 3}])
+        ledger.append({'value': 4})
+        ledger.close()
+
+        assert (ledger.sequence, ledger.fsync_count) == (2, 2)
+        assert Ledger(str(tmp_path)).recover()[1] == [{'value': 1}, {'value': 2}, {'value': 3}, {'value': 4}]
+
+    def test_torn_entry_recovers_none_of_its_records(self, tmp_path):
+        ledger = Ledger(str(tmp_path))
+        ledger.recover()
+        ledger.append({'value': 1})
+        ledger.append_all([{'value': 2}, {'value': 3}])
+        ledger.close()
+        with open(ledger.log_path, 'rb+') as log_file:
+            log_file.truncate(os.path.getsize(ledger.log_path) - 5)
+
+        assert Ledger(str(tmp_path)).recover()[1] == [{'value': 1}]
+
+    # snapshots
+    def test_snapshot_compacts_log(self, tmp_path):
+        ledger = Ledger(str(tmp_path), snapshot_every=5)
+        ledger.recover()
+
+        for value in range(7):
+            ledger.append({'value': value})
+            if ledger.snapshot_due:
+                ledger.snapshot(ledger.sequence, {'total': ledger.sequence})
+        ledger.close()
+
+        state, records = Ledger(str(tmp_path)).recover()
+
+        assert state == {'total': 5}
+        assert records == [{'value': 5}, {'value': 6}]
+
+    # AtmService integration
+    def test_atm_service_state_survives_restart(self, atm_service, tmp_path):
+        atm_service.attach_ledger(Ledger(str(tmp_path), snapshot_every=3))
+        atm_service.deposit('2859459814', 100)
+        atm_service.withdraw('1434597300', 60)
+        atm_service.withdraw('2001377812', 80)
+        atm_service.load_cash('lobby', 1000)
+        atm_service.withdraw('2859459814', 40, 'lobby')
+        atm_service.ledger.close()
+
+        AtmService._instance = None
+        restarted = AtmService()
+        restarted.attach_ledger(Ledger(str(tmp_path)))
+
+        assert restarted.account_balances['2859459814'] == 70.24
+        assert restarted.fleet.get_cash('lobby') == 960
+        assert restarted.account_balances['1434597300'] == 90000.55 - 60
+        assert restarted.account_balances['2001377812'] == -25.0
+        assert restarted.atm_balance == 10000.00 - 140
+        assert len(restarted.transaction_history['2001377812']) == 2
+        assert next(iter(restarted.transaction_history['2001377812']))[1] == -500
+
+    def test_cassettes_survive_restart(self, atm_service, tmp_path):
+        atm_service.attach_ledger(Ledger(str(tmp_path), snapshot_every=3))
+        atm_service.load_notes('lobby', {20: 10, 50: 4}, EVEN_WEAR)
+        atm_service.withdraw('1434597300', 100, 'lobby')
+        atm_service.withdraw('1434597300', 70, 'lobby')  # after the snapshot
+        atm_service.ledger.close()
+
+        AtmService._instance = None
+        restarted = AtmService()
+        restarted.attach_ledger(Ledger(str(tmp_path)))
+
+        assert restarted.fleet.get_notes('lobby') == atm_service.fleet.get_notes('lobby')
+        assert restarted.fleet.get_cash('lobby') == 230
+        assert restarted.fleet.terminals['lobby'].strategy == EVEN_WEAR
+
+    def test_restart_maps_account_snapshot_and_loads_history_lazily(self, atm_service, tmp_path):
+        atm_service.attach_ledger(Ledger(str(tmp_path), snapshot_every=2))
+        for _ in range(3):
+            atm_service.deposit('2859459814', 10)
+        atm_service.withdraw('1434597300', 20)
+        atm_service.ledger.close()
+
+        assert [name for name in os.listdir(str(tmp_path)) if name.startswith('accounts-')] == ['accounts-4']
+
+        AtmService._instance = None
+        restarted = AtmService()
+        restarted.attach_ledger(Ledger(str(tmp_path)))
+
+        assert restarted.account_balances.index == {}
+        assert restarted.transaction_history._loaded == {}
+        assert restarted.get_balance('2859459814') == 'Current Balance: $40.24'
+        assert restarted.read_view('2859459814') == (40.24, 3)
+        assert restarted.transaction_history._loaded == {}
+        assert len(restarted.transaction_history['2859459814']) == 3
+        assert list(restarted.transaction_history._loaded) == ['2859459814']
+
+    def test_sweeps_are_one_entry_each(self, atm_service, tmp_path):
+        atm_service.attach_ledger(Ledger(str(tmp_path)))
+        atm_service.account_balances['2859459814'] = -50
+        atm_service.account_balances['7089382418'] = -10
+
+        assert atm_service.assess_overdraft_fees() == 2
+        assert atm_service.accrue_interest(0.01) == 2
+        assert (atm_service.ledger.sequence, atm_service.ledger.fsync_count) == (2, 2)
+        atm_service.ledger.close()
+
+        AtmService._instance = None
+        restarted = AtmService()
+        restarted.attach_ledger(Ledger(str(tmp_path)))
+
+        assert restarted.account_balances['7089382418'] == -15
+        assert restarted.account_balances['1434597300'] == atm_service.account_balances['1434597300']
+        assert len(restarted.transaction_history['2859459814']) == 1
+
+    def test_snapshot_due_mid_withdrawal_waits_for_it(self, atm_service, tmp_path):
+        atm_service.attach_ledger(Ledger(str(tmp_path), snapshot_every=1))
+        atm_service.withdraw('2001377812', 80)  # overdraft: the withdrawal and its fee are one entry
+        assert atm_service.ledger.snapshot_sequence == 1
+        atm_service.ledger.close()
+
+        AtmService._instance = None
+        restarted = AtmService()
+        restarted.attach_ledger(Ledger(str(tmp_path)))
+
+        assert restarted.account_balances['2001377812'] == -25.0
+        assert [event[2] for event in restarted.transaction_history['2001377812']][:2] == [-2500, -2000]
+
+    def test_one_snapshot_at_a_time(self, atm_service, tmp_path, monkeypatch):
+        atm_service.attach_ledger(Ledger(str(tmp_path), snapshot_every=2))
+        get_state = atm_service.get_state
+        started, finish = threading.Event(), threading.Event()
+        calls = []
+
+        def slow_get_state():
+            calls.append(threading.current_thread())
+            started.set()
+            finish.wait(10)
+            return get_state()
+
+        monkeypatch.setattr(atm_service, 'get_state', slow_get_state)
+        atm_service.deposit('2859459814', 10)
+        snapshotting = threading.Thread(target=atm_service.deposit, args=('2859459814', 10))
+        snapshotting.start()
+        started.wait(10)
+        # the snapshot is still due, these leave it to the thread already taking it
+        atm_service.deposit('1434597300', 10)
+        atm_service.deposit('1434597300', 10)
+        finish.set()
+        snapshotting.join(10)
+
+        assert calls == [snapshotting]
+        assert atm_service.ledger.snapshot_sequence == 4
@@ -0,0 +1,73 @@
+import json
+
+from services import log_pipeline
+from services.log_pipeline import StructuredLog
+
+
+class TestStructuredLog:
+
+    @staticmethod
+    def read_records(path):
+        with open(path, 'r') as log_file:
+            return [json.loads(line) for line in log_file]
+
+    def test_records_are_discarded_until_started(self, tmp_path):
+        structured_log = StructuredLog()
+
+        structured_log.info('Deposit successful', account_id='1')
+
+        assert structured_log.dropped == 0
+        assert not list(tmp_path.iterdir())
+
+    def test_records_are_written_as_json_lines(self, tmp_path):
+        path = str(tmp_path / 'atm.log')
+        structured_log = StructuredLog()
+        structured_log.start(path)
+
+        structured_log.info('Withdrawal successful', account_id='2859459814', amount=80, balance=20)
+        structured_log.warning('Not multiple of 20', account_id='2859459814')
+        structured_log.stop()
+
+        records = self.read_records(path)
+        assert [(record['level'], record['event']) for record in records] == \
+               [('INFO', 'Withdrawal successful'), ('WARNING', 'Not multiple of 20')]
+        assert records[0]['amount'] == 80 and records[0]['balance'] == 20
+        assert records[1]['account_id'] == '2859459814'
+
+    def test_exception_records_the_traceback(self, tmp_path):
+        path = str(tmp_path / 'atm.log')
+        structured_log = StructuredLog()
+        structured_log.start(path)
+
+        try:
+            int('abc')
+        except ValueError:
+            structured_log.exception('Command failed', command='withdraw')
+        structured_log.stop()
+
+        [record] = self.read_records(path)
+        assert (record['level'], record['event'], record['command']) == ('ERROR', 'Command failed', 'withdraw')
+        assert 'ValueError' in record['traceback']
+
+    def test_log_file_is_rotated(self, tmp_path):
+        path = str(tmp_path / 'atm.log')
+        structured_log = StructuredLog()
+        structured_log.start(path, max_bytes=200, backup_count=2)
+
+        for number in range(100):
+            structured_log.info('Deposit successful', number=number)
+        structured_log.stop()
+
+        files = sorted(file.name for file in tmp_path.iterdir())
+        assert files == ['atm.log', 'atm.log.1', 'atm.log.2']
+        assert self.read_records(path)[-1]['number'] == 99
+
+    def test_records_are_dropped_when_writer_falls_behind(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(log_pipeline, 'MAX_PENDING', 0)
+        structured_log = StructuredLog()
+        structured_log.start(str(tmp_path / 'atm.log'))
+
+        structured_log.info('Deposit successful')
+        structured_log.stop()
+
+        assert structured_log.dropped == 1
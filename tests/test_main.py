@@ -0,0 +1,77 @@
+import argparse
+import io
+import json
+
+import pytest
+
+import main
+from batch_replay import replay
+from services.atm_service import AtmService
+from services.authorization_service import AuthorizationService
+
+
+class TestProcessCommand:
+
+    @pytest.fixture
+    def session(self, monkeypatch):
+        monkeypatch.setattr(AtmService, '_instance', None)
+        monkeypatch.setattr(AuthorizationService, '_instance', None)
+        monkeypatch.setattr(main, 'atm_service', AtmService())
+        monkeypatch.setattr(main, 'authorization_service', AuthorizationService())
+        main.process_command('authorize', '1434597300', '4557', session_id='session-1')
+        return 'session-1'
+
+    def test_history_pages(self, session):
+        main.process_command('deposit', '10', session_id=session)
+        main.process_command('deposit', '10', session_id=session)
+
+        assert main.process_command('history', '1', session_id=session).endswith('history 1 1')
+
+    @pytest.mark.parametrize('args', [('abc',), ('1.5',), ('ten', '3')])
+    def test_history_page_size_that_is_not_a_number(self, session, args):
+        assert main.process_command('history', *args, session_id=session) == main.HISTORY_USAGE
+
+    def test_history_last_days(self, session):
+        main.process_command('deposit', '10', session_id=session)
+
+        assert main.process_command('history', 'last', '7', session_id=session) != 'No history found.'
+
+    @pytest.mark.parametrize('args', [('last',), ('last', 'week'), ('last', '-3'), ('last', '7', '2')])
+    def test_history_last_without_a_number_of_days(self, session, args):
+        assert main.process_command('history', *args, session_id=session) == main.HISTORY_LAST_USAGE
+
+    def test_history_last_zero_days(self, session):
+        assert main.process_command('history', 'last', '0', session_id=session) == \
+            'Please enter a number of days greater than zero.'
+
+    def test_unknown_terminal_is_refused(self, session):
+        assert main.process_command('authorize', '1434597300', '4557', session_id='session-2', terminal_id='lobby') \
+            == 'Unknown terminal.'
+        assert main.process_command('withdraw', '20', session_id=session, terminal_id='lobby') == 'Unknown terminal.'
+
+    def test_batch_replay_at_loaded_and_unknown_terminals(self, session):
+        main.atm_service.load_cash('lobby', 100)
+        records = [{'session': session, 'terminal': 'lobby', 'command': 'withdraw', 'args': ['20']},
+                   {'session': session, 'terminal': 'drive-up', 'command': 'withdraw', 'args': ['20']}]
+        output = io.StringIO()
+
+        replay(io.StringIO(''.join(json.dumps(record) + '\n' for record in records)), output, main.process_command)
+
+        results = [json.loads(line)['result'] for line in output.getvalue().splitlines()]
+        assert results[0].startswith('Amount dispensed: $20.')
+        assert results[1] == 'Unknown terminal.'
+        assert main.atm_service.fleet.get_cash('lobby') == 80
+
+    def test_load_options(self):
+        assert main.parse_cash_load('lobby=5000') == ('lobby', 5000)
+        assert main.parse_notes_load('lobby=20:100,50:40') == ('lobby', {20: 100, 50: 40})
+
+    @pytest.mark.parametrize('value', ['lobby', '=50', 'lobby=-5', 'lobby=nan'])
+    def test_malformed_cash_load(self, value):
+        with pytest.raises(argparse.ArgumentTypeError):
+            main.parse_cash_load(value)
+
+    @pytest.mark.parametrize('value', ['lobby', 'lobby=20', 'lobby=20:x', 'lobby=20:0'])
+    def test_malformed_notes_load(self, value):
+        with pytest.raises(argparse.ArgumentTypeError):
+            main.parse_notes_load(value)
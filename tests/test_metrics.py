@@ -0,0 +1,169 @@
+import sys
+import threading
+import types
+import urllib.request
+
+import pytest
+
+import main
+from services import metrics as metrics_module
+from services.atm_service import AtmService
+from services.metrics import Metrics, metrics
+
+
+class Service:
+    def work(self, value):
+        return value * 2
+
+
+class TestMetrics:
+
+    @pytest.fixture
+    def local_metrics(self):
+        local_metrics = Metrics()
+        local_metrics.define('jobs_total', 'counter', 'outcome', 'Jobs by outcome.')
+        local_metrics.define('job_seconds', 'histogram', 'method', 'Job latency.')
+        local_metrics.enable()
+        yield local_metrics
+        local_metrics.disable()
+
+    @pytest.fixture
+    def shared_metrics(self):
+        metrics.reset()
+        metrics.enable()
+        yield metrics
+        metrics.disable()
+        metrics.reset()
+
+    def test_disabled_metrics_record_nothing(self):
+        disabled = Metrics()
+
+        disabled.increment('jobs_total', 'ok')
+        disabled.observe('job_seconds', 'work', 100)
+
+        assert disabled.counters == {} and disabled.histograms == {}
+
+    def test_instrument_times_calls_and_disable_restores(self, local_metrics):
+        original = Service.work
+        local_metrics.instrument(Service, 'work', 'job_seconds')
+
+        assert Service().work(21) == 42
+        histogram = local_metrics.histograms[('job_seconds', 'work')]
+        assert sum(histogram.counts) == 1
+
+        local_metrics.disable()
+        assert Service.work is original
+
+    def test_threads_recording_at_once_lose_nothing(self, local_metrics):
+        local_metrics.instrument(Service, 'work', 'job_seconds')
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # switch threads as often as possible to expose races
+
+        def record():
+            for _ in range(2000):
+                local_metrics.increment('jobs_total', 'ok')
+                Service().work(1)
+
+        threads = [threading.Thread(target=record) for _ in range(8)]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+        assert local_metrics.counters == {('jobs_total', 'ok'): 16000}
+        assert sum(local_metrics.histograms[('job_seconds', 'work')].counts) == 16000
+
+    def test_labelled_calls_and_reset_keep_wrappers_recording(self, local_metrics):
+        commands = types.SimpleNamespace(run=lambda command, *args: command)
+        local_metrics.instrument(commands, 'run', 'job_seconds',
+                                 lambda command, *args: command if command in ('balance', 'deposit') else 'other')
+
+        for command in ('balance', 'balance', 'bogus', 'deposit', 'deposit', 'deposit'):
+            commands.run(command)
+
+        assert {label: sum(histogram.counts) for (_, label), histogram in local_metrics.histograms.items()} == \
+            {'balance': 2, 'other': 1, 'deposit': 3}
+        local_metrics.reset()
+        assert local_metrics.histograms == {}
+        commands.run('balance')
+        assert sum(local_metrics.histograms[('job_seconds', 'balance')].counts) == 1
+
+    def test_buffered_latencies_are_bucketed(self, local_metrics, monkeypatch):
+        monkeypatch.setattr(metrics_module, 'FOLD_SAMPLES', 4)
+
+        for elapsed_ns in (500, 3000, 3000, 2_000_000_000, 7000):
+            local_metrics.observe('job_seconds', 'work', elapsed_ns)
+
+        histogram = local_metrics.histograms[('job_seconds', 'work')]
+        assert histogram.counts[0] == 1 and histogram.counts[2] == 2 and histogram.counts[3] == 1
+        assert histogram.counts[-1] == 1
+        assert histogram.total_ns == 2_000_013_500
+
+    def test_render_prometheus_text(self, local_metrics):
+        local_metrics.increment('jobs_total', 'ok')
+        local_metrics.increment('jobs_total', 'ok')
+        local_metrics.observe('job_seconds', 'work', 3000)  # 3us
+
+        text = local_metrics.render()
+
+        assert '# TYPE jobs_total counter' in text
+        assert 'jobs_total{outcome="ok"} 2' in text
+        assert 'job_seconds_bucket{method="work",le="2.5e-06"} 0' in text
+        assert 'job_seconds_bucket{method="work",le="5e-06"} 1' in text
+        assert 'job_seconds_bucket{method="work",le="+Inf"} 1' in text
+        assert 'job_seconds_count{method="work"} 1' in text
+
+    def test_gauges_are_read_when_rendered(self, local_metrics):
+        cash = [100]
+        local_metrics.gauge('cash_dollars', 'Cash.', lambda: cash[0])
+
+        first = local_metrics.render()
+        cash[0] = 40
+
+        assert '# TYPE cash_dollars gauge' in first
+        assert 'cash_dollars 100' in first
+        assert 'cash_dollars 40' in local_metrics.render()
+
+    def test_serve_exposes_metrics_endpoint(self, local_metrics):
+        local_metrics.increment('jobs_total', 'ok')
+        server = local_metrics.serve(0)
+        try:
+            url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+            with urllib.request.urlopen(url) as response:
+                body = response.read().decode()
+        finally:
+            server.shutdown()
+
+        assert 'jobs_total{outcome="ok"} 1' in body
+
+    def test_withdrawal_outcomes_are_counted(self, shared_metrics):
+        atm_service = AtmService()
+        atm_service.account_balances['2001377812'] = 100
+        atm_service.atm_balance = 500
+
+        atm_service.withdraw('2001377812', 30)
+        atm_service.withdraw('2001377812', 60)
+        atm_service.withdraw('2001377812', 60)
+
+        assert shared_metrics.counters == {
+            ('atm_withdrawals_total', 'rejected'): 1,
+            ('atm_withdrawals_total', 'dispensed'): 1,
+            ('atm_withdrawals_total', 'overdraft'): 1
+        }
+
+    def test_fleet_summary_is_exposed_as_gauges(self, shared_metrics, monkeypatch):
+        monkeypatch.setattr(AtmService, '_instance', None)
+        atm_service = AtmService()
+        atm_service.atm_balance = 500
+        atm_service.fleet.register('t1', 0)
+        monkeypatch.setattr(main, 'atm_service', atm_service)
+
+        main.enable_metrics(0).shutdown()
+        text = shared_metrics.render()
+
+        assert 'atm_terminals 2' in text
+        assert 'atm_cash_dollars 500' in text
+        assert 'atm_terminals_out_of_service 1' in text
@@ -0,0 +1,119 @@
+import cProfile
+import os
+import pstats
+import threading
+
+import pytest
+
+from services import profiler as profiler_module
+from services.profiler import Profiler
+
+
+class Service:
+    started = None
+    proceed = None
+
+    def dispatch(self, command, session_id='default'):
+        return self.work(command)
+
+    def work(self, command):
+        if command == 'wait':
+            self.started.set()
+            self.proceed.wait(10)
+        return command.upper()
+
+
+class TestProfiler:
+
+    @pytest.fixture
+    def profiler(self):
+        profiler = Profiler()
+        profiler.instrument(Service, 'dispatch', lambda service, command: command,
+                            lambda service, command, session_id='default': session_id)
+        yield profiler
+        profiler.uninstrument()
+
+    def test_sampled_commands_are_written_per_command(self, profiler, tmp_path):
+        profiler.start(str(tmp_path), sample_rate=1.0)
+        Service().dispatch('balance')
+        Service().dispatch('balance')
+        Service().dispatch('withdraw')
+
+        paths = profiler.stop()
+
+        assert [os.path.basename(path).split('-')[0] for path in paths] == ['balance', 'withdraw']
+        functions = {name: counts for (_, _, name), counts in pstats.Stats(paths[0]).stats.items()}
+        assert functions['work'][1] == 2  # called twice, beneath dispatch
+
+    def test_sessions_outside_the_sample_are_not_profiled(self, profiler, tmp_path):
+        profiler.start(str(tmp_path), sample_rate=0.5)
+        sessions = [f'session-{number}' for number in range(100)]
+        for session_id in sessions:
+            Service().dispatch('balance', session_id=session_id)
+
+        [path] = profiler.stop()
+
+        sampled = sum(profiler.is_sampled(session_id) for session_id in sessions)
+        assert 20 < sampled < 80
+        functions = {name: counts for (_, _, name), counts in pstats.Stats(path).stats.items()}
+        assert functions['work'][1] == sampled
+
+    def test_each_round_samples_different_sessions(self, profiler, tmp_path):
+        sessions = [f'session-{number}' for number in range(100)]
+        samples = []
+        for _ in range(20):
+            profiler.start(str(tmp_path), sample_rate=0.5)
+            samples.append({session_id for session_id in sessions if profiler.is_sampled(session_id)})
+            profiler.stop()
+
+        assert len({frozenset(sample) for sample in samples}) > 1
+        # no session is left out of every round
+        assert set().union(*samples) == set(sessions)
+
+    def test_calls_while_another_is_profiled_run_unprofiled(self, profiler, tmp_path):
+        Service.started, Service.proceed = threading.Event(), threading.Event()
+        profiler.start(str(tmp_path), sample_rate=1.0)
+        waiting = threading.Thread(target=Service().dispatch, args=('wait',))
+        waiting.start()
+        Service.started.wait(10)
+
+        assert Service().dispatch('balance') == 'BALANCE'
+        Service.proceed.set()
+        waiting.join()
+
+        paths = profiler.stop()
+        assert [os.path.basename(path).split('-')[0] for path in paths] == ['wait']
+
+    def test_profiling_tool_already_active_leaves_calls_unprofiled(self, profiler, tmp_path, monkeypatch):
+        class Busy(cProfile.Profile):
+            def enable(self, *args, **kwargs):
+                raise ValueError('Another profiling tool is already active')
+
+        monkeypatch.setattr(profiler_module.cProfile, 'Profile', Busy)
+        profiler.start(str(tmp_path), sample_rate=1.0)
+
+        assert Service().dispatch('balance') == 'BALANCE'
+        assert profiler.stop() == []
+
+        monkeypatch.undo()
+        profiler.start(str(tmp_path), sample_rate=1.0)
+        Service().dispatch('balance')
+        assert len(profiler.stop()) == 1
+
+    def test_stopped_profiler_records_nothing_and_restarts(self, profiler, tmp_path):
+        assert Service().dispatch('balance') == 'BALANCE'
+        profiler.start(str(tmp_path), sample_rate=1.0)
+
+        assert profiler.toggle() == []
+        Service().dispatch('balance')
+        assert profiler.toggle() == []
+
+        Service().dispatch('balance')
+        assert len(profiler.toggle()) == 1
+
+    def test_uninstrument_restores(self, profiler):
+        original = Service.dispatch.__wrapped__
+
+        profiler.uninstrument()
+
+        assert Service.dispatch is original
@@ -0,0 +1,118 @@
+import os
+import sqlite3
+
+import pytest
+
+import reconcile
+from reconcile import audit, load_account_snapshot, load_sqlite
+from services.atm_service import AtmService
+from services.ledger import Ledger
+from services.repository import DEFAULT_ACCOUNTS
+from services.sqlite_repository import SqliteRepository
+
+
+class TestReconcile:
+
+    @pytest.fixture
+    def atm_service(self):
+        AtmService._instance = None
+        service = AtmService()
+        yield service
+        if service.ledger:
+            service.ledger.close()
+        AtmService._instance = None
+
+    @pytest.fixture
+    def database_path(self, atm_service, tmp_path):
+        path = os.path.join(str(tmp_path), 'atm.db')
+        atm_service.attach_ledger(SqliteRepository(path))
+        atm_service.withdraw('1434597300', 100)
+        atm_service.deposit('2859459814', 5.50)
+        atm_service.withdraw('2001377812', 80)  # overdraft and fee
+        atm_service.load_cash('lobby', 500)
+        atm_service.withdraw('1434597300', 60, 'lobby')
+        atm_service.ledger.close()
+        return path
+
+    @staticmethod
+    def tamper(path, statement):
+        with sqlite3.connect(path) as connection:
+            connection.execute(statement)
+        connection.close()
+
+    def test_consistent_database(self, database_path):
+        columns = load_sqlite(database_path)
+
+        assert audit(columns) == []
+        assert audit(columns, {account_id: balance for account_id, (_, balance) in DEFAULT_ACCOUNTS.items()}) == []
+        assert len(columns.ids) == 4 and len(columns.amounts) == 5
+
+    def test_balance_that_does_not_match_history(self, database_path):
+        self.tamper(database_path, "UPDATE accounts SET balance_cents = balance_cents + 1 "
+                                   "WHERE account_id = '2001377812'")
+
+        assert audit(load_sqlite(database_path)) == [
+            {'check': 'balance', 'account_id': '2001377812', 'expected': -25, 'actual': -24.99}]
+
+    def test_broken_history(self, database_path):
+        self.tamper(database_path, "UPDATE history SET amount_cents = -600 WHERE account_id = '2001377812' "
+                                   "AND kind = 3")
+
+        assert audit(load_sqlite(database_path)) == [
+            {'check': 'history', 'account_id': '2001377812'},
+            {'check': 'balance', 'account_id': '2001377812', 'expected': -26, 'actual': -25}]
+
+    def test_first_event_is_checked_against_known_opening_balance(self, database_path):
+        self.tamper(database_path, "UPDATE history SET amount_cents = -8100 WHERE account_id = '2001377812' "
+                                   "AND kind = 2")
+        openings = {account_id: balance for account_id, (_, balance) in DEFAULT_ACCOUNTS.items()}
+
+        # nothing before the first event to chain it to, and it looks like $81 left the default drawer
+        assert audit(load_sqlite(database_path), openings) == [
+            {'check': 'balance', 'account_id': '2001377812', 'expected': -26, 'actual': -25},
+            {'check': 'cash', 'terminal_id': 'default', 'expected': 9819, 'actual': 9820}]
+
+    def test_opening_balance(self, database_path):
+        discrepancies = audit(load_sqlite(database_path), {'7089382418': 1.00})
+
+        assert discrepancies == [{'check': 'balance', 'account_id': '7089382418', 'expected': 1, 'actual': 0}]
+
+    def test_cash_drawers(self, database_path):
+        self.tamper(database_path, "UPDATE terminals SET cash_cents = cash_cents - 2000 WHERE terminal_id = 'lobby'")
+
+        assert audit(load_sqlite(database_path)) == [
+            {'check': 'cash', 'terminal_id': 'lobby', 'expected': 440, 'actual': 420}]
+
+    def test_orphaned_history(self, database_path):
+        self.tamper(database_path, "DELETE FROM accounts WHERE account_id = '2859459814'")
+
+        assert audit(load_sqlite(database_path)) == [{'check': 'orphan', 'account_id': '2859459814'}]
+
+    def test_history_read_in_batches(self, database_path, monkeypatch):
+        self.tamper(database_path, "DELETE FROM accounts WHERE account_id = '2859459814'")
+        whole = load_sqlite(database_path)
+        monkeypatch.setattr(reconcile, 'HISTORY_BATCH_ROWS', 2)
+
+        batched = load_sqlite(database_path)
+
+        assert batched.offsets.tolist() == whole.offsets.tolist()
+        assert batched.amounts.tolist() == whole.amounts.tolist()
+        assert batched.event_terminals.tolist() == whole.event_terminals.tolist()
+        assert audit(batched) == [{'check': 'orphan', 'account_id': '2859459814'}]
+
+    def test_cash_loads_are_backfilled_for_older_databases(self, database_path):
+        self.tamper(database_path, 'DROP TABLE cash_loads')
+        SqliteRepository(database_path).close()
+
+        assert audit(load_sqlite(database_path)) == []
+
+    def test_ledger_account_snapshot(self, atm_service, tmp_path):
+        atm_service.attach_ledger(Ledger(str(tmp_path), snapshot_every=2))
+        atm_service.deposit('2859459814', 10)
+        atm_service.withdraw('2001377812', 80)
+        atm_service.ledger.close()
+
+        columns = load_account_snapshot(str(tmp_path))
+
+        assert audit(columns) == []
+        assert len(columns.amounts) == 3
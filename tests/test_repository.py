@@ -0,0 +1,170 @@
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from services.atm_service import AtmService
+from services.authorization_service import AuthorizationService
+from services.credentials import verify_pin
+from services.repository import MemoryRepository
+from services.sqlite_repository import SqliteRepository
+
+
+class TestRepository:
+
+    @pytest.fixture
+    def atm_service(self):
+        AtmService._instance = None
+        yield AtmService()
+        AtmService._instance = None
+
+    @pytest.fixture
+    def database_path(self, tmp_path):
+        return os.path.join(str(tmp_path), 'atm.db')
+
+    def reopen(self, path):
+        AtmService._instance = None
+        repository = SqliteRepository(path)
+        atm_service = AtmService()
+        atm_service.attach_ledger(repository)
+        return atm_service, repository
+
+    # in-memory backend
+    def test_memory_repository_seeds_default_accounts(self, atm_service):
+        assert atm_service.get_balance('1434597300') == 'Current Balance: $90000.55'
+        assert atm_service.atm_balance == 10000
+        assert verify_pin('7386', MemoryRepository().load_pins()['2859459814'])
+
+    # SQLite backend
+    def test_new_database_is_seeded(self, database_path):
+        repository = SqliteRepository(database_path)
+
+        state = repository.load_state()
+
+        assert state['account_balances']['1434597300'] == 90000.55
+        assert state['atm_cash'] == {'default': 10000}
+        assert verify_pin('5950', repository.load_pins()['2001377812'])
+        repository.close()
+
+    def test_transactions_survive_restart(self, atm_service, database_path):
+        repository = SqliteRepository(database_path)
+        atm_service.attach_ledger(repository)
+        atm_service.withdraw('1434597300', 100)
+        atm_service.deposit('2859459814', 5.50)
+        atm_service.load_cash('lobby', 500)
+        atm_service.withdraw('1434597300', 60, 'lobby')
+        repository.close()
+
+        restarted, repository = self.reopen(database_path)
+
+        assert restarted.get_balance('1434597300') == 'Current Balance: $89840.55'
+        assert restarted.get_balance('2859459814') == 'Current Balance: $15.74'
+        assert restarted.read_view('1434597300')[1] == 2
+        assert restarted.transaction_history._loaded == {}  # balance reads leave history in the database
+        assert restarted.atm_balance == 9900
+        assert restarted.fleet.get_cash('lobby') == 440
+        assert len(restarted.transaction_history['1434597300']) == 2
+        [(_, amount, balance, kind)] = repository.load_history('2859459814')
+        assert (amount, balance, kind) == (550, 1574, 1)
+        repository.close()
+
+    def test_cassettes_survive_restart(self, atm_service, database_path):
+        repository = SqliteRepository(database_path)
+        atm_service.attach_ledger(repository)
+        atm_service.load_notes('lobby', {20: 10, 50: 4})
+        atm_service.withdraw('1434597300', 90, 'lobby')
+        repository.close()
+
+        restarted, repository = self.reopen(database_path)
+
+        assert restarted.fleet.get_notes('lobby') == {20: 8, 50: 3}
+        assert restarted.fleet.get_cash('lobby') == 310
+        repository.close()
+
+    def test_pins_load_into_authorization_service(self, database_path):
+        repository = SqliteRepository(database_path)
+        AuthorizationService._instance = None
+        authorization_service = AuthorizationService()
+
+        authorization_service.load_pins(repository)
+
+        assert authorization_service.authorize('2859459814', '7386', 'terminal-1') == \
+            '2859459814 successfully authorized.'
+        AuthorizationService._instance = None
+        repository.close()
+
+    def test_appends_are_batched_into_one_transaction_per_group(self, atm_service, database_path):
+        repository = SqliteRepository(database_path, synchronous=False, group_size=10)
+        atm_service.attach_ledger(repository)
+
+        for _ in range(25):
+            atm_service.deposit('1434597300', 1)
+        repository.close()
+
+        assert repository.commit_count == 3
+        restarted, repository = self.reopen(database_path)
+        assert restarted.get_balance('1434597300') == 'Current Balance: $90025.55'
+        repository.close()
+
+    def test_concurrent_synchronous_appends_share_commits(self, atm_service, database_path):
+        repository = SqliteRepository(database_path)
+        atm_service.attach_ledger(repository)
+
+        def deposit_many():
+            for _ in range(50):
+                atm_service.deposit('1434597300', 1)
+
+        threads = [threading.Thread(target=deposit_many) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        repository.close()
+
+        assert repository.commit_count <= 400
+        restarted, repository = self.reopen(database_path)
+        assert restarted.get_balance('1434597300') == 'Current Balance: $90400.55'
+        repository.close()
+
+    def test_balances_display_as_they_do_in_memory_after_restart(self, atm_service, database_path):
+        repository = SqliteRepository(database_path)
+        atm_service.attach_ledger(repository)
+        atm_service.deposit('7089382418', 100)
+        repository.close()
+        expected = [atm_service.get_balance(account_id) for account_id in ('2001377812', '7089382418')]
+
+        restarted, repository = self.reopen(database_path)
+        assert [restarted.get_balance(account_id) for account_id in ('2001377812', '7089382418')] == expected
+        assert expected == ['Current Balance: $60.0', 'Current Balance: $100.0']
+        repository.close()
+
+    def test_failed_commit_keeps_its_records(self, atm_service, database_path, monkeypatch):
+        repository = SqliteRepository(database_path)
+        atm_service.attach_ledger(repository)
+        write = repository._write
+
+        def fail_once(records):
+            monkeypatch.setattr(repository, '_write', write)
+            raise sqlite3.OperationalError('disk I/O error')
+
+        monkeypatch.setattr(repository, '_write', fail_once)
+        with pytest.raises(sqlite3.OperationalError):
+            atm_service.deposit('1434597300', 1)
+        atm_service.deposit('1434597300', 1)
+        repository.close()
+
+        assert repository.commit_count == 1
+        restarted, repository = self.reopen(database_path)
+        assert restarted.get_balance('1434597300') == 'Current Balance: $90002.55'
+        repository.close()
+
+    def test_reader_pool_is_bounded(self, database_path):
+        repository = SqliteRepository(database_path, readers=2)
+
+        with repository.reader() as first, repository.reader() as second:
+            assert first is not second
+        with repository.reader() as reused:
+            assert reused in (first, second)
+        assert repository._created_readers == 2
+        repository.close()
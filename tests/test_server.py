@@ -0,0 +1,114 @@
+import asyncio
+import json
+
+from load_client import run_load
+from server import AtmServer
+
+
+class TestAtmServer:
+
+    @staticmethod
+    def run_with_server(handler, client, **server_options):
+        ended_sessions = []
+        session_ids = iter(range(1000))
+
+        async def run():
+            server = AtmServer(handler, lambda: f'session-{next(session_ids)}', ended_sessions.append,
+                               **server_options)
+            port = await server.start(port=0)
+            try:
+                return await client(port)
+            finally:
+                await server.stop()
+
+        return asyncio.run(run()), ended_sessions
+
+    @staticmethod
+    async def send_lines(port, lines):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        responses = []
+        for line in lines:
+            writer.write(line.encode() + b'\n')
+            await writer.drain()
+            responses.append(json.loads(await reader.readline()))
+        writer.close()
+        await writer.wait_closed()
+        return responses
+
+    def test_commands_are_dispatched_with_connection_session(self):
+        def handler(command, *args, session_id, source):
+            return f'{session_id} {command} {" ".join(args)}'
+
+        async def client(port):
+            return await asyncio.gather(self.send_lines(port, ['balance', 'withdraw 80']),
+                                        self.send_lines(port, ['deposit 10']))
+
+        (first, second), ended_sessions = self.run_with_server(handler, client)
+
+        assert first[0].split()[0] == first[1].split()[0]
+        assert first[1].split()[1:] == ['withdraw', '80']
+        assert second[0].split()[0] != first[0].split()[0]
+        assert sorted(ended_sessions) == ['session-0', 'session-1']
+
+    def test_commands_carry_the_peer_address(self):
+        async def client(port):
+            return await asyncio.gather(self.send_lines(port, ['balance']), self.send_lines(port, ['balance']))
+
+        responses, _ = self.run_with_server(lambda command, *args, session_id, source: source, client)
+
+        assert responses == [['127.0.0.1'], ['127.0.0.1']]
+
+    def test_connections_identify_their_terminal(self):
+        def handler(command, *args, session_id, source, terminal_id='default'):
+            return terminal_id
+
+        async def client(port):
+            return await asyncio.gather(self.send_lines(port, ['terminal t1', 'withdraw 80']),
+                                        self.send_lines(port, ['terminal t9', 'withdraw 80']),
+                                        self.send_lines(port, ['withdraw 80']))
+
+        responses, _ = self.run_with_server(handler, client, terminals={'t1': None})
+
+        assert responses == [['Terminal t1 ready.', 't1'], ['Unknown terminal.', 'default'], ['default']]
+
+    def test_multi_line_results_stay_one_response(self):
+        async def client(port):
+            return await self.send_lines(port, ['withdraw 80'])
+
+        responses, _ = self.run_with_server(lambda command, *args, session_id, source: 'line one \n line two', client)
+
+        assert responses == ['line one \n line two']
+
+    def test_handler_errors_do_not_drop_connection(self):
+        def handler(command, *args, session_id, source):
+            if command == 'bad':
+                raise IndexError()
+            return 'ok'
+
+        async def client(port):
+            return await self.send_lines(port, ['bad', 'good'])
+
+        responses, _ = self.run_with_server(handler, client)
+
+        assert responses == ['Unable to process your request at this time.', 'ok']
+
+    def test_in_flight_requests_are_bounded(self):
+        in_flight = []
+        peak = []
+
+        def handler(command, *args, session_id, source):
+            in_flight.append(1)
+            peak.append(len(in_flight))
+            for _ in range(10000):
+                pass
+            in_flight.pop()
+            return 'ok'
+
+        async def client(port):
+            return await run_load('127.0.0.1', port, terminals=20, requests=10)
+
+        report, _ = self.run_with_server(handler, client, max_in_flight=2, workers=8)
+
+        assert report['requests'] == 20 * 11
+        assert max(peak) <= 2
+        assert report['p99_ms'] >= report['p50_ms']
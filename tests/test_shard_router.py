@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+import main
+from services.repository import DEFAULT_ACCOUNTS
+from shard_router import ShardRouter, shard_for
+
+
+# starting shard processes is slow, so the tests share one router
+@pytest.fixture(scope='module')
+def router():
+    router = ShardRouter(2)
+    yield router
+    router.close()
+
+
+class TestShardRouter:
+
+    @pytest.fixture
+    def sharded_main(self, router):
+        atm_service = main.atm_service
+        main.atm_service = router
+        yield router
+        main.atm_service = atm_service
+
+    def test_accounts_are_spread_across_shards(self):
+        assert {shard_for(account_id, 2) for account_id in DEFAULT_ACCOUNTS} == {0, 1}
+        assert shard_for('2859459814', 2) == shard_for('2859459814', 2)
+
+    def test_commands_reach_the_owning_shard(self, sharded_main):
+        main.process_command('authorize', '1434597300', '4557', session_id='shard-1')
+
+        assert main.process_command('deposit', '10', session_id='shard-1') == 'Current balance: 90010.55.'
+        assert main.process_command('withdraw', '20', session_id='shard-1') == \
+            'Amount dispensed: $20. \n Current balance: $89990.55.'
+        assert main.process_command('balance', session_id='shard-1') == 'Current Balance: $89990.55'
+        assert main.process_command('history', '1', session_id='shard-1').endswith('history 1 1')
+        main.process_command('logout', session_id='shard-1')
+
+    def test_repeated_request_is_answered_once(self, sharded_main):
+        main.process_command('authorize', '2001377812', '5950', session_id='shard-2')
+        cash = sharded_main.fleet.get_cash('default')
+
+        first = main.process_command('@r-1', 'withdraw', '20', session_id='shard-2')
+        repeated = main.process_command('@r-1', 'withdraw', '20', session_id='shard-2')
+
+        assert first == repeated
+        assert sharded_main.fleet.get_cash('default') == cash - 20
+        main.process_command('logout', session_id='shard-2')
+
+    def test_rejected_withdrawal_returns_reserved_cash(self, router):
+        cash = router.fleet.get_cash('default')
+
+        assert router.withdraw('2859459814', 30) == 'Please enter a multiple of $20.'
+        assert router.fleet.get_cash('default') == cash
+
+    def test_cash_is_coordinated_across_shards(self, router):
+        router.load_cash('lobby', 100)
+        results = []
+
+        def withdraw(account_id):
+            results.append(router.withdraw(account_id, 80, 'lobby'))
+
+        threads = [threading.Thread(target=withdraw, args=(account_id,)) for account_id in ('1434597300', '2001377812')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        dispensed = sum(int(result.split('Amount dispensed: $')[1].split('.')[0]) for result in results)
+        assert dispensed == 100
+        assert router.fleet.get_cash('lobby') == 0
+
+    def test_cassettes_stay_in_the_router(self, router):
+        router.load_notes('cassettes', {20: 5, 50: 1})
+
+        assert router.withdraw('1434597300', 30, 'cassettes') == \
+            'Please enter an amount that can be made from $20 and $50 notes.'
+        assert router.withdraw('1434597300', 90, 'cassettes').startswith('Amount dispensed: $90.')
+        assert router.fleet.get_notes('cassettes') == {20: 3, 50: 0}
+
+    def test_end_of_day_runs_on_every_shard(self, router):
+        liability = router.get_total_liability()
+
+        assert router.accrue_interest(0.0) == 0
+        assert router.get_total_liability() == liability
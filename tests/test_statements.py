@@ -0,0 +1,88 @@
+import os
+import zipfile
+from datetime import datetime
+
+import pytest
+
+from services.repository import MemoryRepository
+from services.sqlite_repository import SqliteRepository
+from services.transaction_history import DEPOSIT, WITHDRAWAL
+from statements import StatementJob
+
+NOVEMBER_1 = int(datetime(2023, 11, 1).timestamp())
+DECEMBER_1 = int(datetime(2023, 12, 1).timestamp())
+
+
+class TestStatements:
+
+    @pytest.fixture
+    def repository(self, tmp_path):
+        repository = SqliteRepository(os.path.join(str(tmp_path), 'atm.db'),
+                                      seed=MemoryRepository({'1111111111': ('1111', 100.00),
+                                                             '2222222222': ('2222', 50.00)}))
+        yield repository
+        repository.close()
+
+    @staticmethod
+    def post(repository, account_id, day, amount, balance):
+        # day of November 2023, or of December when past 30
+        timestamp = NOVEMBER_1 + (day - 1) * 86400 + 12 * 3600
+        repository.append({'account_id': account_id, 'terminal_id': 'default',
+                           'history': (timestamp, amount, balance, DEPOSIT if amount > 0 else WITHDRAWAL)})
+
+    @staticmethod
+    def job(repository, tmp_path, **options):
+        return StatementJob(repository.path, os.path.join(str(tmp_path), 'statements'), NOVEMBER_1, DECEMBER_1,
+                            workers=1, chunk_size=1, **options)
+
+    @staticmethod
+    def read(tmp_path, account_id):
+        with open(os.path.join(str(tmp_path), 'statements', f'{account_id}.txt')) as statement_file:
+            return statement_file.read()
+
+    def test_statement_per_account(self, repository, tmp_path):
+        self.post(repository, '1111111111', 2, 2000, 12000)
+        self.post(repository, '1111111111', 3, -8000, 4000)
+        self.post(repository, '1111111111', 31, 1000, 5000)  # December
+
+        report = self.job(repository, tmp_path).run()
+
+        assert report['statements'] == 2
+        assert self.read(tmp_path, '1111111111') == (
+            'Statement for account 1111111111\n'
+            'Period: 2023-11-01 to 2023-11-30\n'
+            'Opening balance: $100\n'
+            '2023-11-02 12:00:00 20 120\n'
+            '2023-11-03 12:00:00 -80 40\n'
+            'Closing balance: $40\n')
+        assert self.read(tmp_path, '2222222222').endswith('Opening balance: $50\nClosing balance: $50\n')
+        assert not os.path.exists(os.path.join(str(tmp_path), 'statements', 'checkpoint.json'))
+
+    def test_resumed_job_leaves_out_history_after_its_cutoff(self, repository, tmp_path):
+        self.post(repository, '2222222222', 2, 2000, 7000)
+        job = self.job(repository, tmp_path)
+        os.makedirs(job.output)
+        job.load_checkpoint(repository._writer)  # started, then interrupted
+        self.post(repository, '2222222222', 4, 1000, 8000)
+
+        report = self.job(repository, tmp_path).run()
+
+        assert report['statements'] == 2
+        assert self.read(tmp_path, '2222222222').endswith('2023-11-02 12:00:00 20 70\nClosing balance: $70\n')
+
+    def test_unfinished_job_for_another_period(self, repository, tmp_path):
+        job = self.job(repository, tmp_path)
+        os.makedirs(job.output)
+        job.load_checkpoint(repository._writer)
+
+        with pytest.raises(ValueError):
+            StatementJob(repository.path, job.output, NOVEMBER_1, DECEMBER_1 + 86400, workers=1).run()
+
+    def test_archive(self, repository, tmp_path):
+        report = self.job(repository, tmp_path, archive=True).run()
+
+        with zipfile.ZipFile(os.path.join(str(tmp_path), 'statements', 'statements.zip')) as archive:
+            assert sorted(archive.namelist()) == ['1111111111.txt', '2222222222.txt']
+            assert archive.read('1111111111.txt').decode().startswith('Statement for account 1111111111\n')
+        assert report['statements'] == 2
+        assert os.listdir(os.path.join(str(tmp_path), 'statements')) == ['statements.zip']
@@ -0,0 +1,61 @@
+from services.throttle import FailureThrottle
+
+
+class TestFailureThrottle:
+
+    def test_locks_after_max_failures_within_window(self):
+        throttle = FailureThrottle(max_failures=3, window=60, lockout=100)
+
+        assert not throttle.record_failure('a', 0)
+        assert not throttle.record_failure('a', 10)
+        assert throttle.record_failure('a', 20)
+        assert throttle.is_locked('a', 119)
+        assert not throttle.is_locked('a', 121)
+
+    def test_failures_outside_window_do_not_count(self):
+        throttle = FailureThrottle(max_failures=3, window=60, lockout=100)
+
+        throttle.record_failure('a', 0)
+        throttle.record_failure('a', 50)
+        throttle.record_failure('a', 100)
+
+        assert not throttle.is_locked('a', 100)
+
+    def test_capacity_evicts_least_recent_key(self):
+        throttle = FailureThrottle(max_failures=3, window=60, lockout=100, capacity=2)
+
+        throttle.record_failure('a', 0)
+        throttle.record_failure('b', 1)
+        throttle.record_failure('a', 2)
+        throttle.record_failure('c', 3)
+
+        assert len(throttle) == 2
+        assert 'b' not in throttle._entries
+
+    def test_full_table_never_evicts_a_lockout(self):
+        throttle = FailureThrottle(max_failures=2, window=60, lockout=100, capacity=2)
+        throttle.record_failure('a', 0)
+        throttle.record_failure('a', 1)
+
+        for number in range(10):
+            throttle.record_failure(f'fresh-{number}', 2 + number)
+
+        assert throttle.is_locked('a', 20)
+        assert len(throttle) == 2
+
+    def test_new_keys_are_refused_while_every_key_is_locked(self):
+        throttle = FailureThrottle(max_failures=1, window=60, lockout=100, capacity=2)
+        throttle.record_failure('a', 0)
+        throttle.record_failure('b', 1)
+
+        assert not throttle.record_failure('c', 2)
+        assert throttle.is_locked('a', 2) and throttle.is_locked('b', 2)
+        assert throttle.record_failure('c', 101)  # once a's lockout ends there is room again
+
+    def test_expired_entries_are_dropped(self):
+        throttle = FailureThrottle(max_failures=3, window=60, lockout=100)
+
+        throttle.record_failure('a', 0)
+        throttle.record_failure('b', 100)
+
+        assert len(throttle) == 1
@@ -0,0 +1,69 @@
+from services.transaction_history import FEE, AccountHistory
+
+
+class TestAccountHistory:
+
+    def test_iterates_newest_first(self):
+        history = AccountHistory()
+        history.append(100, 2000, 2000)
+        history.append(200, -500, 1500)
+
+        assert list(history) == [(200, -500, 1500), (100, 2000, 2000)]
+        assert len(history) == 2
+
+    def test_empty_history_is_falsy(self):
+        assert not AccountHistory()
+
+    def test_columns_round_trip(self):
+        history = AccountHistory()
+        history.append(100, 2000, 2000)
+        history.append(200, -500, 1500)
+
+        restored = AccountHistory.from_columns(history.to_columns())
+
+        assert list(restored) == list(history)
+
+    # page
+    def test_page_walks_history_with_stable_cursor(self):
+        history = AccountHistory()
+        for timestamp in range(5):
+            history.append(timestamp, 100, 100 * (timestamp + 1))
+
+        first_page, cursor = history.page(2)
+        history.append(5, 100, 600)  # new events don't shift later pages
+        second_page, cursor = history.page(2, cursor)
+        last_page, cursor = history.page(2, cursor)
+
+        assert [event[0] for event in first_page] == [4, 3]
+        assert [event[0] for event in second_page] == [2, 1]
+        assert [event[0] for event in last_page] == [0]
+        assert cursor is None
+
+    # time ranges
+    def test_iter_between_uses_half_open_window(self):
+        history = AccountHistory()
+        for timestamp in (10, 20, 20, 30, 40):
+            history.append(timestamp, 100, 100)
+
+        assert [event[0] for event in history.iter_between(20, 40)] == [30, 20, 20]
+        assert [event[0] for event in history.iter_between(start=35)] == [40]
+        assert list(history.iter_between(50)) == []
+
+    def test_withdrawn_between_ignores_deposits_and_fees(self):
+        history = AccountHistory()
+        history.append(10, -2000, 8000)
+        history.append(20, 5000, 13000)
+        history.append(30, -4000, 9000)
+        history.append(30, -500, 8500, FEE)
+        history.append(40, -6000, 2500)
+
+        assert history.withdrawn_between() == 12000
+        assert history.withdrawn_between(15, 40) == 4000
+        assert history.withdrawn_between(41) == 0
+
+    def test_clock_going_backwards_keeps_timestamps_sorted(self):
+        history = AccountHistory()
+        history.append(100, 100, 100)
+        history.append(90, 100, 200)
+
+        assert list(history.timestamps) == [100, 100]
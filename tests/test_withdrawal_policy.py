@@ -0,0 +1,33 @@
+from services.withdrawal_policy import Rule, WithdrawalPolicy
+
+
+class TestWithdrawalPolicy:
+
+    def test_table_has_a_decision_per_combination_of_facts(self):
+        policy = WithdrawalPolicy()
+
+        assert [decision.outcome for decision in policy.table] == \
+            ['dispensed', 'overdraft', 'partial', 'partial_overdraft']
+        assert policy.decide(partial=False, overdraws=False).fee == 0
+        assert policy.decide(partial=True, overdraws=True).fee_cents == 500
+
+    def test_messages(self):
+        policy = WithdrawalPolicy()
+
+        assert policy.decide(False, False).message.format(amount=80, balance=20) == \
+            'Amount dispensed: $80. \n Current balance: $20.'
+        assert policy.decide(True, True).message.format(amount=40, balance=-15.0) == \
+            'Unable to dispense full amount requested at this time. \n' \
+            'Amount dispensed: $40. \n You have been charged an overdraft fee of $5. Current balance: $-15.0.'
+
+    def test_later_rules_override_earlier_ones(self):
+        policy = WithdrawalPolicy([
+            Rule(outcome='dispensed'),
+            Rule({'overdraws': True}, outcome='overdraft', fee=5.00, fee_name='Overdraft'),
+            Rule({'partial': True, 'overdraws': True}, fee=2.50)
+        ])
+
+        assert policy.decide(False, True).fee == 5.00
+        assert policy.decide(True, True).fee == 2.50
+        assert policy.decide(True, True).outcome == 'overdraft'
+        assert policy.decide(True, False).fee_name is None